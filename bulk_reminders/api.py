@@ -1,39 +1,141 @@
 from __future__ import print_function
 
 import datetime
+import functools
+import json
 import logging
 import os.path
 import re
-from typing import Any, Iterator, List, Optional, Tuple, Union
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Container, Dict, Iterable, Iterator, List, Optional, Set, TYPE_CHECKING, Tuple, Union
 
-from PyQt5 import QtGui
-from PyQt5.QtWidgets import QTableWidget, QTableWidgetItem
 from dateutil.parser import isoparse
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import Resource, build
-from tzlocal import get_localzone
+from googleapiclient.errors import HttpError
+
+if TYPE_CHECKING:
+    # The auth libraries, the HTTP transport and the discovery module are slow to import and are loaded when first needed
+    from google.oauth2.credentials import Credentials
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient.discovery import Resource
+    from googleapiclient.http import HttpRequest
+
+    from bulk_reminders.cache import LocalCache
 
 # If modifying these scopes, delete the file token.json.
-from bulk_reminders import undo
+from bulk_reminders import metrics, undo
+from bulk_reminders.ratelimit import RequestScheduler, is_retryable
+from bulk_reminders.store import EventStore, local_zone
 from bulk_reminders.undo import IDPair
 
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 TIME_REGEX = re.compile(r'\d{2}:\d{2}(?:AM|PM)')
 DATE_FORMAT = '%Y-%m-%d'
-DATETIME_FORMAT = DATE_FORMAT + '%H:%M%p'
+DATETIME_FORMAT = DATE_FORMAT + '%I:%M%p'  # 12-hour clock, %p is ignored unless the hour is parsed with %I
+PAGE_SIZE = 2500  # The largest page the Events API will return
+BATCH_SIZE = 50  # The Calendar API rejects batches with more than 50 calls
+DISCOVERY_CACHE = 'calendar-v3.json'
+USER_AGENT = 'bulk-reminders (gzip)'  # Google only compresses responses for user agents containing "gzip"
+
+# Partial response masks: only the fields the application reads are transferred
+CALENDAR_LIST_FIELDS = 'etag,nextPageToken,items(id,summary,primary)'
+EVENT_FIELDS = 'id,status,summary,description,start,end,recurrence,recurringEventId,etag,updated'
+EVENT_LIST_FIELDS = f'nextPageToken,nextSyncToken,items({EVENT_FIELDS})'
+INSERT_FIELDS = 'id'
+GET_FIELDS = 'id,status'
 
 logger = logging.getLogger(__file__)
 logger.setLevel(logging.DEBUG)
 
 
+def rfc3339(value: Optional[datetime.datetime]) -> Optional[str]:
+    """Formats a datetime for the API's timeMin/timeMax parameters. Naive datetimes are assumed to be in UTC."""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value.isoformat()
+
+
+@functools.lru_cache(maxsize=None)
+def timezone_name() -> str:
+    """The IANA name of the local timezone, which the API requires for recurring events."""
+    zone = local_zone()
+    return getattr(zone, 'key', None) or getattr(zone, 'zone', None) or str(zone)
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_time(text: str, format: str) -> datetime.datetime:
+    """strptime, memoized. Inputs tend to repeat the same days, whose events then share a single immutable object."""
+    return datetime.datetime.strptime(text, format)
+
+
+@functools.lru_cache(maxsize=4096)
+def day_after(value: datetime.datetime) -> datetime.datetime:
+    return value + datetime.timedelta(hours=24)
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_api_value(text: str, date: bool) -> Union[datetime.date, datetime.datetime]:
+    """Parses the date or dateTime of an API 'start' or 'end' field, memoized like parse_time()."""
+    return isoparse(text).date() if date else isoparse(text)
+
+
+def endpoint(request: 'HttpRequest') -> str:
+    """The name of the API method a request calls, e.g. calendar.events.insert"""
+    return getattr(request, 'methodId', None) or 'unknown'
+
+
+def measure(request: 'HttpRequest', info: dict) -> 'HttpRequest':
+    """Records the status and size of the request's response into info once it is received successfully."""
+    postproc = getattr(request, 'postproc', None)
+    if postproc is not None:
+        def measured(resp: Any, content: bytes) -> Any:
+            info['status'], info['received'] = resp.status, len(content or b'')
+            return postproc(resp, content)
+
+        request.postproc = measured
+    return request
+
+
 class Calendar(object):
     TOKEN_FILE = 'token.json'
 
     def __init__(self) -> None:
-        self.credentials: Optional[Credentials] = None
-        self.service: Optional[Resource] = None
+        self.credentials: Optional['Credentials'] = None
+        self.service: Optional['Resource'] = None
+        self._events: Optional[Tuple['Resource', 'Resource']] = None
+        self.stores: Dict[str, EventStore] = {}
+        self.cache: Optional['LocalCache'] = None  # Persists the calendar list and event stores between runs, if set
+        self.scheduler = RequestScheduler()
+        self.metrics = metrics.registry
+        self.partial = True  # Whether requests send field masks, only switched off to benchmark full responses
+        self._local = threading.local()
+
+    @property
+    def http(self) -> 'AuthorizedHttp':
+        """An authorized HTTP object for the calling thread. httplib2 connections cannot be shared between threads."""
+        if getattr(self._local, 'http', None) is None:
+            import httplib2
+            from google_auth_httplib2 import AuthorizedHttp
+            from googleapiclient.http import set_user_agent
+            # Single requests already ask for gzip, this makes sure batch responses are compressed as well
+            self._local.http = AuthorizedHttp(self.credentials, http=set_user_agent(httplib2.Http(), USER_AGENT))
+        return self._local.http
+
+    def mask(self, fields: str) -> Optional[str]:
+        """The fields parameter for a request, None (every field) if field masks are switched off."""
+        return fields if self.partial else None
+
+    @property
+    def events(self) -> 'Resource':
+        """The service's events collection. Creating it builds every method from the discovery document, so it is
+        only created once per service rather than for every request."""
+        if self._events is None or self._events[0] is not self.service:
+            self._events = (self.service, self.service.events())
+        return self._events[1]
 
     def save_token(self) -> None:
         """Store the credentials for later use."""
@@ -45,10 +147,12 @@ class Calendar(object):
         """Attempt to login using the tokens stored in token.json"""
         logger.info('Attempting to authenticate via token')
         if os.path.exists(Calendar.TOKEN_FILE):
+            from google.oauth2.credentials import Credentials
             self.credentials = Credentials.from_authorized_user_file('token.json', SCOPES)
             if self.credentials and self.credentials.expired and self.credentials.refresh_token:
                 try:
                     logger.info('Refreshing token')
+                    from google.auth.transport.requests import Request
                     self.credentials.refresh(Request())
                 except BaseException as e:
                     logger.error('Failed to refresh token', exc_info=e)
@@ -62,6 +166,7 @@ class Calendar(object):
     def authenticate_via_oauth(self) -> bool:
         """Attempt to acquire credentials"""
         try:
+            from google_auth_oauthlib.flow import InstalledAppFlow
             flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
             self.credentials = flow.run_local_server(port=0)
         except BaseException as e:
@@ -71,23 +176,141 @@ class Calendar(object):
             self.save_token()
             return True
 
-    def setupService(self) -> None:
-        """Setup the Google App Engine API Service for the Calendar API"""
+    def setupService(self, rootUrl: Optional[str] = None) -> None:
+        """Setup the Google App Engine API Service for the Calendar API
+
+        A root URL other than https://www.googleapis.com/ points the service at another server implementing the same
+        API, like the local fake server used by the benchmarks."""
         logger.debug('Initializing Calendar API Service')
-        self.service = build('calendar', 'v3', credentials=self.credentials)
+        from googleapiclient.discovery import build, build_from_document
 
-    def getCalendars(self) -> Iterator[Any]:
-        """Retrieve all calendar data"""
-        logger.debug('Retrieving all calendar data')
+        document = Calendar.load_discovery_document()
+        if rootUrl is not None:
+            if document is None:
+                raise RuntimeError('A discovery document is required to use a different root URL')
+            description = json.loads(document)
+            description['rootUrl'] = rootUrl
+            document = json.dumps(description)
+        if document is not None:
+            self.service = build_from_document(document, credentials=self.credentials)
+            return
+
+        logger.info('No discovery document available, fetching it from the API')
+        self.service = build('calendar', 'v3', credentials=self.credentials, static_discovery=False)
+        try:
+            with open(DISCOVERY_CACHE, 'w') as file:
+                json.dump(self.service._rootDesc, file)
+        except OSError as e:
+            logger.warning('Failed to cache the discovery document', exc_info=e)
+
+    @staticmethod
+    def load_discovery_document() -> Optional[str]:
+        """Loads the Calendar API discovery document from the local cache, or the copy packaged with the API client."""
+        if os.path.exists(DISCOVERY_CACHE):
+            with open(DISCOVERY_CACHE, 'r') as file:
+                return file.read()
+
+        try:
+            from googleapiclient.discovery_cache import get_static_doc
+        except ImportError:
+            return None
+        return get_static_doc('calendar', 'v3')
+
+    def execute(self, request: 'HttpRequest') -> Any:
+        """Executes a single request through the shared rate limiter, retrying it if it gets throttled."""
+        info = {'attempts': 0}
+
+        def run() -> Any:
+            info['attempts'] += 1
+            return request.execute(http=self.http)
+
+        measure(request, info)
+        started = time.perf_counter()
+        try:
+            return self.scheduler.execute(run)
+        except HttpError as e:
+            info['status'] = e.resp.status
+            raise
+        finally:
+            self.metrics.record(endpoint(request), info.get('status', 0), time.perf_counter() - started,
+                                len(getattr(request, 'body', None) or ''), info.get('received', 0), info['attempts'] - 1)
+
+    def executeBatch(self, requests: List[Callable[[], 'HttpRequest']]) -> List[Tuple[Optional[Any], Optional[HttpError]]]:
+        """Executes requests as a single batch, returning the response and exception of each one in order.
+
+        Requests are given as functions creating them, so sub-requests that were throttled can be re-created and
+        re-queued into a new batch after backing off."""
+        results: List[Optional[Tuple[Optional[Any], Optional[HttpError]]]] = [None] * len(requests)
+        pending = list(range(len(requests)))
+        attempt = 0
+        started = time.perf_counter()
+        while True:
+            responses = {}
+            infos = {index: {} for index in pending}
+
+            def callback(request_id: str, response: Optional[Any], exception: Optional[HttpError]) -> None:
+                responses[int(request_id)] = (response, exception)
+
+            batch = self.service.new_batch_http_request(callback=callback)
+            sent = 0
+            for index in pending:
+                request = measure(requests[index](), infos[index])
+                infos[index]['endpoint'], infos[index]['sent'] = endpoint(request), len(getattr(request, 'body', None) or '')
+                sent += infos[index]['sent']
+                batch.add(request, request_id=str(index))
+
+            batchStarted, status = time.perf_counter(), 0
+            try:
+                self.scheduler.execute(lambda: batch.execute(http=self.http), cost=len(pending), report=False)
+                status = 200
+            except HttpError as e:
+                status = e.resp.status
+                raise
+            finally:
+                self.metrics.record('batch', status, time.perf_counter() - batchStarted, sent,
+                                    sum(info.get('received', 0) for info in infos.values()))
+
+            retry = []
+            for index in pending:
+                response, exception = responses.get(index, (None, None))
+                if exception is not None and is_retryable(exception) and attempt < self.scheduler.maxRetries:
+                    retry.append(index)
+                else:
+                    results[index] = (response, exception)
+                    info = infos[index]
+                    self.metrics.record(info['endpoint'], exception.resp.status if exception is not None else info.get('status', 0),
+                                        time.perf_counter() - started, info['sent'], info.get('received', 0), attempt)
+            self.scheduler.succeeded(len(pending) - len(retry))
+            if len(retry) == 0:
+                return results
+
+            # Sub-requests throttled again after re-queueing are part of the same overload, so only the first slows down.
+            # The scheduler's emptied token bucket paces the re-queued batch, so there is no need to sleep here as well.
+            if attempt == 0:
+                self.scheduler.throttled(burst=len(pending) - len(retry))
+            else:
+                self.scheduler.bucket.drain()
+            attempt += 1
+            logger.info(f'Re-queueing {len(retry)} throttled requests')
+            pending = retry
+
+    def listCalendarPages(self, etag: Optional[str] = None) -> Iterator[dict]:
+        """Pages through the calendars that can be written to, yielding every raw response from the API.
+
+        If an ETag is given, the first request is conditional and raises an HttpError with status 304 if the list
+        has not changed since."""
         page, page_token = 1, None
         while True:
-            calendar_list = self.service.calendarList().list(pageToken=page_token, minAccessRole='writer').execute()
-            for entry in calendar_list['items']:
+            request = self.service.calendarList().list(pageToken=page_token, minAccessRole='writer',
+                                                       fields=self.mask(CALENDAR_LIST_FIELDS))
+            if etag is not None and page_token is None:
+                request.headers['If-None-Match'] = etag
+            calendar_list = self.execute(request)
+            for entry in calendar_list.get('items', []):
                 # Referencing the primary calendar should be done with the ID 'primary'
                 if entry.get('primary', False):
                     entry['id'] = 'primary'
-
-                yield entry
+            yield calendar_list
 
             # Continue loading more calendars
             page += 1
@@ -97,14 +320,264 @@ class Calendar(object):
 
             logger.debug(f'Retrieving page {page} of Calendars')
 
-    def getEvents(self, calendarID: str) -> List[Any]:
-        """Retrieves up to 2500 events for a given calendar ordered by occurrence that happen in the future."""
+    def getCalendars(self) -> Iterator[Any]:
+        """Retrieve all calendar data"""
+        logger.debug('Retrieving all calendar data')
+        for calendar_list in self.listCalendarPages():
+            yield from calendar_list.get('items', [])
+
+    def revalidateCalendars(self) -> Optional[List[Tuple[str, str]]]:
+        """Fetches the simplified calendar list unless the cached copy is still current, updating the cache.
+
+        Returns None if the cached list has not changed."""
+        etag = self.cache.calendarsETag() if self.cache is not None else None
+        try:
+            pages = list(self.listCalendarPages(etag))
+        except HttpError as e:
+            if e.resp.status != 304:
+                raise
+            logger.debug('Cached calendar list is up to date')
+            return None
+
+        calendars = [(entry['id'], entry['summary']) for page in pages for entry in page.get('items', [])]
+        if self.cache is not None:
+            self.cache.saveCalendars(calendars, pages[0].get('etag'))
+        return calendars
+
+    def listEventPages(self, calendarID: str, **params) -> Iterator[dict]:
+        """Pages through the events of a calendar, yielding every raw response from the API. Unless other fields are
+        requested, events only hold the fields the application reads."""
+        params.setdefault('fields', self.mask(EVENT_LIST_FIELDS))
+        page, page_token = 1, None
+        while True:
+            response = self.execute(self.events.list(calendarId=calendarID, pageToken=page_token, **params))
+            yield response
+
+            page_token = response.get('nextPageToken')
+            if page_token is None:
+                break
+
+            page += 1
+            logger.debug(f'Retrieving page {page} of Events from Calendar {calendarID}')
+
+    def getEventPages(self, calendarID: str, timeMin: Optional[datetime.datetime] = None, timeMax: Optional[datetime.datetime] = None,
+                      pageSize: int = PAGE_SIZE) -> Iterator[List[Any]]:
+        """Retrieves events ordered by occurrence one page at a time. Without a time window, only events that happen in the future are retrieved."""
         logger.debug(f'Retrieving all events from Calendar {calendarID}')
-        now = datetime.datetime.utcnow().isoformat() + 'Z'  # 'Z' indicates UTC time
-        events = self.service.events().list(calendarId=calendarID, timeMin=now,
-                                            maxResults=2500, singleEvents=True,
-                                            orderBy='startTime').execute()
-        return events.get('items', [])
+        if timeMin is None and timeMax is None:
+            timeMin = datetime.datetime.now(datetime.timezone.utc)
+        for response in self.listEventPages(calendarID, timeMin=rfc3339(timeMin), timeMax=rfc3339(timeMax),
+                                            maxResults=pageSize, singleEvents=True, orderBy='startTime'):
+            yield response.get('items', [])
+
+    def getEvents(self, calendarID: str, timeMin: Optional[datetime.datetime] = None,
+                  timeMax: Optional[datetime.datetime] = None) -> Iterator[Any]:
+        """Retrieves all events for a given calendar ordered by occurrence, only keeping one page in memory at a time."""
+        for page in self.getEventPages(calendarID, timeMin=timeMin, timeMax=timeMax):
+            yield from page
+
+    def exportEventPages(self, calendarID: str, fields: Iterable[str], timeMin: Optional[datetime.datetime] = None,
+                         timeMax: Optional[datetime.datetime] = None, expand: bool = False) -> Iterator[List[Any]]:
+        """Retrieves every event of a calendar, past ones included, one page at a time and with only the given fields.
+
+        Recurring events are retrieved once with their recurrence rules, unless they are expanded into every
+        occurrence, which are then ordered by occurrence."""
+        logger.debug(f'Exporting events from Calendar {calendarID}')
+        params = dict(timeMin=rfc3339(timeMin), timeMax=rfc3339(timeMax), maxResults=PAGE_SIZE, singleEvents=expand,
+                      fields=f'nextPageToken,items({",".join(fields)})')
+        if expand:
+            params['orderBy'] = 'startTime'
+        for response in self.listEventPages(calendarID, **params):
+            yield response.get('items', [])
+
+    def syncEvents(self, calendarID: str) -> Iterator[List[Any]]:
+        """Brings the local store for a calendar up to date, yielding the changed events of every page as it is applied.
+
+        The first call downloads every event, later calls only fetch the changes since the last sync. Once done, the
+        store's upcoming() events are current."""
+        store = self.getStore(calendarID)
+        with store.lock:
+            try:
+                yield from self._sync(store)
+            except HttpError as e:
+                if e.resp.status != 410:
+                    raise
+                # The sync token is no longer valid, the store has to be rebuilt from scratch
+                logger.info(f'Sync token for Calendar {calendarID} expired, performing a full sync')
+                store.syncToken = None
+                yield from self._sync(store)
+            if self.cache is not None:
+                self.cache.saveStore(store)
+
+    def getStore(self, calendarID: str) -> EventStore:
+        """The local store for a calendar, restored from the cache the first time if possible."""
+        store = self.stores.get(calendarID)
+        if store is None:
+            store = self.cache.loadStore(calendarID) if self.cache is not None else None
+            store = self.stores.setdefault(calendarID, store if store is not None else EventStore(calendarID))
+        return store
+
+    def windowEvents(self, calendarID: str, timeMin: datetime.datetime,
+                     timeMax: datetime.datetime) -> Optional[Tuple[List[Any], Optional[datetime.datetime]]]:
+        """The stored events overlapping a time window ordered by occurrence, along with the start of the last stored
+        event, without contacting the API.
+
+        Returns None if the calendar was not fully synced yet or is being synced right now."""
+        store = self.stores.get(calendarID)
+        if store is None or not store.lock.acquire(blocking=False):
+            return None
+        try:
+            if store.syncToken is None:
+                return None
+            return store.between(timeMin, timeMax), store.latest()
+        finally:
+            store.lock.release()
+
+    def getEventWindow(self, calendarID: str, timeMin: datetime.datetime, timeMax: datetime.datetime) -> List[Any]:
+        """Retrieves the events overlapping a time window from the API, ordered by occurrence."""
+        return list(self.getEvents(calendarID, timeMin=timeMin, timeMax=timeMax))
+
+    def allEvents(self, calendarID: str) -> List[Any]:
+        """Brings the local store for a calendar up to date and returns every event in it, including past ones."""
+        for _ in self.syncEvents(calendarID):
+            pass
+        store = self.stores[calendarID]
+        with store.lock:
+            return list(store.events.values())
+
+    def _sync(self, store: EventStore) -> Iterator[List[Any]]:
+        """Pages through all changes since the store's sync token (or all events) and applies them, yielding each page."""
+        full = store.syncToken is None
+        if full:
+            logger.debug(f'Fully syncing Calendar {store.calendarID}')
+            store.clear()
+        else:
+            logger.debug(f'Incrementally syncing Calendar {store.calendarID}')
+
+        changes = 0
+        for response in self.listEventPages(store.calendarID, syncToken=store.syncToken,
+                                            maxResults=PAGE_SIZE, singleEvents=True):
+            items = response.get('items', [])
+            changes += store.apply(items)
+            if 'nextPageToken' not in response:
+                store.syncToken = response.get('nextSyncToken')
+                logger.debug(f'Applied {changes} changes to Calendar {store.calendarID} ({len(store)} events stored)')
+            yield items
+
+    def insertEvents(self, calendarID: str, events: List['Event']) -> Iterator[List[Tuple['Event', Optional[dict], Optional[HttpError]]]]:
+        """Inserts events using batch requests. Yields the event, API response and exception (if any) of every sub-request, one batch at a time.
+
+        Events that already have an ID are inserted idempotently: a 409 Conflict means the event exists and counts as a success."""
+        for offset in range(0, len(events), BATCH_SIZE):
+            chunk = events[offset:offset + BATCH_SIZE]
+            logger.debug(f'Submitting batch of {len(chunk)} events ({offset + len(chunk)}/{len(events)})')
+            results = self.executeBatch([
+                lambda event=event: self.events.insert(calendarId=calendarID, body=event.body, fields=self.mask(INSERT_FIELDS))
+                for event in chunk
+            ])
+
+            completed = []
+            for event, (response, exception) in zip(chunk, results):
+                if exception is not None and event.eventID is not None and exception.resp.status == 409:
+                    # The event was created by an earlier attempt that never got to record the result
+                    logger.debug(f'Event {event.eventID} already exists')
+                    response, exception = {'id': event.eventID}, None
+                if exception is not None:
+                    logger.error(f'Failed to insert Event "{event.summary}"', exc_info=exception)
+                completed.append((event, response, exception))
+            yield completed
+
+    def patchEvents(self, calendarID: str, changes: List[Tuple['Event', dict]]) -> Iterator[List[Tuple['Event', Optional[dict], Optional[HttpError]]]]:
+        """Updates existing events to match the paired events using batched patch requests, one batch at a time."""
+        for offset in range(0, len(changes), BATCH_SIZE):
+            chunk = changes[offset:offset + BATCH_SIZE]
+            logger.debug(f'Patching batch of {len(chunk)} events ({offset + len(chunk)}/{len(changes)})')
+            results = self.executeBatch([
+                lambda event=event, item=item: self.events.patch(calendarId=calendarID, eventId=item['id'], body=event.patch(item),
+                                                                 fields=self.mask(INSERT_FIELDS))
+                for event, item in chunk
+            ])
+
+            completed = []
+            for (event, item), (response, exception) in zip(chunk, results):
+                if exception is not None:
+                    logger.error(f'Failed to patch Event "{event.summary}"', exc_info=exception)
+                else:
+                    event.eventID = item['id']
+                completed.append((event, response, exception))
+            yield completed
+
+    def deleteEvents(self, pairs: List[IDPair]) -> Iterator[List[Tuple[IDPair, Optional[HttpError]]]]:
+        """Deletes the events referenced by each IDPair using batch requests, several batches at a time. Yields the pair
+        and exception (if any) of every sub-request, one batch at a time as they complete.
+
+        Events that are already gone (404 Not Found or 410 Gone) count as deleted, so a rollback can always be repeated."""
+        chunks = [pairs[offset:offset + BATCH_SIZE] for offset in range(0, len(pairs), BATCH_SIZE)]
+        executor = ThreadPoolExecutor(max_workers=self.scheduler.maxConcurrency)
+        futures = [executor.submit(self._deleteBatch, chunk) for chunk in chunks]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # Stop sending batches once the caller is no longer interested (e.g. the undo was cancelled)
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def _deleteBatch(self, chunk: List[IDPair]) -> List[Tuple[IDPair, Optional[HttpError]]]:
+        logger.debug(f'Deleting batch of {len(chunk)} events')
+        results = self.executeBatch([
+            lambda pair=pair: self.events.delete(calendarId=pair.calendarID, eventId=pair.eventID) for pair in chunk
+        ])
+
+        completed = []
+        for pair, (response, exception) in zip(chunk, results):
+            if exception is not None and exception.resp.status in (404, 410):
+                logger.debug(f'Event {pair.eventID} was already deleted')
+                exception = None
+            if exception is not None:
+                logger.error(f'Failed to delete Event {pair.eventID}', exc_info=exception)
+            completed.append((pair, exception))
+        return completed
+
+    def missingEvents(self, calendarID: str, eventIDs: List[str]) -> Set[str]:
+        """Checks which of the given events no longer exist using batched get requests.
+
+        Events that are gone (404 Not Found or 410 Gone) or cancelled are missing. Events that could not be checked
+        for any other reason are assumed to still exist."""
+        missing = set()
+        for offset in range(0, len(eventIDs), BATCH_SIZE):
+            chunk = eventIDs[offset:offset + BATCH_SIZE]
+            results = self.executeBatch([
+                lambda eventID=eventID: self.events.get(calendarId=calendarID, eventId=eventID, fields=self.mask(GET_FIELDS)) for eventID in chunk
+            ])
+            for eventID, (response, exception) in zip(chunk, results):
+                if exception is not None:
+                    if exception.resp.status in (404, 410):
+                        missing.add(eventID)
+                    else:
+                        logger.warning(f'Could not check whether Event {eventID} exists: {exception}')
+                elif response.get('status') == 'cancelled':
+                    missing.add(eventID)
+        return missing
+
+    def getEventsByID(self, calendarID: str, eventIDs: Iterable[str]) -> List[dict]:
+        """Retrieves events by their IDs using batched get requests, e.g. the series of recurring events listed as
+        single occurrences. Events that are gone, cancelled or could not be retrieved are left out."""
+        eventIDs = list(eventIDs)
+        found = []
+        for offset in range(0, len(eventIDs), BATCH_SIZE):
+            chunk = eventIDs[offset:offset + BATCH_SIZE]
+            results = self.executeBatch([
+                lambda eventID=eventID: self.events.get(calendarId=calendarID, eventId=eventID, fields=self.mask(EVENT_FIELDS))
+                for eventID in chunk
+            ])
+            for eventID, (response, exception) in zip(chunk, results):
+                if exception is not None:
+                    logger.warning(f'Could not retrieve Event {eventID}: {exception}')
+                elif response.get('status') != 'cancelled':
+                    found.append(response)
+        return found
 
     def getCalendarsSimplified(self) -> List[Tuple[str, str]]:
         """Extracts the bare minimum required information from the Calendar."""
@@ -112,30 +585,83 @@ class Calendar(object):
 
 
 class Event(object):
+    """A single event, either parsed from input or listed by the API.
+
+    Apart from the status and ID, events are not changed once created, so their API payload and display strings
+    are only computed the first time they are needed."""
+    __slots__ = ('summary', 'start', 'end', 'description', 'status', 'eventID', 'recurrence', '_payload', '_display', '_title')
+
     def __init__(self, summary: str, start: Union[datetime.date, datetime.datetime], end: Union[datetime.date, datetime.datetime],
-                 description: Optional[str] = None, status: Optional[str] = None):
+                 description: Optional[str] = None, status: Optional[str] = None, eventID: Optional[str] = None,
+                 recurrence: Optional[List[str]] = None):
         if type(start) != type(end):
             raise Exception("Both start and end times need to be either simple dates or advanced datetime objects.")
         self.summary, self.start, self.end, self.description, self.status = summary, start, end, description, status
+        self.eventID = eventID
+        self.recurrence = recurrence  # RRULE and EXDATE lines, if this is a recurring event
+        self._payload: Optional[dict] = None
+        self._display: Optional[Tuple[str, str]] = None
+        self._title: Optional[str] = None
 
     @classmethod
-    def from_api(cls, event: dict, history: List[IDPair]) -> 'Event':
-        """Returns a Event object from a Google API Engine item."""
-        in_history = any(pair.eventID == event.get('id') for pair in history)
+    def from_api(cls, event: dict, undoableIDs: Container[str]) -> 'Event':
+        """Returns a Event object from a Google API Engine item. The IDs of undoable events should be given as a set.
+
+        Occurrences of a recurring event are undoable if their series is."""
+        in_history = event.get('recurringEventId', event.get('id')) in undoableIDs
         return Event(summary=event.get('summary'),
-                     start=isoparse(event['start'].get('dateTime', event['start'].get('date'))),
-                     end=isoparse(event['end'].get('dateTime', event['end'].get('date'))),
+                     start=Event.parse_api_time(event['start']),
+                     end=Event.parse_api_time(event['end']),
                      description=event.get('description'),
-                     status='Undoable' if in_history else 'Foreign')
+                     status='Undoable' if in_history else 'Foreign',
+                     eventID=event.get('id'),
+                     recurrence=event.get('recurrence'))
+
+    @staticmethod
+    def parse_api_time(field: dict) -> Union[datetime.date, datetime.datetime]:
+        """Parses the 'start' or 'end' field of an API event into a date (all-day events) or a datetime."""
+        if 'dateTime' in field:
+            return parse_api_value(field['dateTime'], False)
+        return parse_api_value(field['date'], True)
+
+    @property
+    def payload(self) -> dict:
+        """The body of the event without its ID. It is shared by every request for the event and must not be changed."""
+        if self._payload is None:
+            payload = {
+                'summary': self.summary,
+                'description': self.description,
+                'start': self.api_time(self.start),
+                'end': self.api_time(self.end)
+            }
+            if self.recurrence is not None:
+                payload['recurrence'] = self.recurrence
+            self._payload = payload
+        return self._payload
 
     @property
     def body(self) -> dict:
-        return {
-            'summary': self.summary,
-            'description': self.description,
-            'start': self.api_start,
-            'end': self.api_end
-        }
+        body = dict(self.payload)
+        if self.eventID is not None:
+            body['id'] = self.eventID
+        return body
+
+    def patch(self, item: dict) -> dict:
+        """The fields of the body that differ from an existing API event.
+
+        Patches merge into the existing start and end, so turning an all-day event into a timed one (or the reverse)
+        has to clear the date or time it had before."""
+        patch = {}
+        for key, value in self.payload.items():
+            if item.get(key) == value:
+                continue
+            if key in ('start', 'end'):
+                value = dict(value)
+                for kind in ('date', 'dateTime'):
+                    if kind in item.get(key, {}) and kind not in value:
+                        value[kind] = None
+            patch[key] = value
+        return patch
 
     @property
     def is_datetime(self) -> bool:
@@ -145,45 +671,59 @@ class Event(object):
     @property
     def api_start(self) -> dict:
         """Provides a proper object for the 'start' field in the body of a new event."""
-        if type(self.start) is datetime.date:
-            return {'date': self.start.strftime('%Y-%m-%d')}
-        elif type(self.start) is datetime.datetime:
-            return {'dateTime': self.start.astimezone(get_localzone()).isoformat()}
+        return self.payload['start']
 
     @property
     def api_end(self) -> dict:
         """Provides a proper object for the 'end' field in the body of a new event."""
-        if type(self.end) is datetime.date:
-            return {'date': self.end.strftime('%Y-%m-%d')}
-        elif type(self.end) is datetime.datetime:
-            return {'dateTime': self.end.astimezone(get_localzone()).isoformat()}
-
-    def fill_row(self, row: int, table: QTableWidget) -> None:
-        """Fills a specific row on a QTableWidget object with the information stored in the Event object."""
-        summaryItem = QTableWidgetItem(self.summary)
-        summaryItem.setForeground(QtGui.QColor("blue"))
-        table.setItem(row, 0, summaryItem)
-
-        formatString = '%b %d, %Y' if self.start is not None else '%b %d, %Y %I:%M %Z'
-        table.setItem(row, 1, QTableWidgetItem(self.status))
-        table.setItem(row, 2, QTableWidgetItem(self.start.strftime(formatString)))
-        table.setItem(row, 3, QTableWidgetItem(self.end.strftime(formatString)))
+        return self.payload['end']
+
+    def api_time(self, value: Union[datetime.date, datetime.datetime]) -> dict:
+        """Converts the start or end of the event into a 'start' or 'end' field for the API."""
+        if type(value) is datetime.date:
+            return {'date': value.strftime('%Y-%m-%d')}
+        if self.recurrence is not None:
+            # Recurring events are expanded in a named timezone, so they keep their local time across DST changes
+            return {'dateTime': value.astimezone(local_zone()).isoformat(), 'timeZone': timezone_name()}
+        return {'dateTime': value.astimezone(local_zone()).isoformat()}
+
+    def format(self, value: Union[datetime.date, datetime.datetime]) -> str:
+        """Formats the start or end of the event for display."""
+        return value.strftime('%b %d, %Y %I:%M %p' if self.is_datetime else '%b %d, %Y')
+
+    @property
+    def display(self) -> Tuple[str, str]:
+        """The start and end of the event formatted for display."""
+        if self._display is None:
+            self._display = self.format(self.start), self.format(self.end)
+        return self._display
+
+    @property
+    def title(self) -> str:
+        """The summary of the event for display, followed by a description of its recurrence if it has one."""
+        if self._title is None:
+            if self.recurrence is not None:
+                from bulk_reminders.recurrence import describe
+                self._title = f'{self.summary} ({describe(self.recurrence)})'
+            else:
+                self._title = self.summary
+        return self._title
 
     @classmethod
     def parse_raw(cls, input: Tuple[str]) -> 'Event':
         """Takes in input that has been separated by a RegEx expression into groups and creates a Event object"""
         first_time = input[2] is not None
-        start = datetime.datetime.strptime(input[1] + (input[2] if first_time else ''), DATETIME_FORMAT if first_time else DATE_FORMAT)
+        start = parse_time(input[1] + (input[2] if first_time else ''), DATETIME_FORMAT if first_time else DATE_FORMAT)
         if input[3] is not None:
             second_time = input[4] is not None
-            end = datetime.datetime.strptime(input[3] + (input[4] if second_time else ''), DATETIME_FORMAT if second_time else DATE_FORMAT)
+            end = parse_time(input[3] + (input[4] if second_time else ''), DATETIME_FORMAT if second_time else DATE_FORMAT)
         else:
             if first_time:
                 # But if a start time (hour & minute) was specified, make it end at the same time
                 end = start
             else:
                 # If no second date is specified and no first time is either, it simply ends the next day and lasts 24 hours
-                end = start + datetime.timedelta(hours=24)
+                end = day_after(start)
 
         return Event(
                 summary=input[0],
@@ -191,3 +731,16 @@ class Event(object):
                 end=end,
                 status='Ready'
         )
+
+
+def classify(readyEvents: List[Event], apiEvents: Iterable[dict], undoableIDs: Container[str]) -> Tuple[List[Event], Counter]:
+    """Labels every API event as Undoable or Foreign in a single pass, after the events that are ready to submit.
+
+    Returns the events to display and the number of events with each status."""
+    events = list(readyEvents)
+    counts = Counter(event.status for event in readyEvents)
+    for item in apiEvents:
+        event = Event.from_api(item, undoableIDs)
+        counts[event.status] += 1
+        events.append(event)
+    return events, counts
@@ -0,0 +1,234 @@
+"""Throughput and memory benchmarks against a local fake Calendar API server.
+
+Run with `python -m bulk_reminders.benchmark`; results are saved as JSON so runs can be compared with --baseline."""
+import argparse
+import datetime
+import gc
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from googleapiclient.errors import HttpError
+
+from bulk_reminders import api
+from bulk_reminders.checkpoint import Submission
+from bulk_reminders.fakeserver import FakeCalendarServer
+from bulk_reminders.parser import LineParser
+from bulk_reminders.ratelimit import RequestScheduler
+from bulk_reminders.undo import HistoryManager
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+SIZES = [10, 100, 1000, 10000, 100000]
+
+
+def generate_lines(count: int) -> List[str]:
+    """Input lines in every format the parser accepts, spread over future dates."""
+    start = datetime.date.today() + datetime.timedelta(days=1)
+    lines = []
+    for i in range(count):
+        date = (start + datetime.timedelta(days=i % 3650)).isoformat()
+        kind = i % 3
+        if kind == 0:
+            lines.append(f'Event {i} | {date}')
+        elif kind == 1:
+            lines.append(f'Event {i} | {date} {i % 12 + 1}:{i % 60:02d}PM')
+        else:
+            lines.append(f'Event {i} | {date} 9:00AM {date} 10:30AM')
+    return lines
+
+
+def timed(fn: Callable[[], Any]) -> Tuple[Any, float]:
+    """Run a function, returning its result and how many seconds it took."""
+    gc.collect()
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def retained(fn: Callable[[], Any]) -> Tuple[Any, int, int]:
+    """Run a function under tracemalloc, returning its result, the bytes it left allocated and its peak allocation."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = fn()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, current, peak
+
+
+def collect(batches: Iterator[list]) -> Tuple[List[list], Optional[str]]:
+    """Consume batches of results, returning those completed and the error a request failed with after every retry."""
+    completed = []
+    try:
+        for batch in batches:
+            completed.append(batch)
+    except HttpError as e:
+        logger.warning(f'Stage failed after retrying: {e}')
+        return completed, str(e)
+    return completed, None
+
+
+def rate(count: int, seconds: float) -> float:
+    return round(count / seconds, 1) if seconds > 0 else float('inf')
+
+
+def connect(server: FakeCalendarServer, requestRate: float) -> api.Calendar:
+    """A Calendar talking to the fake server, paced by a scheduler allowing the given request rate.
+
+    Retries use the application's default backoff, so runs against a rate limited or failing server stay comparable."""
+    from google.auth.credentials import AnonymousCredentials
+    calendar = api.Calendar()
+    calendar.credentials = AnonymousCredentials()
+    calendar.setupService(server.url)
+    calendar.scheduler = RequestScheduler(rate=requestRate, maxRate=requestRate, concurrency=8)
+    return calendar
+
+
+def run_size(size: int, args: argparse.Namespace, directory: str) -> Dict[str, Any]:
+    """Benchmark every stage of the application for one input size."""
+    result: Dict[str, Any] = {'size': size}
+    text = '\n'.join(generate_lines(size))
+
+    (events, errors), seconds = timed(lambda: LineParser(caching=False).parse_text(text))
+    _, memory, peak = retained(lambda: LineParser(caching=False).parse_text(text))
+    result['parse'] = {'seconds': seconds, 'eventsPerSecond': rate(size, seconds), 'errors': len(errors),
+                       'bytesPerEvent': memory // max(size, 1), 'peakBytes': peak}
+
+    with FakeCalendarServer(latency=args.latency, errorRate=args.error_rate, rateLimit=args.rate_limit, seed=size,
+                            bandwidth=args.bandwidth) as server:
+        calendar = connect(server, args.request_rate)
+        history = HistoryManager(os.path.join(directory, f'history-{size}.jsonl'))
+        submission = Submission('primary', history, file=os.path.join(directory, f'checkpoint-{size}.jsonl'))
+
+        # Events in batches that failed as a whole never come back, so they count as failed too
+        (batches, failure), seconds = timed(lambda: collect(submission.run(calendar, events)))
+        submitted = sum(1 for batch in batches for event, response, error in batch if error is None)
+        result['submit'] = {'seconds': seconds, 'eventsPerSecond': rate(size, seconds), 'failed': size - submitted,
+                            'error': failure, 'requests': server.stats['requests'], 'retries': calendar.scheduler.retries,
+                            'throttles': calendar.scheduler.throttles}
+
+        def populate() -> Tuple[float, List[dict]]:
+            first = None
+            started = time.perf_counter()
+            for _ in calendar.syncEvents('primary'):
+                if first is None:
+                    first = time.perf_counter() - started
+            store = calendar.getStore('primary')
+            with store.lock:
+                apiEvents = store.upcoming()
+            api.classify([], apiEvents, set(eventID for calendarID, eventID in history.index))
+            return first, apiEvents
+
+        try:
+            calendar.stores.clear()
+            (first, apiEvents), seconds = timed(populate)
+            calendar.stores.clear()
+            _, memory, peak = retained(populate)
+            result['populate'] = {'seconds': seconds, 'firstPageSeconds': first, 'events': len(apiEvents),
+                                  'bytesPerEvent': memory // max(len(apiEvents), 1), 'peakBytes': peak}
+
+            # Populate with full uncompressed responses, against field masks and gzip
+            transfer = {}
+            for name, partial in (('full', False), ('partial', True)):
+                calendar.partial = server.compress = partial
+                calendar.stores.clear()
+                sent = server.stats['bytesOut']
+                _, seconds = timed(populate)
+                transfer[name] = {'seconds': seconds, 'bytes': server.stats['bytesOut'] - sent}
+            transfer['ratio'] = round(transfer['full']['bytes'] / max(transfer['partial']['bytes'], 1), 1)
+            result['transfer'] = transfer
+        except HttpError as e:
+            logger.warning(f'Populating failed after retrying: {e}')
+            result.setdefault('populate', {'error': str(e)})
+
+        requests = server.stats['requests']
+        stages = history.select('primary')
+        pairs = sum(len(stage) for stage in stages)
+        (batches, failure), seconds = timed(lambda: collect(history.rollback(calendar, stages)))
+        deleted = sum(1 for batch in batches for pair, error in batch if error is None)
+        result['undo'] = {'seconds': seconds, 'eventsPerSecond': rate(pairs, seconds), 'failed': pairs - deleted,
+                          'error': failure, 'requests': server.stats['requests'] - requests}
+        history.close()
+    return result
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """Lines comparing the throughput of each stage with a baseline run."""
+    lines = []
+    previous = {entry['size']: entry for entry in baseline.get('results', [])}
+    for entry in results['results']:
+        old = previous.get(entry['size'])
+        if old is None:
+            continue
+        for stage in ('parse', 'submit', 'undo'):
+            new, before = entry[stage]['eventsPerSecond'], old.get(stage, {}).get('eventsPerSecond')
+            if before:
+                lines.append(f'{entry["size"]:>7} {stage:<8} {before:>12.1f} -> {new:>12.1f} events/s ({(new / before - 1) * 100:+.1f}%)')
+        new, before = entry['populate'].get('seconds'), old.get('populate', {}).get('seconds')
+        if new and before:
+            lines.append(f'{entry["size"]:>7} {"populate":<8} {before:>12.3f} -> {new:>12.3f} s ({(new / before - 1) * 100:+.1f}%)')
+        new, before = entry.get('transfer', {}).get('partial', {}).get('bytes'), old.get('transfer', {}).get('partial', {}).get('bytes')
+        if new and before:
+            lines.append(f'{entry["size"]:>7} {"transfer":<8} {before:>12} -> {new:>12} B ({(new / before - 1) * 100:+.1f}%)')
+    return lines
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m bulk_reminders.benchmark', description=__doc__.splitlines()[0])
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=SIZES, help='numbers of events to benchmark with')
+    parser.add_argument('-o', '--output', help='file to save the results to (default: benchmark-<timestamp>.json)')
+    parser.add_argument('-b', '--baseline', help='results of an earlier run to compare with')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the fake server delays every HTTP request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of calls failing with 503')
+    parser.add_argument('--bandwidth', type=float, help='bytes per second the fake server sends responses at (default: unlimited)')
+    parser.add_argument('--rate-limit', type=float, help='calls per second the fake server allows before returning 403')
+    parser.add_argument('--request-rate', type=float, default=100000.0, help='calls per second the client is paced to')
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    # Module loggers are always set to DEBUG, so the verbosity is controlled on the handler
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.WARNING)
+    logging.basicConfig(format='[%(asctime)s] [%(levelname)s] %(message)s', handlers=[handler])
+
+    results = {'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+               'python': sys.version.split()[0], 'platform': platform.platform(),
+               'server': {'latency': args.latency, 'errorRate': args.error_rate, 'rateLimit': args.rate_limit,
+                          'bandwidth': args.bandwidth},
+               'requestRate': args.request_rate, 'results': []}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            entry = run_size(size, args, directory)
+            results['results'].append(entry)
+            populate = entry['populate'].get('seconds')
+            print(f'{size:>7} events: parse {entry["parse"]["eventsPerSecond"]:.0f}/s, '
+                  f'submit {entry["submit"]["eventsPerSecond"]:.0f}/s ({entry["submit"]["failed"]} failed), '
+                  f'populate {f"{populate * 1000:.0f}ms" if populate is not None else "failed"} '
+                  f'({entry.get("transfer", {}).get("ratio", "?")}x fewer bytes than full responses), '
+                  f'undo {entry["undo"]["eventsPerSecond"]:.0f}/s ({entry["undo"]["failed"]} failed)', file=sys.stderr)
+
+    output = args.output or f'benchmark-{datetime.datetime.now().strftime("%Y%m%d-%H%M%S")}.json'
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f'Saved results to {output}', file=sys.stderr)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as file:
+            for line in compare(results, json.load(file)):
+                print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
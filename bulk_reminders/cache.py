@@ -0,0 +1,232 @@
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, List, Optional, Tuple
+
+from bulk_reminders.store import EventStore
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+CACHE_FILE = 'cache.sqlite3'
+SCHEMA_VERSION = 2
+MAX_EVENTS = 250000  # Events kept across all calendars before the least recently viewed calendars are evicted
+MAX_AGE = 30 * 24 * 60 * 60  # Seconds a calendar is kept after it was last viewed
+LRU_SIZE = 8  # Entries kept by an LRUCache by default
+LRU_TTL = 10 * 60  # Seconds an LRUCache entry is kept by default
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS calendars (id TEXT PRIMARY KEY, summary TEXT NOT NULL, position INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS stores (calendarID TEXT PRIMARY KEY, syncToken TEXT, synced REAL NOT NULL, viewed REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS events (calendarID TEXT NOT NULL, id TEXT NOT NULL, etag TEXT, updated TEXT,
+                                   startTime TEXT NOT NULL, endTime TEXT NOT NULL, data TEXT NOT NULL,
+                                   PRIMARY KEY (calendarID, id));
+CREATE INDEX IF NOT EXISTS eventsByStart ON events (calendarID, startTime);
+'''
+
+
+def sortable(value: datetime.datetime) -> str:
+    """Formats a timezone aware datetime as UTC text that sorts in chronological order."""
+    return value.astimezone(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+
+
+class LocalCache(object):
+    """An SQLite copy of the calendar list and of every calendar's events, so they can be shown before the API is
+    reached. Events are stored with their ETag and last update, along with the sync token to continue from.
+
+    The cache is only an optimization: if it cannot be read or written, errors are logged and it is treated as empty."""
+
+    def __init__(self, file: str = CACHE_FILE, maxEvents: int = MAX_EVENTS, maxAge: float = MAX_AGE) -> None:
+        self.file = file
+        self.maxEvents, self.maxAge = maxEvents, maxAge
+        self.lock = threading.Lock()  # The connection is shared by the GUI thread and the workers
+        self.connection: Optional[sqlite3.Connection] = None
+        try:
+            self.connection = self.open()
+        except sqlite3.DatabaseError as e:
+            logger.warning(f'Discarding unreadable cache {self.file}', exc_info=e)
+            os.remove(self.file)
+            self.connection = self.open()
+
+    def open(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.file, check_same_thread=False, isolation_level=None)
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            # The cache can always be rebuilt from the API, so older layouts are simply dropped
+            for table in ('meta', 'calendars', 'stores', 'events'):
+                connection.execute(f'DROP TABLE IF EXISTS {table}')
+            connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            connection.execute('VACUUM')
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.execute('PRAGMA synchronous = NORMAL')
+        connection.executescript(SCHEMA)
+        connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        return connection
+
+    def close(self) -> None:
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def loadCalendars(self) -> List[Tuple[str, str]]:
+        """The cached (ID, summary) of every calendar, in the order the API listed them."""
+        try:
+            with self.lock:
+                return list(self.connection.execute('SELECT id, summary FROM calendars ORDER BY position'))
+        except sqlite3.Error as e:
+            logger.warning('Failed to read cached calendars', exc_info=e)
+            return []
+
+    def calendarsETag(self) -> Optional[str]:
+        """The ETag of the cached calendar list, used to check whether it changed."""
+        try:
+            with self.lock:
+                row = self.connection.execute("SELECT value FROM meta WHERE key = 'calendarsETag'").fetchone()
+            return row[0] if row is not None else None
+        except sqlite3.Error as e:
+            logger.warning('Failed to read cached calendars', exc_info=e)
+            return None
+
+    def saveCalendars(self, calendars: List[Tuple[str, str]], etag: Optional[str]) -> None:
+        """Replace the cached calendar list."""
+        try:
+            with self.lock, self.connection:
+                self.connection.execute('BEGIN')
+                self.connection.execute('DELETE FROM calendars')
+                self.connection.executemany('INSERT INTO calendars (id, summary, position) VALUES (?, ?, ?)',
+                                            [(calendarID, summary, position) for position, (calendarID, summary) in enumerate(calendars)])
+                self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('calendarsETag', ?)", (etag,))
+        except sqlite3.Error as e:
+            logger.warning('Failed to cache calendars', exc_info=e)
+
+    def loadStore(self, calendarID: str) -> Optional[EventStore]:
+        """Restore a calendar's event store as it was last saved, or None if it isn't cached."""
+        try:
+            with self.lock:
+                row = self.connection.execute('SELECT syncToken FROM stores WHERE calendarID = ?', (calendarID,)).fetchone()
+                if row is None:
+                    return None
+                items = [json.loads(data) for data, in self.connection.execute('SELECT data FROM events WHERE calendarID = ?', (calendarID,))]
+                self.connection.execute('UPDATE stores SET viewed = ? WHERE calendarID = ?', (time.time(), calendarID))
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(f'Failed to read cached events of Calendar {calendarID}', exc_info=e)
+            return None
+
+        store = EventStore(calendarID)
+        store.apply(items)
+        store.syncToken = row[0]
+        store.unsaved()
+        # Deletions made while the application wasn't running were never seen, so the undo history is checked in full
+        store.resynced = True
+        logger.debug(f'Restored {len(store)} cached events of Calendar {calendarID}')
+        return store
+
+    def hasStore(self, calendarID: str) -> bool:
+        """Whether a calendar's events are cached."""
+        try:
+            with self.lock:
+                return self.connection.execute('SELECT 1 FROM stores WHERE calendarID = ?', (calendarID,)).fetchone() is not None
+        except sqlite3.Error as e:
+            logger.warning(f'Failed to read cached events of Calendar {calendarID}', exc_info=e)
+            return False
+
+    def loadWindow(self, calendarID: str, timeMin: datetime.datetime, timeMax: datetime.datetime) -> List[dict]:
+        """The cached events of a calendar overlapping a time window, ordered by occurrence. Unlike loadStore(), this
+        only reads the events that are needed."""
+        try:
+            with self.lock:
+                rows = self.connection.execute('SELECT data FROM events WHERE calendarID = ? AND startTime < ? AND endTime > ? '
+                                               'ORDER BY startTime', (calendarID, sortable(timeMax), sortable(timeMin))).fetchall()
+            return [json.loads(data) for data, in rows]
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(f'Failed to read cached events of Calendar {calendarID}', exc_info=e)
+            return []
+
+    def saveStore(self, store: EventStore) -> None:
+        """Write the events that changed since the store was last saved, then evict other calendars if the cache is
+        over its limits. Must be called with the store's lock held."""
+        wiped, dirty = store.unsaved()
+        now = time.time()
+        try:
+            with self.lock, self.connection:
+                self.connection.execute('BEGIN')
+                if wiped:
+                    self.connection.execute('DELETE FROM events WHERE calendarID = ?', (store.calendarID,))
+                changed = [store.events[eventID] for eventID in dirty if eventID in store.events]
+                self.connection.executemany('DELETE FROM events WHERE calendarID = ? AND id = ?',
+                                            [(store.calendarID, eventID) for eventID in dirty if eventID not in store.events])
+                self.connection.executemany('INSERT OR REPLACE INTO events (calendarID, id, etag, updated, startTime, endTime, data) '
+                                            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                            [(store.calendarID, item['id'], item.get('etag'), item.get('updated'),
+                                              sortable(store.starts[item['id']]), sortable(store.ends[item['id']]), json.dumps(item))
+                                             for item in changed])
+                self.connection.execute('INSERT OR REPLACE INTO stores (calendarID, syncToken, synced, viewed) VALUES (?, ?, ?, ?)',
+                                        (store.calendarID, store.syncToken, now, now))
+                self.evict(store.calendarID, now)
+        except sqlite3.Error as e:
+            logger.warning(f'Failed to cache events of Calendar {store.calendarID}', exc_info=e)
+            # Save everything the next time, rather than leaving the cache with some changes missing
+            store.wiped, store.dirty = True, set(store.events)
+            return
+        if wiped or len(dirty) > 0:
+            logger.debug(f'Cached {len(dirty)} changed events of Calendar {store.calendarID}')
+
+    def evict(self, keep: str, now: float) -> None:
+        """Remove calendars not viewed within the maximum age, then the least recently viewed ones until the cache
+        holds at most the maximum number of events. The given calendar is never evicted."""
+        rows = self.connection.execute('SELECT stores.calendarID, viewed, COUNT(events.id) FROM stores '
+                                       'LEFT JOIN events ON events.calendarID = stores.calendarID '
+                                       'GROUP BY stores.calendarID ORDER BY viewed').fetchall()
+        total = sum(count for calendarID, viewed, count in rows)
+        evicted = []
+        for calendarID, viewed, count in rows:
+            if calendarID != keep and (viewed < now - self.maxAge or total > self.maxEvents):
+                evicted.append(calendarID)
+                total -= count
+        for calendarID in evicted:
+            self.connection.execute('DELETE FROM events WHERE calendarID = ?', (calendarID,))
+            self.connection.execute('DELETE FROM stores WHERE calendarID = ?', (calendarID,))
+        if len(evicted) > 0:
+            logger.info(f'Evicted {len(evicted)} calendars from the cache')
+            self.connection.execute('PRAGMA incremental_vacuum')
+
+
+class LRUCache(object):
+    """A small in-memory cache that forgets the least recently used entries beyond its size, and entries that were
+    stored longer ago than its time to live. Not thread-safe."""
+
+    def __init__(self, maxSize: int = LRU_SIZE, ttl: float = LRU_TTL) -> None:
+        self.maxSize, self.ttl = maxSize, ttl
+        self.entries: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """The value stored for the key, or None if there is none or it expired."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        stored, value = entry
+        if time.monotonic() - stored > self.ttl:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self.entries[key] = (time.monotonic(), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        """Forget the value stored for the key, if any."""
+        self.entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self.entries)
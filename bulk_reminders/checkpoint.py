@@ -0,0 +1,197 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import uuid
+from collections import Counter
+from typing import Iterable, Iterator, List, Optional, Set, TextIO, Tuple
+
+from googleapiclient.errors import HttpError
+
+from bulk_reminders import api
+from bulk_reminders.api import Event
+from bulk_reminders.diff import EventIndex
+from bulk_reminders.undo import HistoryManager, IDPair, Stage
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+CHECKPOINT_FILE = 'checkpoint.jsonl'
+
+
+def event_id(nonce: str, calendarID: str, event: Event, occurrence: int = 0) -> str:
+    """A deterministic event ID for an event within a submission.
+
+    Hex digits are a subset of the base32hex alphabet the API allows for IDs. The occurrence keeps events that
+    appear more than once in the same submission from colliding."""
+    parts = [nonce, calendarID, event.summary, event.start.isoformat(), event.end.isoformat(), str(occurrence)]
+    if event.recurrence is not None:
+        parts.extend(event.recurrence)
+    key = '|'.join(parts)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class Submission(object):
+    """A bulk submission of events that can be resumed after it was interrupted.
+
+    Every event gets a deterministic ID before anything is sent, and the checkpoint file records the events and
+    which of them are done. Before each batch is sent, its events are added to the undo history. Resuming simply
+    sends every event that is not done again; events created by the interrupted batch come back as 409 Conflict,
+    which counts as a success."""
+
+    def __init__(self, calendarID: str, history: Optional[HistoryManager] = None, file: str = CHECKPOINT_FILE,
+                 nonce: Optional[str] = None) -> None:
+        self.calendarID = calendarID
+        self.history = history
+        self.file = file
+        self.nonce = nonce or uuid.uuid4().hex
+        self.stage: Optional[Stage] = None
+        self.pending: List[Event] = []
+        self.known: Set[str] = set()
+        self.occurrences: Counter = Counter()
+        self.started = False  # Whether the checkpoint file belongs to this submission yet
+        self._journal: Optional[TextIO] = None
+
+    @classmethod
+    def load(cls, history: Optional[HistoryManager] = None, file: str = CHECKPOINT_FILE) -> Optional['Submission']:
+        """Loads an interrupted submission from its checkpoint file. Returns None if there is nothing to resume."""
+        if not os.path.exists(file):
+            return None
+
+        events, done, submission = {}, set(), None
+        with open(file, 'r') as checkpoint:
+            for line in checkpoint:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning('Ignoring a corrupt record in the checkpoint file.')
+                    continue
+                if 'nonce' in record:
+                    submission = Submission(record['calendarID'], history, file, record['nonce'])
+                    submission.started = True
+                    if history is not None:
+                        submission.stage = next((stage for stage in history.stages if stage.index == record['stage']), None)
+                elif 'event' in record:
+                    events[record['event']['id']] = record['event']
+                elif 'done' in record:
+                    done.update(record['done'])
+
+        if submission is None:
+            return None
+        submission.known = set(events.keys())
+        submission.pending = [Event.from_api(body, ()) for eventID, body in events.items() if eventID not in done]
+        for event in submission.pending:
+            event.status = 'Ready'
+        logger.info(f'Found an interrupted submission with {len(submission.pending)} of {len(events)} events left')
+        return submission
+
+    def record(self, *records: dict) -> None:
+        """Durably append records to the checkpoint file, creating it first if needed."""
+        if self._journal is None:
+            if not self.started:
+                self.ensureStage()
+                header = {'nonce': self.nonce, 'calendarID': self.calendarID,
+                          'stage': self.stage.index if self.stage is not None else None}
+                # Write the header atomically, so a checkpoint file without one can never exist
+                with open(self.file + '.tmp', 'w') as file:
+                    file.write(json.dumps(header) + '\n')
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(self.file + '.tmp', self.file)
+                self.started = True
+            self._journal = open(self.file, 'a')
+
+        for record in records:
+            self._journal.write(json.dumps(record) + '\n')
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def ensureStage(self) -> None:
+        """Create the undo history stage this submission's events are recorded in."""
+        if self.history is not None and self.stage is None:
+            self.stage = Stage(self.history.nextIndex(), self.calendarID)
+            self.history.addStage(self.stage)
+
+    def assign(self, events: Iterable[Event]) -> None:
+        """Give each event its deterministic ID and record it in the checkpoint."""
+        records = []
+        for event in events:
+            if event.eventID is None:
+                base = event_id(self.nonce, self.calendarID, event)
+                event.eventID = event_id(self.nonce, self.calendarID, event, self.occurrences[base])
+                self.occurrences[base] += 1
+            if event.eventID not in self.known:
+                self.known.add(event.eventID)
+                records.append({'event': event.body})
+        if len(records) > 0:
+            self.record(*records)
+
+    def submit(self, calendar: 'api.Calendar', events: List[Event]) -> Iterator[List[Tuple[Event, Optional[dict], Optional[HttpError]]]]:
+        """Submits events one batch at a time, checkpointing before and after every batch. Nothing is recorded, not even
+        an undo stage, if there are no events."""
+        if len(events) == 0:
+            return
+        self.assign(events)
+        self.ensureStage()
+        # Only the bookkeeping is done under the lock, the GUI thread reads the history while batches are sent
+        lock = self.history.lock if self.history is not None else contextlib.nullcontext()
+        for offset in range(0, len(events), api.BATCH_SIZE):
+            chunk = events[offset:offset + api.BATCH_SIZE]
+            pairs = [IDPair(self.calendarID, event.eventID) for event in chunk]
+            eventIDs = [pair.eventID for pair in pairs]
+            with lock:
+                self.record({'sending': eventIDs})
+                if self.history is not None:
+                    self.history.addEvents(self.stage, [pair for pair in pairs if self.history.exists(pair) == -1])
+                    # Keeps the history from being pruned while the batch is only partly created
+                    self.history.sending(self.calendarID, eventIDs)
+
+            try:
+                results = [result for batch in calendar.insertEvents(self.calendarID, chunk) for result in batch]
+                failed = [IDPair(self.calendarID, event.eventID) for event, response, error in results if error is not None]
+                with lock:
+                    if self.history is not None and len(failed) > 0:
+                        self.history.removeEvents(failed)
+                    self.record({'done': [event.eventID for event, response, error in results if error is None]})
+            finally:
+                if self.history is not None:
+                    self.history.sent(self.calendarID, eventIDs)
+            yield results
+
+    def reconcile(self, calendar: 'api.Calendar', events: List[Event], index: EventIndex) -> Iterator[List[Tuple[Event, Optional[dict], Optional[HttpError]]]]:
+        """Compares events with those already on the calendar: unchanged events are skipped, changed events are
+        patched and only new events are inserted. Skipped and patched events are marked Unchanged or Updated."""
+        result = index.diff(events)
+        if len(result.unchanged) > 0:
+            for event, item in result.unchanged:
+                event.eventID, event.status = item['id'], 'Unchanged'
+            yield [(event, None, None) for event, item in result.unchanged]
+
+        for results in calendar.patchEvents(self.calendarID, result.changed):
+            for event, response, error in results:
+                if error is None:
+                    event.status = 'Updated'
+            yield results
+
+        yield from self.submit(calendar, result.new)
+
+    def run(self, calendar: 'api.Calendar', events: List[Event], index: Optional[EventIndex] = None) -> Iterator[List[Tuple[Event, Optional[dict], Optional[HttpError]]]]:
+        """Submits all events (comparing them with the index first, if given) and removes the checkpoint once every batch has been sent."""
+        if index is not None:
+            yield from self.reconcile(calendar, events, index)
+        else:
+            yield from self.submit(calendar, events)
+        self.finish()
+
+    def finish(self) -> None:
+        """The submission is complete, the checkpoint is no longer needed."""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if os.path.exists(self.file):
+            os.remove(self.file)
+
+    def discard(self) -> None:
+        """Forget an interrupted submission without resuming it."""
+        self.finish()
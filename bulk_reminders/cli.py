@@ -0,0 +1,268 @@
+"""Headless command line interface. Nothing in here may import PyQt5, directly or indirectly."""
+import argparse
+import contextlib
+import datetime
+import itertools
+import json
+import logging
+import sys
+from typing import Iterable, Iterator, List, Optional, TextIO
+
+from dateutil.parser import parse as parse_date
+
+from bulk_reminders import api, exporters, importers, metrics
+from bulk_reminders.api import Event
+from bulk_reminders.cache import CACHE_FILE, LocalCache
+from bulk_reminders.checkpoint import Submission
+from bulk_reminders.diff import EventIndex
+from bulk_reminders.metrics import profiled
+from bulk_reminders.parser import LineError
+from bulk_reminders.recurrence import compress, describe
+from bulk_reminders.store import local_zone
+from bulk_reminders.undo import HISTORY_FILE, HistoryManager
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+CHUNK_SIZE = api.BATCH_SIZE * 4  # Number of parsed events held in memory before they are submitted
+
+
+def chunked(events: Iterable[Event], size: int) -> Iterator[List[Event]]:
+    """Groups a stream of events into lists of at most the given size."""
+    iterator = iter(events)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if len(chunk) == 0:
+            break
+        yield chunk
+
+
+def connect() -> Optional[api.Calendar]:
+    """Authenticate and setup the Calendar API service, returning None if authentication failed."""
+    calendar = api.Calendar()
+    if not calendar.authenticate_via_token() and not calendar.authenticate_via_oauth():
+        print('Failed to authenticate with the Google Calendar API.', file=sys.stderr)
+        return None
+    calendar.setupService()
+    calendar.cache = LocalCache(CACHE_FILE)
+    return calendar
+
+
+def valid_events(results: Iterable, errors: List[LineError]) -> Iterator[Event]:
+    """Passes through parsed events, reporting and collecting invalid lines as they are found."""
+    for result in results:
+        if isinstance(result, LineError):
+            print(str(result), file=sys.stderr)
+            errors.append(result)
+        else:
+            yield result
+
+
+def run_import(args: argparse.Namespace) -> int:
+    file: TextIO = sys.stdin if args.file == '-' else importers.open_file(args.file)
+    importer = importers.IMPORTERS[args.format or importers.detect(args.file)]
+    errors: List[LineError] = []
+    submitted = failed = unchanged = updated = 0
+
+    with file:
+        events = valid_events(importer(file), errors)
+        if args.recurring:
+            # Finding series needs every event at once
+            events = iter(compress(list(events)))
+        if args.dry_run:
+            for event in events:
+                print(f'{event.summary} | {event.start.isoformat()} - {event.end.isoformat()}'
+                      + (f' | {describe(event.recurrence)}' if event.recurrence is not None else ''))
+                submitted += 1
+            print(f'{submitted} events parsed, {len(errors)} invalid lines.', file=sys.stderr)
+            return 1 if len(errors) > 0 else 0
+
+        calendar = connect()
+        if calendar is None:
+            return 2
+
+        history = HistoryManager(HISTORY_FILE)
+        submission = Submission.load(history)
+        if submission is not None and args.resume:
+            if submission.calendarID != args.calendar:
+                print(f'The interrupted submission was for Calendar {submission.calendarID}, use --calendar to select it.',
+                      file=sys.stderr)
+                return 2
+            print(f'Resuming an interrupted submission of {len(submission.pending)} events', file=sys.stderr)
+            chunks = itertools.chain([submission.pending], chunked(events, CHUNK_SIZE))
+        else:
+            if submission is not None:
+                print('Discarding an interrupted submission (use --resume to continue it)', file=sys.stderr)
+                # Otherwise the old checkpoint survives until the new submission records anything, which it may never do
+                submission.discard()
+            submission = Submission(args.calendar, history)
+            chunks = chunked(events, CHUNK_SIZE)
+
+        index = None
+        if not args.all:
+            patchable = history.eventIDs(args.calendar)
+            index = EventIndex.fetch(calendar, args.calendar, patchable)
+
+        for chunk in chunks:
+            batches = submission.reconcile(calendar, chunk, index) if index is not None else submission.submit(calendar, chunk)
+            for batch in batches:
+                for event, result, error in batch:
+                    if error is None and event.status == 'Unchanged':
+                        unchanged += 1
+                    elif error is None and event.status == 'Updated':
+                        updated += 1
+                    elif error is None:
+                        submitted += 1
+                    else:
+                        failed += 1
+                        print(f'Failed to submit "{event.summary}": {error}', file=sys.stderr)
+                if not args.quiet:
+                    print(f'{submitted} submitted, {updated} updated, {failed} failed', file=sys.stderr)
+        submission.finish()
+        history.close()
+
+    print(f'Submitted {submitted} events to Calendar {args.calendar} ({unchanged} unchanged, {updated} updated, '
+          f'{failed} failed, {len(errors)} invalid lines).', file=sys.stderr)
+    return 1 if failed > 0 or len(errors) > 0 else 0
+
+
+def run_undo(args: argparse.Namespace) -> int:
+    history = HistoryManager(HISTORY_FILE)
+    stages = history.select(args.calendar, None if args.all else args.count)
+    total = sum(len(stage) for stage in stages)
+    if len(stages) == 0:
+        print(f'Nothing to undo on Calendar {args.calendar}.', file=sys.stderr)
+        return 0
+
+    calendar = connect()
+    if calendar is None:
+        return 2
+
+    deleted = failed = 0
+    for results in history.rollback(calendar, stages):
+        for pair, error in results:
+            if error is None:
+                deleted += 1
+            else:
+                failed += 1
+                print(f'Failed to delete Event {pair.eventID}: {error}', file=sys.stderr)
+        if not args.quiet:
+            print(f'{deleted}/{total} deleted, {failed} failed', file=sys.stderr)
+    history.close()
+
+    print(f'Deleted {deleted} events in {len(stages)} submissions from Calendar {args.calendar} ({failed} failed).',
+          file=sys.stderr)
+    return 1 if failed > 0 else 0
+
+
+def parse_moment(text: str) -> datetime.datetime:
+    """Parses a --since or --until date and optional time, in the local timezone unless one is given."""
+    try:
+        value = parse_date(text)
+    except (ValueError, OverflowError):
+        raise argparse.ArgumentTypeError(f'invalid date "{text}"')
+    return value if value.tzinfo is not None else value.replace(tzinfo=local_zone())
+
+
+def run_export(args: argparse.Namespace) -> int:
+    fields = [field.strip() for field in args.fields.split(',') if field.strip()]
+    format = args.format or exporters.detect(args.file)
+    calendar = connect()
+    if calendar is None:
+        return 2
+
+    count = 0
+    # Standard output is left open for --metrics -
+    with open(args.file, 'w', encoding='utf-8', newline='') if args.file != '-' else contextlib.nullcontext(sys.stdout) as file:
+        pages = calendar.exportEventPages(args.calendar, exporters.requested_fields(fields), timeMin=args.since,
+                                          timeMax=args.until, expand=args.expand)
+        for count in exporters.export(file, format, pages, fields):
+            if not args.quiet:
+                print(f'{count} exported', file=sys.stderr)
+
+    print(f'Exported {count} events from Calendar {args.calendar}.', file=sys.stderr)
+    return 0
+
+
+def run_calendars(args: argparse.Namespace) -> int:
+    calendar = connect()
+    if calendar is None:
+        return 2
+    for calendarID, summary in calendar.getCalendarsSimplified():
+        print(f'{calendarID}\t{summary}')
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m bulk_reminders', description='Bulk import reminders into Google Calendar without a GUI.')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show debug logging')
+    parser.add_argument('--metrics', metavar='FILE',
+                        help='save API call metrics when done, as JSON if FILE ends in .json, otherwise in the Prometheus text format (- for stdout)')
+    parser.add_argument('--profile', metavar='FILE', help='capture a cProfile of the command into FILE')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = subparsers.add_parser('import', help='import events from a text, CSV or iCalendar file')
+    import_parser.add_argument('file', nargs='?', default='-', help='file to read events from (default: stdin)')
+    import_parser.add_argument('-f', '--format', choices=sorted(importers.IMPORTERS),
+                               help='format of the file: "Summary | date [time] [date [time]]" lines, CSV with a header '
+                                    '(e.g. Subject,Start Date,Start Time) or iCalendar (default: detected from the extension)')
+    import_parser.add_argument('-c', '--calendar', default='primary', help='ID of the calendar to submit to (default: primary)')
+    import_parser.add_argument('-n', '--dry-run', action='store_true', help='only parse and print the events')
+    import_parser.add_argument('-a', '--all', action='store_true',
+                               help='submit every event, even if an identical one is already on the calendar')
+    import_parser.add_argument('-R', '--recurring', action='store_true',
+                               help='combine events repeating at a fixed interval into single recurring events')
+    import_parser.add_argument('-r', '--resume', action='store_true', help='resume an interrupted submission before importing')
+    import_parser.add_argument('-q', '--quiet', action='store_true', help='do not print progress after every batch')
+    import_parser.set_defaults(func=run_import)
+
+    undo_parser = subparsers.add_parser('undo', help='delete the events of the latest submissions to a calendar')
+    undo_parser.add_argument('-c', '--calendar', default='primary', help='ID of the calendar to undo submissions on (default: primary)')
+    undo_parser.add_argument('-n', '--count', type=int, default=1, help='number of submissions to undo (default: 1)')
+    undo_parser.add_argument('-a', '--all', action='store_true', help='undo every submission to the calendar')
+    undo_parser.add_argument('-q', '--quiet', action='store_true', help='do not print progress after every batch')
+    undo_parser.set_defaults(func=run_undo)
+
+    export_parser = subparsers.add_parser('export', help='save the events of a calendar to an iCalendar, CSV or JSON lines file')
+    export_parser.add_argument('file', nargs='?', default='-', help='file to write events to (default: stdout)')
+    export_parser.add_argument('-c', '--calendar', default='primary', help='ID of the calendar to export (default: primary)')
+    export_parser.add_argument('-f', '--format', choices=sorted(exporters.EXPORTERS),
+                               help='format of the file (default: detected from the extension, otherwise jsonl)')
+    export_parser.add_argument('--since', type=parse_moment, help='only export events ending after this date and time')
+    export_parser.add_argument('--until', type=parse_moment, help='only export events starting before this date and time')
+    export_parser.add_argument('--fields', default=','.join(exporters.DEFAULT_FIELDS),
+                               help=f'comma separated event fields to export (default: {",".join(exporters.DEFAULT_FIELDS)})')
+    export_parser.add_argument('-e', '--expand', action='store_true',
+                               help='export every occurrence of recurring events instead of their recurrence rules')
+    export_parser.add_argument('-q', '--quiet', action='store_true', help='do not print progress after every page')
+    export_parser.set_defaults(func=run_export)
+
+    calendars_parser = subparsers.add_parser('calendars', help='list the IDs of calendars that can be written to')
+    calendars_parser.set_defaults(func=run_calendars)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    # Module loggers are always set to DEBUG, so the verbosity is controlled on the handler
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+    logging.basicConfig(format='[%(asctime)s] [%(levelname)s] %(message)s', handlers=[handler])
+    with profiled(args.profile):
+        code = args.func(args)
+    if args.metrics is not None:
+        export_metrics(args.metrics)
+    return code
+
+
+def export_metrics(path: str) -> None:
+    """Write the metrics of every API call made by this run to a file or stdout."""
+    if path.endswith('.json'):
+        text = json.dumps(metrics.registry.to_json(), indent=2)
+    else:
+        text = metrics.registry.to_prometheus()
+    if path == '-':
+        sys.stdout.write(text)
+    else:
+        with open(path, 'w') as file:
+            file.write(text)
@@ -0,0 +1,130 @@
+import datetime
+import itertools
+import logging
+from collections import defaultdict
+from typing import Container, Dict, Iterable, List, Optional, Set, TYPE_CHECKING, Tuple
+
+from dateutil.parser import isoparse
+
+from bulk_reminders.api import Event
+
+if TYPE_CHECKING:
+    from bulk_reminders import api
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+# The normalized summary, start, end and recurrence of an event
+EventKey = Tuple[str, str, str, str]
+
+
+def normalize_summary(summary: str) -> str:
+    return ' '.join((summary or '').split()).casefold()
+
+
+def normalize_time(field: dict) -> str:
+    """Normalizes an API 'start' or 'end' field so equal points in time compare equal regardless of their timezone."""
+    if 'dateTime' in field:
+        return isoparse(field['dateTime']).astimezone(datetime.timezone.utc).isoformat()
+    return field.get('date', '')
+
+
+def normalize_recurrence(lines: Optional[List[str]]) -> str:
+    """Normalizes RRULE and EXDATE lines so the same rules compare equal regardless of their order and case."""
+    return '\n'.join(sorted(line.strip().upper() for line in lines or ()))
+
+
+def api_key(item: dict) -> EventKey:
+    return (normalize_summary(item.get('summary')), normalize_time(item['start']), normalize_time(item['end']),
+            normalize_recurrence(item.get('recurrence')))
+
+
+def event_key(event: Event) -> EventKey:
+    return (normalize_summary(event.summary), normalize_time(event.api_start), normalize_time(event.api_end),
+            normalize_recurrence(event.recurrence))
+
+
+def series_ids(existing: List[dict]) -> Set[str]:
+    """The IDs of the recurring events that the given occurrences belong to, unless they were listed themselves."""
+    listed = {item['id'] for item in existing}
+    return {item['recurringEventId'] for item in existing if 'recurringEventId' in item} - listed
+
+
+class Diff(object):
+    """The result of comparing ready events with the events already on a calendar."""
+
+    def __init__(self) -> None:
+        self.new: List[Event] = []
+        self.unchanged: List[Tuple[Event, dict]] = []
+        self.changed: List[Tuple[Event, dict]] = []
+
+    def __str__(self) -> str:
+        return f'{len(self.new)} new, {len(self.unchanged)} unchanged, {len(self.changed)} changed'
+
+
+class EventIndex(object):
+    """Hash indexes over the events already on a calendar, used to find which ready events actually need to be sent.
+
+    A ready event is unchanged if an event with the same summary, start, end and recurrence exists. Otherwise it is
+    changed if it can be paired with an existing event this application created: first by summary and start, then by
+    summary alone when that summary is unique on both sides. Each existing event is only ever paired with one ready
+    event. Listed events are single occurrences, so recurring events are only compared if their series are given."""
+
+    def __init__(self, existing: Iterable[dict], patchable: Container[str], series: Iterable[dict] = ()) -> None:
+        self.exact: Dict[EventKey, List[dict]] = defaultdict(list)
+        self.byStart: Dict[Tuple[str, str], List[dict]] = defaultdict(list)
+        self.bySummary: Dict[str, List[dict]] = defaultdict(list)
+        for item in itertools.chain(series, existing):
+            key = api_key(item)
+            self.exact[key].append(item)
+            if item.get('id') in patchable:
+                self.byStart[key[:2]].append(item)
+                self.bySummary[key[0]].append(item)
+        self.used = set()
+
+    @classmethod
+    def fetch(cls, calendar: 'api.Calendar', calendarID: str, patchable: Container[str]) -> 'EventIndex':
+        """An index over every event on a calendar, including the series of its recurring events."""
+        existing = calendar.allEvents(calendarID)
+        return cls(existing, patchable, calendar.getEventsByID(calendarID, series_ids(existing)))
+
+    def _take(self, candidates: List[dict]) -> Optional[dict]:
+        """Take the first candidate that hasn't been paired yet, or None."""
+        for item in candidates:
+            if item['id'] not in self.used:
+                self.used.add(item['id'])
+                return item
+        return None
+
+    def diff(self, events: List[Event]) -> Diff:
+        result = Diff()
+        remaining = []
+        for event in events:
+            key = event_key(event)
+            item = self._take(self.exact.get(key, ()))
+            if item is not None:
+                result.unchanged.append((event, item))
+            else:
+                remaining.append((event, key))
+
+        unmatched = []
+        for event, key in remaining:
+            item = self._take(self.byStart.get(key[:2], ()))
+            if item is not None:
+                result.changed.append((event, item))
+            else:
+                unmatched.append((event, key))
+
+        summaries = defaultdict(int)
+        for event, key in unmatched:
+            summaries[key[0]] += 1
+        for event, key in unmatched:
+            candidates = [item for item in self.bySummary.get(key[0], ()) if item['id'] not in self.used]
+            if summaries[key[0]] == 1 and len(candidates) == 1:
+                self.used.add(candidates[0]['id'])
+                result.changed.append((event, candidates[0]))
+            else:
+                result.new.append(event)
+
+        logger.info(f'Compared {len(events)} ready events with the calendar: {result}')
+        return result
@@ -0,0 +1,265 @@
+"""Streaming exporters writing events from the API to files, one page at a time, so calendars of any size can be
+backed up without holding all of their events in memory."""
+import csv
+import datetime
+import json
+import logging
+import os
+import re
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, TextIO, Tuple, Type
+
+from dateutil import tz
+from dateutil.parser import isoparse
+
+from bulk_reminders.importers import ics_property
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+# Fields exported by default. Any top-level field of an event resource can be selected.
+DEFAULT_FIELDS = ('id', 'summary', 'start', 'end', 'description', 'location', 'recurrence', 'status', 'updated')
+REQUIRED_FIELDS = ('id', 'start', 'end', 'status')  # Always requested, cancelled events are skipped by their status
+ICS_ESCAPE_REGEX = re.compile(r'([\\;,])')
+ICS_LINE_LENGTH = 75  # Octets per line, including the space starting a folded line
+ICS_UTC_FORMAT = '%Y%m%dT%H%M%SZ'
+ICS_LOCAL_FORMAT = '%Y%m%dT%H%M%S'
+ICS_DAY_CODES = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+ICS_ZONE_YEARS = 20  # Years of timezone changes a VTIMEZONE describes, unless they follow a yearly rule
+
+
+def api_value(item: dict, field: str) -> str:
+    """A field of an event as text: the date or time of start and end, one line per item of lists, and JSON for
+    anything else that isn't already text."""
+    value = item.get(field)
+    if value is None:
+        return ''
+    if field in ('start', 'end', 'originalStartTime'):
+        return value.get('dateTime') or value.get('date', '')
+    if isinstance(value, list):
+        return '\n'.join(entry if isinstance(entry, str) else json.dumps(entry) for entry in value)
+    if isinstance(value, (dict, bool)):
+        return json.dumps(value)
+    return str(value)
+
+
+def zone_transitions(zone: datetime.tzinfo, year: int) -> List[Tuple[datetime.datetime, datetime.timedelta, datetime.timedelta]]:
+    """The UTC offset changes of a timezone during a year, as the local time each happens at (before it) along with
+    the offsets before and after."""
+    def offset(moment: datetime.datetime) -> datetime.timedelta:
+        return moment.astimezone(zone).utcoffset()
+
+    def epoch(seconds: int) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc)
+
+    transitions = []
+    day = datetime.datetime(year, 1, 1, tzinfo=datetime.timezone.utc)
+    while day.year == year:
+        after = day + datetime.timedelta(days=1)
+        if offset(day) != offset(after):
+            low, high = int(day.timestamp()), int(after.timestamp())  # Narrowed down to the second the offset changes at
+            while high - low > 1:
+                middle = (low + high) // 2
+                low, high = (middle, high) if offset(epoch(middle)) == offset(day) else (low, middle)
+            change = epoch(high)
+            transitions.append(((change + offset(day)).replace(tzinfo=None), offset(day), offset(change)))
+        day = after
+    return transitions
+
+
+def ics_offset(offset: datetime.timedelta) -> str:
+    minutes = int(offset.total_seconds()) // 60
+    return f'{"-" if minutes < 0 else "+"}{abs(minutes) // 60:02d}{abs(minutes) % 60:02d}'
+
+
+def weekday_rules(onset: datetime.datetime) -> Set[str]:
+    """The yearly RRULEs an onset matches, like the second or the last sunday of its month."""
+    month = (onset.replace(day=28) + datetime.timedelta(days=4)).replace(day=1) - datetime.timedelta(days=1)
+    weeks = {(onset.day - 1) // 7 + 1} | ({-1} if onset.day + 7 > month.day else set())
+    return {f'RRULE:FREQ=YEARLY;BYMONTH={onset.month};BYDAY={week}{ICS_DAY_CODES[onset.weekday()]}' for week in weeks}
+
+
+def vtimezone(name: str, zone: datetime.tzinfo, year: int) -> List[str]:
+    """The lines of a VTIMEZONE describing a timezone from the given year on.
+
+    Each kind of change gets a yearly rule if one matches it for the next ICS_ZONE_YEARS years, like daylight saving
+    time rules do. Otherwise every change during those years is listed, and the last offset holds after them."""
+    transitions = [transition for current in range(year, year + ICS_ZONE_YEARS) for transition in zone_transitions(zone, current)]
+    if len(transitions) == 0:
+        offset = datetime.datetime(year, 1, 1, tzinfo=zone).utcoffset()
+        transitions = [(datetime.datetime(year, 1, 1), offset, offset)]
+    standard = min(offset for transition in transitions for offset in transition[1:])
+
+    onsets: Dict[Tuple[datetime.timedelta, datetime.timedelta], List[datetime.datetime]] = {}
+    for onset, before, after in transitions:
+        onsets.setdefault((before, after), []).append(onset)
+    lines = ['BEGIN:VTIMEZONE', f'TZID:{name}']
+    for (before, after), group in onsets.items():
+        kind = 'DAYLIGHT' if after > standard else 'STANDARD'
+        lines += [f'BEGIN:{kind}', f'DTSTART:{group[0].strftime(ICS_LOCAL_FORMAT)}', f'TZOFFSETFROM:{ics_offset(before)}',
+                  f'TZOFFSETTO:{ics_offset(after)}']
+        rules = set.intersection(*(weekday_rules(onset) for onset in group))
+        if len(group) > 1 and len(rules) > 0 and len({onset.time() for onset in group}) == 1 \
+                and len(group) == group[-1].year - group[0].year + 1:
+            lines.append(min(rules))
+        elif len(group) > 1:
+            lines.append('RDATE:' + ','.join(onset.strftime(ICS_LOCAL_FORMAT) for onset in group[1:]))
+        lines.append(f'END:{kind}')
+    lines.append('END:VTIMEZONE')
+    return lines
+
+
+class Exporter(ABC):
+    """Writes events to a file in some format, as they are given."""
+
+    def __init__(self, file: TextIO, fields: Sequence[str]) -> None:
+        self.file = file
+        self.fields = fields
+
+    @abstractmethod
+    def write(self, item: dict) -> None:
+        """Write a single event."""
+        pass
+
+    def close(self) -> None:
+        """Finish the file after the last event. Does not close the file itself."""
+        pass
+
+
+class JSONLinesExporter(Exporter):
+    """One JSON object per line, holding the selected fields of an event as the API returned them."""
+
+    def write(self, item: dict) -> None:
+        self.file.write(json.dumps({field: item[field] for field in self.fields if field in item}) + '\n')
+
+
+class CSVExporter(Exporter):
+    """One column per selected field. With the default fields, the file can be imported again."""
+
+    def __init__(self, file: TextIO, fields: Sequence[str]) -> None:
+        super(CSVExporter, self).__init__(file, fields)
+        self.writer = csv.writer(file)
+        self.writer.writerow(fields)
+
+    def write(self, item: dict) -> None:
+        self.writer.writerow([api_value(item, field) for field in self.fields])
+
+
+class ICSExporter(Exporter):
+    """An iCalendar file with a VEVENT per event. Fields without an iCalendar property are left out."""
+
+    PROPERTIES = {'summary': 'SUMMARY', 'description': 'DESCRIPTION', 'location': 'LOCATION', 'status': 'STATUS'}
+
+    def __init__(self, file: TextIO, fields: Sequence[str]) -> None:
+        super(ICSExporter, self).__init__(file, fields)
+        self.zones: Set[str] = set()  # Timezones already described by a VTIMEZONE
+        self.stamp = datetime.datetime.now(datetime.timezone.utc).strftime(ICS_UTC_FORMAT)  # For events without 'updated'
+        self.line('BEGIN:VCALENDAR')
+        self.line('VERSION:2.0')
+        self.line('PRODID:-//Xevion//Bulk Reminders//EN')
+
+    def line(self, text: str) -> None:
+        """Write a content line, folded so no line is longer than 75 octets. Folded lines start with a space, so they
+        hold one octet less of the text."""
+        encoded = text.encode('utf-8')
+        length = ICS_LINE_LENGTH
+        while len(encoded) > length:
+            cut = length
+            while cut > 0 and (encoded[cut] & 0xC0) == 0x80:  # Never split a multi-byte character
+                cut -= 1
+            self.file.write(encoded[:cut].decode('utf-8') + '\r\n ')
+            encoded = encoded[cut:]
+            length = ICS_LINE_LENGTH - 1
+        self.file.write(encoded.decode('utf-8') + '\r\n')
+
+    @staticmethod
+    def text(value: str) -> str:
+        return ICS_ESCAPE_REGEX.sub(r'\\\1', value).replace('\r\n', '\\n').replace('\n', '\\n')
+
+    def timezone(self, name: str, year: int) -> Optional[datetime.tzinfo]:
+        """The timezone with the given name, writing a VTIMEZONE for it the first time. None if it is unknown.
+
+        The VTIMEZONE starts the year before the first event using it, as the events still to come aren't known yet."""
+        zone = tz.gettz(name)
+        if zone is not None and name not in self.zones:
+            self.zones.add(name)
+            for line in vtimezone(name, zone, year - 1):
+                self.line(line)
+        return zone
+
+    def time(self, name: str, value: dict, recurring: bool) -> str:
+        """A DTSTART or DTEND line. Times of recurring events keep their timezone, so occurrences stay at the same local
+        time across daylight saving time changes. Other times are written in UTC."""
+        if 'date' in value:
+            return f'{name};VALUE=DATE:{value["date"].replace("-", "")}'
+        moment = isoparse(value['dateTime'])
+        zone = self.timezone(value['timeZone'], moment.year) if recurring and 'timeZone' in value else None
+        if zone is not None:
+            return f'{name};TZID={value["timeZone"]}:{moment.astimezone(zone).strftime(ICS_LOCAL_FORMAT)}'
+        return f'{name}:{moment.astimezone(datetime.timezone.utc).strftime(ICS_UTC_FORMAT)}'
+
+    def rule(self, line: str, year: int) -> str:
+        """A recurrence line. The timezone of EXDATE and RDATE lines naming a TZID is described by a VTIMEZONE."""
+        name, parameters, value = ics_property(line)
+        if name in ('EXDATE', 'RDATE') and 'TZID' in parameters:
+            self.timezone(parameters['TZID'].strip('"'), year)
+        return line
+
+    def write(self, item: dict) -> None:
+        recurring = 'recurrence' in self.fields and bool(item.get('recurrence'))
+        if recurring:
+            # Timezones are described before the event that uses them, as files are written one event at a time
+            year = isoparse(item['start'].get('dateTime') or item['start']['date']).year
+            start, end = self.time('DTSTART', item['start'], True), self.time('DTEND', item['end'], True)
+            rules = [self.rule(rule, year) for rule in item['recurrence']]
+        else:
+            start, end, rules = self.time('DTSTART', item['start'], False), self.time('DTEND', item['end'], False), []
+        self.line('BEGIN:VEVENT')
+        self.line(f'UID:{item["id"]}')
+        if 'updated' in item:
+            self.line(f'DTSTAMP:{isoparse(item["updated"]).astimezone(datetime.timezone.utc).strftime(ICS_UTC_FORMAT)}')
+        else:
+            self.line(f'DTSTAMP:{self.stamp}')  # Required by every VEVENT
+        self.line(start)
+        self.line(end)
+        for field in self.fields:
+            if field == 'recurrence':
+                for rule in rules:
+                    self.line(rule)
+            elif field in self.PROPERTIES and item.get(field):
+                value = item[field].upper() if field == 'status' else self.text(item[field])
+                self.line(f'{self.PROPERTIES[field]}:{value}')
+        self.line('END:VEVENT')
+
+    def close(self) -> None:
+        self.line('END:VCALENDAR')
+
+
+EXPORTERS: Dict[str, Type[Exporter]] = {'jsonl': JSONLinesExporter, 'csv': CSVExporter, 'ics': ICSExporter}
+EXTENSIONS: Dict[str, str] = {'.jsonl': 'jsonl', '.json': 'jsonl', '.csv': 'csv', '.ics': 'ics', '.ical': 'ics'}
+
+
+def detect(path: str) -> str:
+    """The format to write a file in, judged by its extension. Anything unknown is written as JSON lines."""
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower(), 'jsonl')
+
+
+def requested_fields(fields: Iterable[str]) -> List[str]:
+    """The fields to request from the API for an export of the given fields."""
+    return sorted(set(fields) | set(REQUIRED_FIELDS))
+
+
+def export(file: TextIO, format: str, pages: Iterable[List[dict]], fields: Sequence[str] = DEFAULT_FIELDS) -> Iterator[int]:
+    """Writes every page of events to a file as it arrives, yielding the number of events written so far after each
+    page. Cancelled events are skipped."""
+    exporter = EXPORTERS[format](file, fields)
+    count = 0
+    for page in pages:
+        for item in page:
+            if item.get('status') == 'cancelled':
+                continue
+            exporter.write(item)
+            count += 1
+        yield count
+    exporter.close()
+    logger.info(f'Exported {count} events as {format}')
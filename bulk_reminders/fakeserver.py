@@ -0,0 +1,407 @@
+import datetime
+import email.parser
+import functools
+import gzip
+import json
+import logging
+import random
+import threading
+import time
+import urllib.parse
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from dateutil.parser import isoparse
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+SERVICE_PATH = '/calendar/v3/'
+BATCH_PATH = '/batch/calendar/v3'
+MAX_BATCH_SIZE = 50
+MAX_PAGE_SIZE = 2500
+OWNER = 'owner@example.com'
+
+REASONS = {400: 'badRequest', 403: 'rateLimitExceeded', 404: 'notFound', 409: 'duplicate', 410: 'deleted',
+           429: 'rateLimitExceeded', 500: 'backendError', 503: 'backendError'}
+STATUS_TEXT = {200: 'OK', 204: 'No Content', 304: 'Not Modified', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 409: 'Conflict',
+               410: 'Gone', 429: 'Too Many Requests', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+Response = Tuple[int, Optional[dict]]
+
+
+def error(status: int, message: str) -> Response:
+    """An error response in the format the Google APIs use."""
+    reason = REASONS.get(status, 'backendError')
+    return status, {'error': {'errors': [{'domain': 'global', 'reason': reason, 'message': message}],
+                              'code': status, 'message': message}}
+
+
+def public(event: dict) -> dict:
+    """An event without the fields only the fake server uses."""
+    return {key: value for key, value in event.items() if key != '_sequence'}
+
+
+@functools.lru_cache(maxsize=64)
+def parse_fields(text: str) -> Dict[str, Any]:
+    """Parses a partial response mask like "nextPageToken,items(id,start/dateTime)" into a tree of selected fields,
+    where None selects a field with everything in it."""
+    tree: Dict[str, Any] = {}
+    stack = [tree]  # The nodes whose sub-selections are open
+    path: List[str] = []  # The names of the current field, split by slashes
+
+    def node(names: List[str]) -> Optional[Dict[str, Any]]:
+        """The node for a path below the innermost open node, None if an enclosing field is selected entirely."""
+        current = stack[-1]
+        for name in names:
+            if name in current and current[name] is None:
+                return None
+            current = current.setdefault(name, {})
+        return current
+
+    def select() -> None:
+        if len(path) > 0 and path[-1]:
+            parent = node(path[:-1])
+            if parent is not None:
+                parent[path[-1]] = None
+        path.clear()
+
+    name = ''
+    for character in text + ',':
+        if character in ',)':
+            path.append(name)
+            select()
+            if character == ')':
+                stack.pop()
+        elif character == '/':
+            path.append(name)
+        elif character == '(':
+            path.append(name)
+            child = node(path)
+            stack.append(child if child is not None else {})
+            path.clear()
+        elif not character.isspace():
+            name += character
+            continue
+        name = ''
+    return tree
+
+
+def merge(target: dict, patch: dict) -> dict:
+    """Applies a patch to a resource like the API does: objects are merged field by field and null clears a field."""
+    result = dict(target)
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        elif isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = merge(result[key], value)
+        else:
+            result[key] = value
+    return result
+
+
+def valid_times(event: dict) -> bool:
+    """Whether the start and end of an event each hold either a date or a date and time, but not both."""
+    return all(isinstance(event.get(field), dict) and ('date' in event[field]) != ('dateTime' in event[field])
+               for field in ('start', 'end'))
+
+
+def select_fields(value: Any, tree: Optional[Dict[str, Any]]) -> Any:
+    """Only keeps the selected fields of a resource, of every resource in a list."""
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [select_fields(entry, tree) for entry in value]
+    if isinstance(value, dict):
+        return {key: select_fields(value[key], subtree) for key, subtree in tree.items() if key in value}
+    return value
+
+
+def start_time(event: dict) -> datetime.datetime:
+    field = event['start']
+    if 'dateTime' in field:
+        return isoparse(field['dateTime'])
+    return isoparse(field['date']).replace(tzinfo=datetime.timezone.utc)
+
+
+def end_time(event: dict) -> datetime.datetime:
+    field = event['end']
+    if 'dateTime' in field:
+        return isoparse(field['dateTime'])
+    return isoparse(field['date']).replace(tzinfo=datetime.timezone.utc)
+
+
+class FakeCalendarServer(object):
+    """A local HTTP stand-in for the parts of the Calendar v3 API this application uses, for benchmarks and testing.
+
+    Supports calendarList.list, events.list/get/insert/patch/delete (including paging and sync tokens) and batch
+    requests, with conditional requests for the calendar list. Every HTTP request is delayed by the given latency, a random fraction of (sub-)requests fail with the
+    given error status, responses are slowed down to the given bandwidth and requests beyond the rate limit (per second) are rejected with 403 rateLimitExceeded.
+    Recurring events are stored and returned as-is, they are not expanded into occurrences. The rate limit is measured
+    with the given clock, so tests can simulate time."""
+
+    def __init__(self, latency: float = 0.0, errorRate: float = 0.0, errorStatus: int = 503,
+                 rateLimit: Optional[float] = None, calendars: Optional[List[str]] = None, seed: Optional[int] = None,
+                 compress: bool = True, bandwidth: Optional[float] = None, clock: Callable[[], float] = time.monotonic) -> None:
+        self.latency, self.errorRate, self.errorStatus, self.rateLimit = latency, errorRate, errorStatus, rateLimit
+        self.clock = clock
+        self.compress = compress
+        self.bandwidth = bandwidth  # Bytes per second responses are sent at, unlimited if None
+        self.random = random.Random(seed)
+        # Resources carry the fields the real API returns, so the effect of partial responses is realistic
+        self.calendars = {calendarID: {'kind': 'calendar#calendarListEntry', 'etag': f'"{zlib.crc32(calendarID.encode("utf-8"))}"',
+                                       'id': calendarID, 'summary': calendarID, 'timeZone': 'UTC', 'colorId': '14',
+                                       'backgroundColor': '#9fe1e7', 'foregroundColor': '#000000', 'selected': True,
+                                       'accessRole': 'owner', 'defaultReminders': [{'method': 'popup', 'minutes': 10}],
+                                       'conferenceProperties': {'allowedConferenceSolutionTypes': ['hangoutsMeet']}}
+                          for calendarID in (calendars or ['primary'])}
+        self.events: Dict[str, Dict[str, dict]] = {calendarID: {} for calendarID in self.calendars}
+        self.sequence = 0
+        self.lock = threading.Lock()
+        self.allowance = rateLimit or 0.0
+        self.updated = self.clock()
+        self.stats = {'requests': 0, 'batches': 0, 'calls': 0, 'errors': 0, 'throttled': 0, 'bytesIn': 0, 'bytesOut': 0}
+        self.httpd: Optional[ThreadingHTTPServer] = None
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """The root URL of the running server, to be used in place of https://www.googleapis.com/"""
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def start(self) -> str:
+        """Start serving on a free local port in a background thread, returning the root URL."""
+        handler = type('Handler', (RequestHandler,), {'fake': self})
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='FakeCalendarServer', daemon=True)
+        self.thread.start()
+        logger.debug(f'Fake Calendar API listening on {self.url}')
+        return self.url
+
+    def stop(self) -> None:
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    def __enter__(self) -> 'FakeCalendarServer':
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _admit(self) -> Optional[Response]:
+        """Apply the rate limit and error injection to a single call. Returns an error response to send instead, if any."""
+        with self.lock:
+            self.stats['calls'] += 1
+            if self.rateLimit is not None:
+                now = self.clock()
+                self.allowance = min(self.rateLimit, self.allowance + (now - self.updated) * self.rateLimit)
+                self.updated = now
+                if self.allowance < 1:
+                    self.stats['throttled'] += 1
+                    return error(403, 'Rate Limit Exceeded')
+                self.allowance -= 1
+            if self.errorRate > 0 and self.random.random() < self.errorRate:
+                self.stats['errors'] += 1
+                return error(self.errorStatus, 'Injected error')
+        return None
+
+    def dispatch(self, method: str, target: str, body: Optional[bytes], ifNoneMatch: Optional[str] = None) -> Response:
+        """Handle a single API call, given its method, path with query string, body and If-None-Match header."""
+        rejected = self._admit()
+        if rejected is not None:
+            return rejected
+
+        parsed = urllib.parse.urlsplit(target)
+        if not parsed.path.startswith(SERVICE_PATH):
+            return error(404, f'Unknown path {parsed.path}')
+        parts = [urllib.parse.unquote(part) for part in parsed.path[len(SERVICE_PATH):].strip('/').split('/')]
+        query = {key: values[-1] for key, values in urllib.parse.parse_qs(parsed.query).items()}
+        try:
+            content = json.loads(body) if body else None
+        except ValueError:
+            return error(400, 'Invalid JSON body')
+
+        with self.lock:
+            if parts == ['users', 'me', 'calendarList'] and method == 'GET':
+                items = list(self.calendars.values())
+                etag = f'"{zlib.crc32(json.dumps(items, sort_keys=True).encode("utf-8"))}"'
+                if ifNoneMatch == etag:
+                    return 304, None
+                return self.partial(query, (200, {'kind': 'calendar#calendarList', 'etag': etag, 'items': items}))
+            if len(parts) < 3 or parts[0] != 'calendars' or parts[2] != 'events':
+                return error(404, f'Unknown path {parsed.path}')
+            if parts[1] not in self.events:
+                return error(404, f'Unknown calendar {parts[1]}')
+
+            events = self.events[parts[1]]
+            if len(parts) == 3 and method == 'GET':
+                return self.partial(query, self.list(parts[1], events, query))
+            if len(parts) == 3 and method == 'POST':
+                return self.partial(query, self.insert(events, content or {}))
+            if len(parts) == 4 and method in ('GET', 'PATCH', 'DELETE'):
+                event = events.get(parts[3])
+                if event is None:
+                    return error(404, 'Not Found')
+                if method == 'GET':
+                    return self.partial(query, (200, public(event)))
+                if event['status'] == 'cancelled':
+                    return error(410, 'Resource has been deleted')
+                if method == 'PATCH':
+                    patched = merge(event, content or {})
+                    if not valid_times(patched):
+                        return error(400, 'Invalid start or end time.')
+                    event.clear()
+                    event.update(patched)
+                    event['sequence'] += 1
+                    self.touch(event)
+                    return self.partial(query, (200, public(event)))
+                event['status'] = 'cancelled'
+                self.touch(event)
+                return 204, None
+        return error(400, f'Unsupported method {method}')
+
+    @staticmethod
+    def partial(query: Dict[str, str], response: Response) -> Response:
+        """Applies the fields parameter of a request to a successful response."""
+        status, content = response
+        if 'fields' not in query or content is None or status >= 300:
+            return response
+        return status, select_fields(content, parse_fields(query['fields']))
+
+    def touch(self, event: dict) -> None:
+        """Record a change to an event, so incremental syncs pick it up."""
+        self.sequence += 1
+        event['_sequence'] = self.sequence
+        event['updated'] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        event['etag'] = f'"{self.sequence}"'
+
+    def insert(self, events: Dict[str, dict], body: dict) -> Response:
+        eventID = body.get('id') or uuid.uuid4().hex
+        if eventID in events:
+            return error(409, 'The requested identifier already exists.')
+        if not valid_times(body):
+            return error(400, 'Invalid start or end time.')
+        event = dict(body, id=eventID, status='confirmed', kind='calendar#event',
+                     htmlLink=f'https://www.google.com/calendar/event?eid={eventID}',
+                     created=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                     creator={'email': OWNER, 'self': True}, organizer={'email': OWNER, 'self': True},
+                     iCalUID=f'{eventID}@google.com', sequence=0, reminders={'useDefault': True}, eventType='default')
+        events[eventID] = event
+        self.touch(event)
+        return 200, public(event)
+
+    def list(self, calendarID: str, events: Dict[str, dict], query: Dict[str, str]) -> Response:
+        """events.list, with page tokens holding the offset into the results and sync tokens holding a sequence number."""
+        pageSize = min(int(query.get('maxResults', 250)), MAX_PAGE_SIZE)
+        offset = int(query.get('pageToken', 0))
+        if 'syncToken' in query:
+            try:
+                since = int(query['syncToken'])
+            except ValueError:
+                since = self.sequence + 1  # Tokens from elsewhere are invalid, like expired ones
+            if since > self.sequence:
+                return error(410, 'Sync token is no longer valid, a full sync is required.')
+            items = [event for event in events.values() if event['_sequence'] > since]
+        else:
+            items = [event for event in events.values() if event['status'] != 'cancelled' or query.get('showDeleted') == 'true']
+            if 'timeMin' in query:
+                after = isoparse(query['timeMin'])
+                items = [event for event in items if end_time(event) > after]
+            if 'timeMax' in query:
+                before = isoparse(query['timeMax'])
+                items = [event for event in items if start_time(event) < before]
+            if query.get('orderBy') == 'startTime':
+                items.sort(key=start_time)
+
+        page = [public(event) for event in items[offset:offset + pageSize]]
+        response = {'kind': 'calendar#events', 'etag': f'"{self.sequence}"', 'summary': calendarID,
+                    'updated': datetime.datetime.now(datetime.timezone.utc).isoformat(), 'timeZone': 'UTC',
+                    'accessRole': 'owner', 'defaultReminders': [{'method': 'popup', 'minutes': 10}], 'items': page}
+        if offset + pageSize < len(items):
+            response['nextPageToken'] = str(offset + pageSize)
+        else:
+            response['nextSyncToken'] = str(self.sequence)
+        return 200, response
+
+    def batch(self, contentType: str, body: bytes) -> Tuple[int, str, bytes]:
+        """Handle a multipart/mixed batch request, returning the status, content type and body of the response."""
+        message = email.parser.BytesParser().parsebytes(b'Content-Type: ' + contentType.encode('utf-8') + b'\r\n\r\n' + body)
+        if not message.is_multipart():
+            status, content = error(400, 'Batch requests must be multipart/mixed')
+            return status, 'application/json', json.dumps(content).encode('utf-8')
+        parts = message.get_payload()
+        if len(parts) > MAX_BATCH_SIZE:
+            status, content = error(400, f'A batch may contain at most {MAX_BATCH_SIZE} requests')
+            return status, 'application/json', json.dumps(content).encode('utf-8')
+
+        boundary = uuid.uuid4().hex
+        output = []
+        for part in parts:
+            payload = part.get_payload()
+            if isinstance(payload, list):
+                payload = payload[0].as_string()
+            requestLine, rest = payload.split('\n', 1)
+            method, target = requestLine.split(' ')[:2]
+            inner = email.parser.Parser().parsestr(rest)
+            innerBody = inner.get_payload()
+            status, content = self.dispatch(method, target, innerBody.encode('utf-8') if innerBody else None)
+
+            contentID = part.get('Content-ID', '<+>')
+            text = json.dumps(content) if content is not None else ''
+            output.append(f'--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{contentID[1:]}\r\n\r\n'
+                          f'HTTP/1.1 {status} {STATUS_TEXT.get(status, "Error")}\r\n'
+                          f'Content-Type: application/json; charset=UTF-8\r\nContent-Length: {len(text)}\r\n\r\n{text}\r\n')
+        output.append(f'--{boundary}--\r\n')
+        return 200, f'multipart/mixed; boundary={boundary}', ''.join(output).encode('utf-8')
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep connections alive like the real API
+    fake: FakeCalendarServer
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def handle_request(self) -> None:
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length > 0 else None
+        fake = self.fake
+        with fake.lock:
+            fake.stats['requests'] += 1
+            fake.stats['bytesIn'] += length
+        if fake.latency > 0:
+            time.sleep(fake.latency)
+
+        if self.command == 'POST' and urllib.parse.urlsplit(self.path).path == BATCH_PATH:
+            with fake.lock:
+                fake.stats['batches'] += 1
+            status, contentType, content = fake.batch(self.headers.get('Content-Type', ''), body or b'')
+        else:
+            status, payload = fake.dispatch(self.command, self.path, body, self.headers.get('If-None-Match'))
+            contentType = 'application/json; charset=UTF-8'
+            content = json.dumps(payload).encode('utf-8') if payload is not None else b''
+
+        compressed = (fake.compress and len(content) > 0 and 'gzip' in self.headers.get('Accept-Encoding', '')
+                      and 'gzip' in self.headers.get('User-Agent', ''))
+        if compressed:
+            content = gzip.compress(content, compresslevel=6)
+        with fake.lock:
+            fake.stats['bytesOut'] += len(content)
+        if fake.bandwidth is not None:
+            time.sleep(len(content) / fake.bandwidth)
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        if compressed:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PATCH = do_DELETE = handle_request
@@ -1,81 +1,182 @@
+import datetime
 import logging
-from typing import Any, List, Set
+from collections import Counter
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
 
 from PyQt5 import QtCore, QtGui, QtWidgets
-from PyQt5.QtWidgets import QMainWindow, QMessageBox
+from PyQt5.QtGui import QKeySequence
+from PyQt5.QtWidgets import QFileDialog, QInputDialog, QMainWindow, QMenu, QMessageBox, QShortcut
 
-from bulk_reminders import api
+from bulk_reminders import api, exporters, metrics
 from bulk_reminders.api import Event
+from bulk_reminders.cache import CACHE_FILE, LRUCache, LocalCache
+from bulk_reminders.checkpoint import Submission
+from bulk_reminders.diff import EventIndex
 from bulk_reminders.gui_base import Ui_MainWindow
-from bulk_reminders.load import LoadDialog
-from bulk_reminders.oauth import OAuthDialog
-from bulk_reminders.undo import IDPair
+from bulk_reminders.metrics import profile_generator
+from bulk_reminders.model import EventTableModel
+from bulk_reminders.stats import StatsPanel
+from bulk_reminders.timing import startup
+from bulk_reminders.undo import HISTORY_FILE, HistoryManager, IDPair
+from bulk_reminders.windows import EventWindows, MAX_CACHED_WINDOWS, merge
+from bulk_reminders.workers import Worker, WorkerPool
 
 logging.basicConfig(format='[%(asctime)s] [%(levelname)s] [%(threadName)s] %(message)s')
 logger = logging.getLogger(__file__)
 logger.setLevel(logging.DEBUG)
 
+REFRESH_INTERVAL = 5 * 60 * 1000  # Milliseconds between background refreshes of the current calendar
+PREFETCH_ROWS = 50  # The next window of events is shown once the table is scrolled this close to its end
+
+
+class CalendarTable(NamedTuple):
+    """The rows shown for a calendar's events, kept so switching back to a calendar is instant."""
+    apiEvents: List[dict]
+    rows: List[Event]
+    counts: Counter
+
+
+def same_items(first: List[dict], second: List[dict]) -> bool:
+    """Whether two lists hold the very same API events, as a store returns them when nothing changed."""
+    return len(first) == len(second) and all(a is b for a, b in zip(first, second))
+
 
 class MainWindow(QMainWindow, Ui_MainWindow):
     def __init__(self, *args, **kwargs):
         # Initial UI setup
-        super(MainWindow, self).__init__(*args, **kwargs)
-        self.setupUi(self)
-        logger.debug('UI Initialized.')
-        self.show()
+        with startup.phase('ui setup'):
+            super(MainWindow, self).__init__(*args, **kwargs)
+            self.setupUi(self)
+            logger.debug('UI Initialized.')
 
         self.calendar = api.Calendar()
+        self.pool = WorkerPool()
+        self.populateWorker: Optional[Worker] = None
+        self.busy = False
+        self.submitted: List[Event] = []
+        self.failed: List[Event] = []
         self.currentCalendarID = 'primary'
+        self.tableCalendarID: Optional[str] = None  # The calendar whose events are shown in the table
+        self.tables = LRUCache()  # CalendarTable of recently viewed calendars, by calendar ID
+        self.windows: Dict[str, EventWindows] = {}  # The time windows of events shown for each calendar
+        self.windowCache = LRUCache(MAX_CACHED_WINDOWS)  # Windows fetched from the API, by EventWindows.key()
+        self.fetching: Set[Tuple[str, datetime.datetime]] = set()  # Keys of windows being fetched
 
-        # Authenticate user into Google API Engine
-        self.authenticated = self.calendar.authenticate_via_token()
-        if not self.authenticated:
-            temp_dialog = OAuthDialog(callback=self.calendar.authenticate_via_oauth)
-            temp_dialog.show()
-        self.calendar.setupService()
-
-        # Get Calendars, Setup Calendar Selection Combobox
-        calendars = self.calendar.getCalendarsSimplified()
         self.comboModel = QtGui.QStandardItemModel()
-        for id, summary in calendars:
-            item = QtGui.QStandardItem(summary)
-            item.setData(id)
-            self.comboModel.appendRow(item)
         self.calendarCombobox.setModel(self.comboModel)
-        self.calendarCombobox.currentIndexChanged[int].connect(self.comboBoxChanged)
 
-        # Make sure the current calendar ID matches up
-        self.currentCalendarID = self.comboModel.item(self.calendarCombobox.currentIndex()).data()
-
-        # Setup Column View headers
-        self.eventsView.setColumnCount(4)
-        self.eventsView.setHorizontalHeaderLabels(['Summary', 'Status', 'Start', 'End'])
+        # Setup the events table
+        self.eventsModel = EventTableModel(self)
+        self.eventsView.setModel(self.eventsModel)
         header = self.eventsView.horizontalHeader()
         header.setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
         header.setSectionResizeMode(1, QtWidgets.QHeaderView.ResizeToContents)
         header.setSectionResizeMode(2, QtWidgets.QHeaderView.ResizeToContents)
         header.setSectionResizeMode(3, QtWidgets.QHeaderView.ResizeToContents)
         self.eventsView.verticalHeader().hide()
+        self.eventsView.verticalScrollBar().valueChanged.connect(lambda value: self.loadMore())
 
-        self.undoButton.clicked.connect(self.undo)
+        undoMenu = QMenu(self.undoButton)
+        undoMenu.addAction('Undo last submission', lambda: self.undo(1))
+        undoMenu.addAction('Undo last submissions...', self.undoSeveral)
+        undoMenu.addAction('Undo everything on this calendar', lambda: self.undo(None))
+        self.undoButton.setMenu(undoMenu)
         self.submitButton.clicked.connect(self.submit)
+        QShortcut(QKeySequence.Cancel, self, self.cancel)
 
-        self.history: List[IDPair] = []
-        self.historyCalendarID: str = ''
+        self.historyManager = HistoryManager(HISTORY_FILE)
+        self.undone = 0
 
-        # Disable the undo button until undo stages are available
-        if len(self.history) == 0:
-            self.undoButton.setDisabled(True)
+        # Periodically pick up changes made outside of the application, which also reconciles the undo history
+        self.refreshTimer = QtCore.QTimer(self)
+        self.refreshTimer.timeout.connect(self.refresh)
+        self.refreshTimer.start(REFRESH_INTERVAL)
 
         self.loadEventsButton.clicked.connect(self.load_events)
+
+        # API statistics and profiling, for finding out where the time of a slow operation goes
+        self.statsPanel = StatsPanel(metrics.registry, self)
+        self.addDockWidget(QtCore.Qt.RightDockWidgetArea, self.statsPanel)
+        self.statsPanel.hide()
+        fileMenu = self.menubar.addMenu('File')
+        self.exportAction = fileMenu.addAction('Export Events...', lambda: self.exportEvents(None))
+        self.exportUpcomingAction = fileMenu.addAction('Export Upcoming Events...',
+                                                       lambda: self.exportEvents(datetime.datetime.now(datetime.timezone.utc)))
+        viewMenu = self.menubar.addMenu('View')
+        viewMenu.addAction(self.statsPanel.toggleViewAction())
+        self.profileAction = viewMenu.addAction('Profile Bulk Operations')
+        self.profileAction.setCheckable(True)
         self.cachedLoadText = ''
         self.readyEvents: List[Event] = []
         self.apiEvents: List[dict] = []
 
+        # Show the window first; connecting to the API happens once the event loop is running
+        self.setBusy(True)
+        self.show()
+        startup.mark('first window')
+        QtCore.QTimer.singleShot(0, self.initialize)
+
+    def initialize(self) -> None:
+        """Show the cached calendars and events, authenticate, setup the API service and load the calendars"""
+        # Render whatever the last run saw straight away, it is revalidated once the API is available
+        with startup.phase('cache'):
+            self.calendar.cache = LocalCache(CACHE_FILE)
+            cached = self.calendar.cache.loadCalendars()
+            if len(cached) > 0:
+                self.applyCalendars(cached)
+                self.showCachedWindows(self.currentCalendarID)
+
+        # Authenticate user into Google API Engine
+        with startup.phase('authentication'):
+            self.authenticated = self.calendar.authenticate_via_token()
+            if not self.authenticated:
+                from bulk_reminders.oauth import OAuthDialog
+                temp_dialog = OAuthDialog(callback=self.calendar.authenticate_via_oauth)
+                temp_dialog.show()
+        with startup.phase('service setup'):
+            self.calendar.setupService()
+
+        # Get Calendars, Setup Calendar Selection Combobox
+        if len(cached) > 0:
+            self.pool.start(self.calendar.revalidateCalendars, result=self.calendarsRevalidated)
+        else:
+            with startup.phase('calendar list'):
+                self.applyCalendars(self.calendar.revalidateCalendars())
+        self.calendarCombobox.currentIndexChanged[int].connect(self.comboBoxChanged)
+
+        self.setBusy(False)
         self.populate()
+        self.resumeSubmission()
+
+    def applyCalendars(self, calendars: List[Tuple[str, str]]) -> None:
+        """Bring the calendar selection up to date, only adding, renaming or removing the calendars that changed"""
+        summaries = dict(calendars)
+        for row in reversed(range(self.comboModel.rowCount())):
+            if self.comboModel.item(row).data() not in summaries:
+                self.comboModel.removeRow(row)
+
+        items = {self.comboModel.item(row).data(): self.comboModel.item(row) for row in range(self.comboModel.rowCount())}
+        for id, summary in calendars:
+            item = items.get(id)
+            if item is None:
+                item = QtGui.QStandardItem(summary)
+                item.setData(id)
+                self.comboModel.appendRow(item)
+            elif item.text() != summary:
+                item.setText(summary)
+
+        # Make sure the current calendar ID matches up
+        if self.calendarCombobox.currentIndex() != -1:
+            self.currentCalendarID = self.comboModel.item(self.calendarCombobox.currentIndex()).data()
+
+    def calendarsRevalidated(self, calendars: Optional[List[Tuple[str, str]]]) -> None:
+        if calendars is not None:
+            logger.debug('Calendar list changed since it was cached')
+            self.applyCalendars(calendars)
 
     def load_events(self) -> None:
         """Open the event loading dialog"""
+        from bulk_reminders.load import LoadDialog
         dial = LoadDialog()
         dial.plainTextEdit.setPlainText(self.cachedLoadText)
         result = dial.exec()
@@ -85,71 +186,321 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             self.readyEvents = dial.parsed
             self.populate()
 
-    def undo(self) -> None:
-        """Get the latest undo stage and delete all events in that stage"""
-        logging.info(f'Deleting {len(self.history)} Events from Calendar {self.historyCalendarID}')
-
+    def setBusy(self, busy: bool) -> None:
+        """Disable the controls that start new API operations while a bulk operation is running."""
+        self.busy = busy
+        self.submitButton.setDisabled(busy or len(self.readyEvents) == 0)
+        self.undoButton.setDisabled(busy or len(self.historyManager.select(self.currentCalendarID, 1)) == 0)
+        self.loadEventsButton.setDisabled(busy)
+        self.calendarCombobox.setDisabled(busy)
+        self.exportAction.setDisabled(busy)
+        self.exportUpcomingAction.setDisabled(busy)
+
+    def cancel(self) -> None:
+        """Cancel all running API operations. Requests already sent are still recorded."""
+        if len(self.pool) > 0:
+            logger.info(f'Cancelling {len(self.pool)} running operations')
+            self.pool.cancelAll()
+
+    def undo(self, count: Optional[int] = 1) -> None:
+        """Delete every event of the latest stages for the current calendar, or of all its stages if count is None"""
+        stages = self.historyManager.select(self.currentCalendarID, count)
+        total = sum(len(stage) for stage in stages)
+        if count is None or count > 1:
+            answer = QMessageBox.question(self, 'Undo', f'Delete {total} events from {len(stages)} submissions?')
+            if answer != QMessageBox.Yes:
+                return
+        logger.info(f'Deleting {total} Events in {len(stages)} stages from Calendar {self.currentCalendarID}')
+
+        self.undone = 0
+        self.setBusy(True)
         self.progressBar.show()
-        self.progressBar.setMaximum(len(self.history))
-        for i, entry in enumerate(self.history):
-            logging.debug(f'Deleting Event {entry.eventID}')
-            self.calendar.service.events().delete(calendarId=entry.calendarID, eventId=entry.eventID).execute()
-            self.progressBar.setValue(i + 1)
-        self.progressBar.hide()
+        self.progressBar.setValue(0)
+        self.progressBar.setMaximum(total)
+        calendarID = self.currentCalendarID
+        self.startBulk(self.historyManager.rollback, self.calendar, stages, result=self.undoProgress,
+                       finished=lambda: self.undoFinished(calendarID))
+
+    def startBulk(self, fn: Callable[..., Iterator], *args, **kwargs) -> Worker:
+        """Start a bulk operation in the background, capturing a profile of it if profiling is switched on"""
+        if not self.profileAction.isChecked():
+            return self.pool.start(fn, *args, **kwargs)
+        path = datetime.datetime.now().strftime('profile-%Y%m%d-%H%M%S.prof')
+        return self.pool.start(lambda *arguments: profile_generator(fn(*arguments), path), *args, **kwargs)
+
+    def exportEvents(self, timeMin: Optional[datetime.datetime]) -> None:
+        """Save the events of the current calendar to a file, optionally only those that haven't ended yet"""
+        path, _ = QFileDialog.getSaveFileName(self, 'Export Events', f'{self.currentCalendarID}.ics',
+                                              'iCalendar (*.ics);;CSV (*.csv);;JSON Lines (*.jsonl)')
+        if not path:
+            return
+        logger.info(f'Exporting Calendar {self.currentCalendarID} to {path}')
+        self.setBusy(True)
+        self.progressBar.show()
+        self.progressBar.setMaximum(0)  # The number of events is unknown until the last page
+        self.startBulk(self.exportCalendar, path, self.currentCalendarID, timeMin, result=self.exportProgress,
+                       error=lambda e: QMessageBox.warning(self, 'Export', f'Failed to export events: {e}'),
+                       finished=self.exportFinished)
 
-        # Disable the undo button until undo stages are available
-        self.history = []
-        self.undoButton.setDisabled(len(self.history) == 0)
-        self.populate()  # Refresh
+    def exportCalendar(self, path: str, calendarID: str, timeMin: Optional[datetime.datetime]) -> Iterator[int]:
+        """Stream every page of events into the file, yielding the number written so far"""
+        with open(path, 'w', encoding='utf-8', newline='') as file:
+            pages = self.calendar.exportEventPages(calendarID, exporters.requested_fields(exporters.DEFAULT_FIELDS), timeMin=timeMin)
+            yield from exporters.export(file, exporters.detect(path), pages)
 
-    def getForeign(self) -> Set[Any]:
-        """Returns all events currently tracked that are not stored in the undo."""
-        foreign = {event.get('id'): event for event in self.apiEvents}
-        undoableIDs = set(pair.eventID for pair in self.history)
-        return {foreign[eventID] for eventID in undoableIDs.difference(foreign.keys())}
+    def exportProgress(self, count: int) -> None:
+        self.statusbar.showMessage(f'{count} events exported')
+
+    def exportFinished(self) -> None:
+        self.progressBar.hide()
+        self.setBusy(False)
+
+    def undoSeveral(self) -> None:
+        """Ask how many of the latest stages to undo"""
+        available = len(self.historyManager.select(self.currentCalendarID))
+        count, accepted = QInputDialog.getInt(self, 'Undo', 'Number of submissions to undo:', 1, 1, max(available, 1))
+        if accepted:
+            self.undo(count)
+
+    def undoProgress(self, results: List[Tuple[IDPair, Any]]) -> None:
+        """Remove deleted events from the table as they are confirmed."""
+        deleted = {pair.eventID for pair, error in results if error is None}
+        self.undone += len(results)
+        self.progressBar.setValue(self.undone)
+        self.eventsModel.removeEvents([event for event in self.eventsModel.events if event.eventID in deleted])
+
+    def undoFinished(self, calendarID: str) -> None:
+        self.tables.invalidate(calendarID)
+        self.progressBar.hide()
+        self.setBusy(False)
+        self.populate()  # Refresh
 
     def submit(self) -> None:
-        self.historyCalendarID = self.currentCalendarID
-        self.history = []
+        self.startSubmission(Submission(self.currentCalendarID, self.historyManager))
+
+    def resumeSubmission(self) -> None:
+        """Offer to resume a submission that was interrupted the last time the application ran."""
+        submission = Submission.load(self.historyManager)
+        if submission is None:
+            return
+
+        answer = QMessageBox.question(self, 'Resume submission',
+                                      f'A submission of {len(submission.pending)} events was interrupted. Resume it now?')
+        if answer != QMessageBox.Yes:
+            submission.discard()
+            return
+
+        self.readyEvents = submission.pending
+        for row in range(self.comboModel.rowCount()):
+            if self.comboModel.item(row).data() == submission.calendarID:
+                self.calendarCombobox.setCurrentIndex(row)
+        self.startSubmission(submission)
+
+    def startSubmission(self, submission: Submission) -> None:
+        """Submit all ready events in the background"""
+        self.submitted, self.failed = [], []
 
         logger.info(f'Submitting {len(self.readyEvents)} events to API')
 
+        self.setBusy(True)
         self.progressBar.show()
+        self.progressBar.setValue(0)
         self.progressBar.setMaximum(len(self.readyEvents))
-        for i, event in enumerate(self.readyEvents):
-            logger.debug(f'Submitting "{event.summary}" scheduled to start on {event.start.isoformat()}....')
-            result = self.calendar.service.events().insert(calendarId=self.currentCalendarID, body=event.body).execute()
-            self.history.append(IDPair(self.currentCalendarID, result.get('id')))
-            self.progressBar.setValue(i + 1)
-
-        self.undoButton.setDisabled(len(self.history) == 0)
-        self.readyEvents.clear()
+        self.startBulk(self.reconcile, submission, list(self.readyEvents),
+                       result=self.submitProgress, finished=lambda: self.submitFinished(submission.calendarID))
+
+    def reconcile(self, submission: Submission, events: List[Event]) -> Iterator[List[Tuple[Event, Optional[dict], Any]]]:
+        """Runs on a worker thread: compare the events with the calendar and only send what changed."""
+        # Submitted events can be patched, the history is read under its lock as other workers may be changing it
+        patchable = self.historyManager.eventIDs(submission.calendarID)
+        index = EventIndex.fetch(self.calendar, submission.calendarID, patchable)
+        yield from submission.run(self.calendar, events, index)
+
+    def submitProgress(self, results: List[Tuple[Event, Optional[dict], Any]]) -> None:
+        """Record the results of a submitted batch as it completes."""
+        for event, result, error in results:
+            self.submitted.append(event)
+            if error is None:
+                # Unchanged and updated events already existed, they are not part of this submission's undo
+                if event.status not in ('Unchanged', 'Updated'):
+                    event.eventID, event.status = result.get('id'), 'Undoable'
+            else:
+                # Keep failed events around so they can be submitted again
+                event.status = 'Failed'
+                self.failed.append(event)
+            self.eventsModel.eventChanged(event)
+        self.progressBar.setValue(len(self.submitted))
+
+    def submitFinished(self, calendarID: str) -> None:
+        self.tables.invalidate(calendarID)
+        if len(self.failed) > 0:
+            logger.warning(f'{len(self.failed)} of {len(self.submitted)} events failed to submit')
+
+        # Events that were never sent (cancelled) remain ready alongside the failed ones
+        submitted = set(map(id, self.submitted))
+        self.readyEvents = self.failed + [event for event in self.readyEvents if id(event) not in submitted]
         self.progressBar.hide()
+        self.setBusy(False)
+
+        self.populate()
 
+    def refresh(self) -> None:
+        """Periodically re-populate the table, unless a bulk operation is still updating it and the undo history"""
+        if self.busy:
+            logger.debug('Skipping the periodic refresh while a bulk operation is running')
+            return
         self.populate()
 
     def populate(self) -> None:
+        """Sync the current calendar's events in the background, then re-populate the table"""
+        if self.populateWorker is not None:
+            self.populateWorker.cancel()
+        calendarID = self.currentCalendarID
+        windows = self.windowsFor(calendarID)
+        store = self.calendar.stores.get(calendarID)
+        if (store is None or store.syncToken is None) and not self.showCachedWindows(calendarID):
+            # Until the calendar is synced, the windows shown are fetched on their own so the first rows don't wait for
+            # every event of the calendar to be downloaded
+            for index in range(windows.count):
+                self.fetchWindow(windows, index)
+        self.populateWorker = self.pool.start(self.calendar.syncEvents, calendarID, finished=lambda: self.synced(calendarID))
+
+    def synced(self, calendarID: str) -> None:
+        if calendarID == self.currentCalendarID:
+            self.showWindows(calendarID)
+        self.reconcileHistory(calendarID)
+
+    def windowsFor(self, calendarID: str) -> EventWindows:
+        if calendarID not in self.windows:
+            self.windows[calendarID] = EventWindows(calendarID)
+        return self.windows[calendarID]
+
+    def showCachedWindows(self, calendarID: str) -> bool:
+        """Fill the table with the windows of events shown for a calendar from the local cache, without waiting for its
+        store to be restored. Returns False if the calendar isn't cached."""
+        cache = self.calendar.cache
+        if cache is None or not cache.hasStore(calendarID):
+            return False
+        windows = self.windowsFor(calendarID)
+        items = cache.loadWindow(calendarID, windows.anchor, windows.horizon)
+        # Reading from the cache is cheap, so sparse calendars skip ahead until the view is likely to be full
+        while len(items) < PREFETCH_ROWS and not windows.complete:
+            windows.count *= 2
+            items = cache.loadWindow(calendarID, windows.anchor, windows.horizon)
+        self.fillTable(calendarID, items)
+        return True
+
+    def fetchWindow(self, windows: EventWindows, index: int) -> None:
+        """Fetch a window of events in the background, unless it is cached or already being fetched"""
+        key = windows.key(index)
+        if key in self.fetching or self.windowCache.get(key) is not None:
+            return
+        self.fetching.add(key)
+        start, end = windows.bounds(index)
+        self.pool.start(self.calendar.getEventWindow, windows.calendarID, start, end,
+                        result=lambda items: self.windowFetched(windows, key, items),
+                        finished=lambda: self.fetching.discard(key))
+
+    def windowFetched(self, windows: EventWindows, key: Tuple[str, datetime.datetime], items: List[dict]) -> None:
+        self.windowCache.put(key, items)
+        if windows.calendarID == self.currentCalendarID:
+            self.showWindows(windows.calendarID)
+
+    def showWindows(self, calendarID: str) -> None:
+        """Fill the table with the windows of events shown for a calendar, taken from its store once it is synced"""
+        windows = self.windowsFor(calendarID)
+        stored = self.calendar.windowEvents(calendarID, windows.anchor, windows.horizon)
+        if stored is not None:
+            items, latest = stored
+            windows.until = latest if latest is not None else windows.anchor
+        else:
+            loaded = []
+            for index in range(windows.count):
+                window = self.windowCache.get(windows.key(index))
+                if window is None:
+                    break
+                loaded.append(window)
+            items = merge(loaded)
+            # Fetch the first missing window, or prefetch the next one so it is ready when it is scrolled to
+            if len(loaded) < windows.count or not windows.complete:
+                self.fetchWindow(windows, len(loaded))
+        self.fillTable(calendarID, items)
+        self.loadMore()
+
+    def loadMore(self) -> None:
+        """Show the next window of events if the table is scrolled close to its end, or doesn't fill the view yet"""
+        windows = self.windows.get(self.currentCalendarID)
+        if windows is None or windows.complete:
+            return
+        bottom = self.eventsView.rowAt(self.eventsView.viewport().height() - 1)
+        if bottom != -1 and bottom < self.eventsModel.rowCount() - PREFETCH_ROWS:
+            return
+
+        store = self.calendar.stores.get(windows.calendarID)
+        if store is None or store.syncToken is None:
+            # Wait for the windows shown so far, and don't show more than can be cached until the calendar is synced
+            if windows.count + 1 >= MAX_CACHED_WINDOWS or self.windowCache.get(windows.key(windows.count - 1)) is None:
+                return
+            windows.count += 1
+        else:
+            # Stored windows are free to show, so sparse calendars skip ahead quickly while the view isn't full
+            windows.count += windows.count if bottom == -1 else 1
+        logger.debug(f'Showing {windows.count} windows of Calendar {windows.calendarID}')
+        self.showWindows(windows.calendarID)
+
+    def reconcileHistory(self, calendarID: str) -> None:
+        """Prune events deleted outside of the application from the undo history in the background"""
+        self.pool.start(self.historyManager.reconcile, self.calendar, calendarID,
+                        result=lambda removed: self.historyReconciled(calendarID, removed))
+
+    def historyReconciled(self, calendarID: str, removed: int) -> None:
+        if removed > 0:
+            self.tables.invalidate(calendarID)
+            if calendarID == self.currentCalendarID:
+                self.fillTable(calendarID, self.apiEvents)
+
+    def fillTable(self, calendarID: str, apiEvents: List[dict]) -> None:
         """Re-populate the table with all of the events"""
-        self.apiEvents = self.calendar.getEvents(self.currentCalendarID)
-
-        events = list(self.readyEvents)
-        events.extend([Event.from_api(event, self.history) for event in self.apiEvents])
-
-        ready, undoable, foreign = len(self.readyEvents), len(self.history), len(list(self.getForeign()))
-        total = ready + undoable + foreign
-        self.eventCountLabel.setText(f'{len(self.readyEvents)} ready, {undoable} undoable, {foreign} foreign ({total})')
-
-        self.eventsView.setRowCount(len(events))
-        logger.debug(f'Populating table with {self.eventsView.rowCount()} events.')
-        for row, event in enumerate(events):
-            logger.debug(f'Event "{event.summary}" starts {event.start} and ends {event.end}')
-            event.fill_row(row, self.eventsView)
-
-        self.submitButton.setDisabled(len(self.readyEvents) < 0)
+        if calendarID != self.currentCalendarID:
+            logger.debug(f'Discarding stale events from Calendar {calendarID}')
+            return
+        self.apiEvents = apiEvents
+
+        table = self.tables.get(calendarID)
+        if table is None or not same_items(table.apiEvents, apiEvents):
+            rows, counts = api.classify([], apiEvents, self.historyManager.eventIDs(calendarID))
+            table = CalendarTable(apiEvents, rows, counts)
+            self.tables.put(calendarID, table)
+        self.showTable(calendarID, table)
+
+    def showTable(self, calendarID: str, table: CalendarTable) -> None:
+        """Show the ready events followed by a calendar's events in the table"""
+        events = self.readyEvents + table.rows
+        ready, undoable, foreign = len(self.readyEvents), table.counts['Undoable'], table.counts['Foreign']
+        self.eventCountLabel.setText(f'{ready} ready, {undoable} undoable, {foreign} foreign ({len(events)})')
+
+        if calendarID != self.tableCalendarID:
+            logger.debug(f'Populating table with {len(events)} events.')
+            self.eventsModel.setEvents(events)
+            self.tableCalendarID = calendarID
+        else:
+            changed = self.eventsModel.updateEvents(events)
+            logger.debug(f'Updated {changed} rows of the table ({len(events)} events).')
+        if not startup.reported:
+            startup.mark('first rows')
+            startup.report()
+
+        self.setBusy(self.busy)
 
     @QtCore.pyqtSlot(int)
     def comboBoxChanged(self, row) -> None:
         """When the Calendar Selection combobox"""
         self.currentCalendarID = self.comboModel.item(row).data()
         logger.info(f'Switching to Calendar "{self.comboModel.item(row).text()} ({self.currentCalendarID})"')
+
+        # Recently viewed calendars are shown straight away and refreshed in the background
+        table = self.tables.get(self.currentCalendarID)
+        if table is not None:
+            self.apiEvents = table.apiEvents
+            self.showTable(self.currentCalendarID, table)
         self.populate()
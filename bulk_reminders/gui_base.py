@@ -24,10 +24,8 @@ class Ui_MainWindow(object):
         self.centralwidget.setObjectName("centralwidget")
         self.gridLayout = QtWidgets.QGridLayout(self.centralwidget)
         self.gridLayout.setObjectName("gridLayout")
-        self.eventsView = QtWidgets.QTableWidget(self.centralwidget)
+        self.eventsView = QtWidgets.QTableView(self.centralwidget)
         self.eventsView.setObjectName("eventsView")
-        self.eventsView.setColumnCount(0)
-        self.eventsView.setRowCount(0)
         self.gridLayout.addWidget(self.eventsView, 1, 0, 1, 1)
         self.verticalLayout = QtWidgets.QVBoxLayout()
         self.verticalLayout.setObjectName("verticalLayout")
@@ -0,0 +1,259 @@
+"""Streaming importers turning files exported by other applications into events.
+
+Every importer reads a file lazily and yields an Event or a LineError for each record, so files of any size are
+imported with bounded memory: read -> parse -> normalize -> Event, one record at a time."""
+import csv
+import datetime
+import functools
+import logging
+import os
+import re
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple, Union
+
+from dateutil import tz
+from dateutil.parser import parse as parse_date
+
+from bulk_reminders.api import Event
+from bulk_reminders.parser import LineError, LineParser
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+Result = Union[Event, LineError]
+Importer = Callable[[TextIO], Iterator[Result]]
+
+# Recognized CSV column names, lowercase. The first set matches the columns Google Calendar imports and exports.
+CSV_COLUMNS = {
+    'summary': ('subject', 'summary', 'title', 'name', 'event'),
+    'startDate': ('start date', 'start', 'date', 'start_date', 'startdate', 'dtstart'),
+    'startTime': ('start time', 'start_time', 'starttime', 'time'),
+    'endDate': ('end date', 'end', 'end_date', 'enddate', 'dtend'),
+    'endTime': ('end time', 'end_time', 'endtime'),
+    'allDay': ('all day event', 'all day', 'all_day', 'allday'),
+    'description': ('description', 'notes', 'details'),
+    'recurrence': ('recurrence', 'rrule'),
+}
+TRUE_VALUES = {'true', 'yes', 'y', '1', 'x'}
+TIME_REGEX = re.compile(r'\d:\d\d')
+
+ICS_DATETIME_REGEX = re.compile(r'(\d{8})T(\d{6})(Z?)')
+ICS_DURATION_REGEX = re.compile(r'([+-]?)P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?')
+ICS_ESCAPE_REGEX = re.compile(r'\\([\\;,nN])')
+ICS_RECURRENCE = ('RRULE', 'RDATE', 'EXRULE', 'EXDATE')
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_value(text: str) -> datetime.datetime:
+    """Parses a date or date and time in any common format, memoized as exports repeat the same values."""
+    return parse_date(text)
+
+
+def csv_column(header: List[str], field: str) -> Optional[int]:
+    names = [name.strip().lower() for name in header]
+    for candidate in CSV_COLUMNS[field]:
+        if candidate in names:
+            return names.index(candidate)
+    return None
+
+
+def csv_event(values: Dict[str, str]) -> Event:
+    """Creates an event from the recognized fields of a CSV row.
+
+    Timed events without an end last no time at all, like events entered as text. All-day events become date events,
+    their end date is exclusive like in the API, but an end on the start day means a single day."""
+    summary = values.get('summary', '').strip()
+    if not summary:
+        raise ValueError('Missing summary')
+    startDate, startTime = values.get('startDate', '').strip(), values.get('startTime', '').strip()
+    endDate, endTime = values.get('endDate', '').strip(), values.get('endTime', '').strip()
+    if not startDate:
+        raise ValueError('Missing start date')
+
+    allDay = values.get('allDay', '').strip().lower() in TRUE_VALUES or not (startTime or TIME_REGEX.search(startDate))
+    description = values.get('description', '').strip() or None
+    recurrence = [line.strip() for line in values.get('recurrence', '').splitlines() if line.strip()] or None
+    if allDay:
+        start = parse_value(startDate).date()
+        end = parse_value(endDate).date() if endDate else start
+        return Event(summary, start, max(end, start + datetime.timedelta(days=1)), description, status='Ready',
+                     recurrence=recurrence)
+
+    start = parse_value(f'{startDate} {startTime}'.strip())
+    if endDate or endTime:
+        end = parse_value(f'{endDate or startDate} {endTime}'.strip())
+    else:
+        end = start
+    if end < start:
+        raise ValueError('The event ends before it starts')
+    return Event(summary, start, end, description, status='Ready', recurrence=recurrence)
+
+
+def read_csv(file: TextIO) -> Iterator[Result]:
+    """Yields an event for every row of a CSV file with a header naming at least the summary and start date columns."""
+    reader = csv.reader(file)
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = {field: csv_column(header, field) for field in CSV_COLUMNS}
+    columns = {field: index for field, index in columns.items() if index is not None}
+    if 'summary' not in columns or 'startDate' not in columns:
+        yield LineError(1, ','.join(header), 'Expected a header with summary and start date columns, e.g. "Subject,Start Date"')
+        return
+
+    for row in reader:
+        if not any(value.strip() for value in row):
+            continue
+        try:
+            yield csv_event({field: row[index] if index < len(row) else '' for field, index in columns.items()})
+        except (ValueError, OverflowError) as e:
+            yield LineError(reader.line_num, ','.join(row), str(e))
+
+
+def ics_lines(file: TextIO) -> Iterator[Tuple[int, str]]:
+    """Unfolds the lines of an iCalendar file, yielding each content line along with the number it starts on."""
+    number, current = 0, None
+    for index, line in enumerate(file, start=1):
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield number, current
+        number, current = index, line
+    if current is not None:
+        yield number, current
+
+
+def ics_property(line: str) -> Tuple[str, Dict[str, str], str]:
+    """Splits a content line into its upper case name, parameters and value."""
+    quoted = False
+    for index, character in enumerate(line):
+        if character == '"':
+            quoted = not quoted
+        elif character == ':' and not quoted:
+            break
+    else:
+        raise ValueError(f'Invalid line "{line}"')
+    name, *parameters = line[:index].split(';')
+    return name.upper(), dict(parameter.split('=', 1) for parameter in parameters if '=' in parameter), line[index + 1:]
+
+
+def ics_text(value: str) -> str:
+    return ICS_ESCAPE_REGEX.sub(lambda match: '\n' if match.group(1) in 'nN' else match.group(1), value)
+
+
+def ics_time(parameters: Dict[str, str], value: str) -> Union[datetime.date, datetime.datetime]:
+    """Parses a DTSTART or DTEND value. Times in UTC or with a known TZID are timezone aware, floating times are local."""
+    if parameters.get('VALUE', '').upper() == 'DATE' or len(value) == 8:
+        return datetime.datetime.strptime(value, '%Y%m%d').date()
+    match = ICS_DATETIME_REGEX.fullmatch(value)
+    if match is None:
+        raise ValueError(f'Invalid date and time "{value}"')
+    result = datetime.datetime.strptime(match.group(1) + match.group(2), '%Y%m%d%H%M%S')
+    if match.group(3):
+        return result.replace(tzinfo=datetime.timezone.utc)
+    zone = tz.gettz(parameters['TZID'].strip('"')) if 'TZID' in parameters else None
+    return result.replace(tzinfo=zone) if zone is not None else result
+
+
+def ics_duration(value: str) -> datetime.timedelta:
+    match = ICS_DURATION_REGEX.fullmatch(value)
+    if match is None:
+        raise ValueError(f'Invalid duration "{value}"')
+    weeks, days, hours, minutes, seconds = (int(group or 0) for group in match.groups()[1:])
+    duration = datetime.timedelta(weeks=weeks, days=days, hours=hours, minutes=minutes, seconds=seconds)
+    return -duration if match.group(1) == '-' else duration
+
+
+def ics_event(lines: List[str]) -> Optional[Event]:
+    """Creates an event from the content lines of a VEVENT, or returns None if it was cancelled."""
+    fields: Dict[str, Tuple[Dict[str, str], str]] = {}
+    recurrence = []
+    for line in lines:
+        name, parameters, value = ics_property(line)
+        if name in ICS_RECURRENCE:
+            recurrence.append(line)
+        elif name not in fields:
+            fields[name] = parameters, value
+
+    if 'RECURRENCE-ID' in fields:
+        raise ValueError('Changed occurrences of a recurring event are not supported')
+    if fields.get('STATUS', ({}, ''))[1].upper() == 'CANCELLED':
+        return None
+    if 'DTSTART' not in fields:
+        raise ValueError('Missing DTSTART')
+
+    start = ics_time(*fields['DTSTART'])
+    if 'DTEND' in fields:
+        end = ics_time(*fields['DTEND'])
+    elif 'DURATION' in fields:
+        end = start + ics_duration(fields['DURATION'][1])
+    else:
+        end = start + datetime.timedelta(days=1) if type(start) is datetime.date else start
+    if type(start) is not type(end):
+        raise ValueError('DTSTART and DTEND must both be dates or both be dates and times')
+    if end < start:
+        raise ValueError('The event ends before it starts')
+
+    summary = ics_text(fields.get('SUMMARY', ({}, ''))[1]).strip()
+    description = ics_text(fields['DESCRIPTION'][1]).strip() if 'DESCRIPTION' in fields else None
+    return Event(summary or '(No title)', start, end, description or None, status='Ready', recurrence=recurrence or None)
+
+
+def read_ics(file: TextIO) -> Iterator[Result]:
+    """Yields an event for every VEVENT of an iCalendar file. Nested components like alarms are skipped."""
+    lines: Optional[List[str]] = None
+    start, depth = 0, 0
+    for number, line in ics_lines(file):
+        upper = line.upper()
+        if upper == 'BEGIN:VEVENT':
+            lines, start, depth = [], number, 0
+        elif lines is None:
+            continue
+        elif upper.startswith('BEGIN:'):
+            depth += 1
+        elif upper.startswith('END:') and depth > 0:
+            depth -= 1
+        elif upper == 'END:VEVENT':
+            try:
+                event = ics_event(lines)
+                if event is not None:
+                    yield event
+            except (ValueError, OverflowError) as e:
+                yield LineError(start, 'BEGIN:VEVENT', str(e))
+            lines = None
+        elif depth == 0:
+            lines.append(line)
+
+
+def read_text(file: TextIO) -> Iterator[Result]:
+    """The "Summary | date [time] [date [time]]" format of the load dialog."""
+    return LineParser(caching=False).parse(file)
+
+
+IMPORTERS: Dict[str, Importer] = {'text': read_text, 'csv': read_csv, 'ics': read_ics}
+EXTENSIONS: Dict[str, str] = {'.csv': 'csv', '.ics': 'ics', '.ical': 'ics', '.ifb': 'ics'}
+
+
+def register(format: str, importer: Importer, extensions: Iterable[str] = ()) -> None:
+    """Add an importer for another format, used for files with the given extensions."""
+    IMPORTERS[format] = importer
+    for extension in extensions:
+        EXTENSIONS[extension.lower()] = format
+
+
+def detect(path: str) -> str:
+    """The format of a file, judged by its extension. Anything unknown is read as text."""
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower(), 'text')
+
+
+def open_file(path: str) -> TextIO:
+    """Opens a file for any importer. Exports from other applications often start with a byte order mark."""
+    return open(path, 'r', encoding='utf-8-sig', newline='')
+
+
+def read_file(path: str, format: Optional[str] = None) -> Iterator[Result]:
+    """Streams the events of a file in the given format, detected from its name if not given."""
+    importer = IMPORTERS[format or detect(path)]
+    with open_file(path) as file:
+        yield from importer(file)
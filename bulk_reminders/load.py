@@ -1,21 +1,21 @@
 import logging
 import os
-import re
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 from PyQt5.QtCore import QSize, QTimer
 from PyQt5.QtGui import QMovie
-from PyQt5.QtWidgets import QApplication, QDialog, QLabel
+from PyQt5.QtWidgets import QDialog, QFileDialog, QLabel
 
+from bulk_reminders import importers
 from bulk_reminders.api import Event
 from bulk_reminders.load_base import Ui_Dialog
+from bulk_reminders.parser import LineError, LineParser
+from bulk_reminders.recurrence import compress
+from bulk_reminders.workers import WorkerPool
 
 logger = logging.getLogger(__file__)
 logger.setLevel(logging.DEBUG)
 
-REGEX_FULL_PARSE = re.compile(
-    r'\s*([\w\d\s,.;\'!#$%^&*@\[\]()+-_=`~?<>]+)\s+\|\s+(\d{4}-\d{2}-\d{2})\s*(\d{1,2}:\d{2}(?:AM|PM))?\s*(\d{4}-\d{2}-\d{2})?\s*(\d{1,2}:\d{2}(?:AM|PM))?')
-
 
 class LoadDialog(QDialog, Ui_Dialog):
     def __init__(self, *args, **kwargs):
@@ -33,31 +33,122 @@ class LoadDialog(QDialog, Ui_Dialog):
         self.horizontalLayout.addWidget(self.spinner)
 
         self.plainTextEdit.textChanged.connect(self.edited)
+        self.recurringCheckBox.toggled.connect(self.recurringToggled)
+        self.toolButton.setToolTip('Import a text, CSV or iCalendar file')
+        self.toolButton.clicked.connect(self.openFile)
         self.parseTimer = QTimer()
         self.parseTimer.timeout.connect(self.parse)
         self.parseTimer.setSingleShot(True)
 
+        # A single parsing thread, so the line cache is never used by two parses at once
+        self.parser = LineParser()
+        self.pool = WorkerPool(maxThreads=1)
+        self.generation = 0
         self.parsed: List[Event] = []
+        self.errors: List[LineError] = []
+        self.file: Optional[str] = None  # Imported instead of the text, until the text is edited
+        self.fileResult: Optional[Tuple[str, bool, Tuple[List[Event], List[LineError]]]] = None
+        self.textResult: Optional[Tuple[str, bool, Tuple[List[Event], List[LineError]]]] = None
+        self.accepting = False  # Whether the dialog closes once the parse running in the background finishes
         self.eventCountLabel.setText('0 groups found.')
 
         self.show()
 
     def parse(self) -> None:
-        """Parse the events entered into the dialog"""
-        self.spinner.hide()
-        results = [result.groups() for result in re.finditer(REGEX_FULL_PARSE, self.plainTextEdit.toPlainText())]
-        resultsText = f'{len(results)} group{"s" if len(results) != 1 else ""} found.'
+        """Parse the events entered into the dialog in the background"""
+        self.generation += 1
+        generation = self.generation
+        self.pool.start(self.parseText, self.plainTextEdit.toPlainText(), self.recurringCheckBox.isChecked(),
+                        result=lambda result: self.parsingFinished(generation, result))
+
+    def parseText(self, text: str, recurring: bool) -> Tuple[List[Event], List[LineError]]:
+        """Parse the text, combining repeating events into recurring ones if requested"""
+        events, errors = self.parser.parse_text(text)
+        if recurring:
+            events = compress(events)
+        self.textResult = (text, recurring, (events, errors))
+        return events, errors
+
+    def openFile(self) -> None:
+        """Choose a file to import. It is streamed from disk rather than loaded into the text box."""
+        path, _ = QFileDialog.getOpenFileName(self, 'Import Events', '', 'Events (*.txt *.csv *.ics);;All Files (*)')
+        if not path:
+            return
+        self.file = path
+        self.parseTimer.stop()
+        self.parseFile()
+
+    def parseFile(self) -> None:
+        """Import the chosen file in the background"""
+        self.generation += 1
+        generation = self.generation
+        self.spinner.show()
+        self.pool.start(self.importFile, self.file, self.recurringCheckBox.isChecked(),
+                        result=lambda result: self.parsingFinished(generation, result))
+
+    def importFile(self, path: str, recurring: bool) -> Tuple[List[Event], List[LineError]]:
+        """Read every event of a file, combining repeating events into recurring ones if requested"""
+        events, errors = [], []
         try:
-            self.parsed = list(map(Event.parse_raw, results))
-            for event in self.parsed:
-                logger.debug(f'Parsed: Event "{event.summary}" starts {event.start} and ends {event.end}')
-        except ValueError as error:
-            logger.warning('Dialog input has data errors (invalid dates etc.)', exc_info=error)
-            resultsText += ' Data error.'
+            for result in importers.read_file(path):
+                (errors if isinstance(result, LineError) else events).append(result)
+        except (OSError, UnicodeDecodeError) as e:
+            logger.error(f'Failed to import {path}', exc_info=e)
+            errors.append(LineError(0, path, str(e)))
+        if recurring:
+            events = compress(events)
+        self.fileResult = (path, recurring, (events, errors))
+        return events, errors
+
+    def parsingFinished(self, generation: int, result: Tuple[List[Event], List[LineError]]) -> None:
+        """Display the results of a parse, unless the text was edited again while it was running"""
+        if generation != self.generation or self.parseTimer.isActive():
+            return
+
+        self.spinner.hide()
+        self.parsed, self.errors = result
+        resultsText = f'{len(self.parsed)} group{"s" if len(self.parsed) != 1 else ""} found'
+        resultsText += f' in {os.path.basename(self.file)}.' if self.file is not None else '.'
+        recurring = sum(1 for event in self.parsed if event.recurrence is not None)
+        if recurring > 0:
+            resultsText += f' {recurring} recurring.'
+        if len(self.errors) > 0:
+            logger.warning(f'Dialog input has {len(self.errors)} invalid lines')
+            resultsText += f' {len(self.errors)} error{"s" if len(self.errors) != 1 else ""}.'
         self.eventCountLabel.setText(resultsText)
+        self.eventCountLabel.setToolTip('\n'.join(map(str, self.errors[:20])))
+        if self.accepting:
+            super(LoadDialog, self).accept()
+
+    def accept(self) -> None:
+        """Close with the results of the latest text or file, parsing it in the background first if needed"""
+        self.parseTimer.stop()
+        recurring = self.recurringCheckBox.isChecked()
+        if self.file is None:
+            latest, source = self.textResult, self.plainTextEdit.toPlainText()
+        else:
+            latest, source = self.fileResult, self.file
+        if latest is not None and latest[:2] == (source, recurring):
+            self.parsed, self.errors = latest[2]
+            super(LoadDialog, self).accept()
+            return
+
+        self.accepting = True
+        if self.file is None:
+            self.spinner.show()
+            self.parse()
+        else:
+            self.parseFile()
+
+    def recurringToggled(self) -> None:
+        if self.file is not None:
+            self.parseFile()
+        else:
+            self.edited()
 
     def edited(self) -> None:
         """Prepare a timer to be fired to parse the edited text"""
+        self.file = None
         self.parseTimer.stop()
         self.spinner.show()
         self.parseTimer.start(500)  # 0.5 seconds
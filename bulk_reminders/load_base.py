@@ -28,6 +28,9 @@ class Ui_Dialog(object):
         self.eventCountLabel = QtWidgets.QLabel(Dialog)
         self.eventCountLabel.setObjectName("eventCountLabel")
         self.horizontalLayout.addWidget(self.eventCountLabel)
+        self.recurringCheckBox = QtWidgets.QCheckBox(Dialog)
+        self.recurringCheckBox.setObjectName("recurringCheckBox")
+        self.horizontalLayout.addWidget(self.recurringCheckBox)
         self.buttonBox = QtWidgets.QDialogButtonBox(Dialog)
         self.buttonBox.setOrientation(QtCore.Qt.Horizontal)
         self.buttonBox.setStandardButtons(QtWidgets.QDialogButtonBox.Cancel|QtWidgets.QDialogButtonBox.Ok)
@@ -46,3 +49,5 @@ class Ui_Dialog(object):
         Dialog.setWindowTitle(_translate("Dialog", "Load Events"))
         self.toolButton.setText(_translate("Dialog", "..."))
         self.eventCountLabel.setText(_translate("Dialog", "3 events found."))
+        self.recurringCheckBox.setToolTip(_translate("Dialog", "Submit events repeating at a fixed interval as a single recurring event"))
+        self.recurringCheckBox.setText(_translate("Dialog", "Combine repeating"))
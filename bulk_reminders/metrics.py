@@ -0,0 +1,162 @@
+import bisect
+import contextlib
+import cProfile
+import io
+import logging
+import pstats
+import threading
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+PREFIX = 'bulk_reminders_api'
+
+
+class Histogram(object):
+    """Counts observations into cumulative buckets, like a Prometheus histogram."""
+
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last bucket holds everything above the largest bound
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """(upper bound, number of observations at or below it) for every bucket, ending with +Inf."""
+        total, result = 0, []
+        for bound, count in zip([*map(str, self.buckets), '+Inf'], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q: float) -> Optional[float]:
+        """An estimate of the q-quantile: the upper bound of the bucket it falls in."""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float('inf')
+
+    def to_json(self) -> dict:
+        return {'buckets': dict(self.cumulative()), 'sum': self.sum, 'count': self.count}
+
+
+class Metrics(object):
+    """Thread-safe counters and histograms of every API call, grouped by endpoint (e.g. calendar.events.insert)."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.calls: Dict[Tuple[str, int], int] = defaultdict(int)  # Keyed by endpoint and status code
+        self.retries: Dict[str, int] = defaultdict(int)
+        self.sent: Dict[str, int] = defaultdict(int)
+        self.received: Dict[str, int] = defaultdict(int)
+        self.latency: Dict[str, Histogram] = {}
+        self.sizes: Dict[str, Histogram] = {}
+
+    def record(self, endpoint: str, status: int, seconds: float, sent: int = 0, received: int = 0, retries: int = 0) -> None:
+        """Record a completed call. The status is 0 if no HTTP response was received at all."""
+        with self.lock:
+            self.calls[(endpoint, status)] += 1
+            self.retries[endpoint] += retries
+            self.sent[endpoint] += sent
+            self.received[endpoint] += received
+            if endpoint not in self.latency:
+                self.latency[endpoint] = Histogram(LATENCY_BUCKETS)
+                self.sizes[endpoint] = Histogram(SIZE_BUCKETS)
+            self.latency[endpoint].observe(seconds)
+            self.sizes[endpoint].observe(sent + received)
+
+    def reset(self) -> None:
+        with self.lock:
+            for values in (self.calls, self.retries, self.sent, self.received, self.latency, self.sizes):
+                values.clear()
+
+    def summary(self) -> List[dict]:
+        """One row of totals per endpoint, for display."""
+        with self.lock:
+            rows = []
+            for endpoint, histogram in sorted(self.latency.items()):
+                statuses = {status: count for (name, status), count in self.calls.items() if name == endpoint}
+                rows.append({'endpoint': endpoint, 'calls': histogram.count,
+                             'errors': sum(count for status, count in statuses.items() if not 200 <= status < 400),
+                             'retries': self.retries[endpoint], 'p50': histogram.quantile(0.5),
+                             'p95': histogram.quantile(0.95), 'mean': histogram.sum / histogram.count,
+                             'sent': self.sent[endpoint], 'received': self.received[endpoint]})
+            return rows
+
+    def to_json(self) -> dict:
+        with self.lock:
+            return {endpoint: {'calls': {str(status): count for (name, status), count in self.calls.items() if name == endpoint},
+                               'retries': self.retries[endpoint], 'sentBytes': self.sent[endpoint],
+                               'receivedBytes': self.received[endpoint], 'latencySeconds': histogram.to_json(),
+                               'payloadBytes': self.sizes[endpoint].to_json()}
+                    for endpoint, histogram in sorted(self.latency.items())}
+
+    def to_prometheus(self) -> str:
+        """The metrics in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            lines.append(f'# HELP {PREFIX}_calls_total API calls by endpoint and HTTP status (0 if none was received).')
+            lines.append(f'# TYPE {PREFIX}_calls_total counter')
+            for (endpoint, status), count in sorted(self.calls.items()):
+                lines.append(f'{PREFIX}_calls_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+            for name, values, text in (('retries', self.retries, 'Retries of throttled or failed calls.'),
+                                       ('sent_bytes', self.sent, 'Bytes of request bodies sent.'),
+                                       ('received_bytes', self.received, 'Bytes of response bodies received.')):
+                lines.append(f'# HELP {PREFIX}_{name}_total {text}')
+                lines.append(f'# TYPE {PREFIX}_{name}_total counter')
+                for endpoint, value in sorted(values.items()):
+                    lines.append(f'{PREFIX}_{name}_total{{endpoint="{endpoint}"}} {value}')
+            for name, histograms, text in (('latency_seconds', self.latency, 'Time taken by calls, including retries.'),
+                                           ('payload_bytes', self.sizes, 'Bytes sent and received by calls.')):
+                lines.append(f'# HELP {PREFIX}_{name} {text}')
+                lines.append(f'# TYPE {PREFIX}_{name} histogram')
+                for endpoint, histogram in sorted(histograms.items()):
+                    for bound, count in histogram.cumulative():
+                        lines.append(f'{PREFIX}_{name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+                    lines.append(f'{PREFIX}_{name}_sum{{endpoint="{endpoint}"}} {histogram.sum}')
+                    lines.append(f'{PREFIX}_{name}_count{{endpoint="{endpoint}"}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+@contextlib.contextmanager
+def profiled(path: Optional[str], limit: int = 25) -> Iterator[None]:
+    """Capture a cProfile of the enclosed block (on the current thread only) into a file, logging the slowest
+    functions. Does nothing if no path is given."""
+    if path is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(limit)
+        logger.info(f'Saved profile to {path}\n{output.getvalue()}')
+
+
+def profile_generator(generator: Iterator, path: Optional[str]) -> Iterator:
+    """Profile a generator on whichever thread iterates it, for operations that run on worker threads."""
+    with profiled(path):
+        yield from generator
+
+
+# Shared by every Calendar, so a whole run can be exported
+registry = Metrics()
@@ -0,0 +1,172 @@
+import itertools
+import logging
+from typing import Any, Dict, Hashable, Iterable, List, Optional
+
+from PyQt5 import QtGui
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+
+from bulk_reminders.api import Event
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+HEADERS = ['Summary', 'Status', 'Start', 'End']
+SUMMARY_COLOR = QtGui.QColor('blue')
+MAX_UPDATE_RANGES = 100  # Above this many changed ranges, the whole model is reset instead
+
+
+def rowIdentity(event: Event) -> Hashable:
+    """Identifies the event a row shows, even if its fields changed."""
+    return id(event) if event.eventID is None else event.eventID
+
+
+def rowKey(event: Event) -> Hashable:
+    """Identifies everything a row displays, so rows that did not change can be told apart from ones that did."""
+    if event.eventID is None:
+        # Events that were not submitted yet are the same objects every time the table is filled
+        return id(event)
+    return (event.eventID, event.status, event.summary, event.start, event.end, event.description,
+            tuple(event.recurrence or ()))
+
+
+class EventTableModel(QAbstractTableModel):
+    """A table model backed by a plain list of Event objects. Cells are only formatted when the view asks for them."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super(EventTableModel, self).__init__(*args, **kwargs)
+        self.events: List[Event] = []
+        self._rows: Optional[Dict[int, int]] = None
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.events)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(HEADERS)
+
+    def headerData(self, section: int, orientation: Qt.Orientation, role: int = Qt.DisplayRole) -> Any:
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return HEADERS[section]
+        return None
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole) -> Any:
+        if not index.isValid():
+            return None
+
+        event = self.events[index.row()]
+        column = index.column()
+        if role == Qt.DisplayRole:
+            if column == 0:
+                return event.title
+            elif column == 1:
+                return event.status
+            elif column == 2:
+                return event.display[0]
+            elif column == 3:
+                return event.display[1]
+        elif role == Qt.ForegroundRole and column == 0:
+            return SUMMARY_COLOR
+        return None
+
+    def row(self, event: Event) -> int:
+        """Returns the row an Event object is displayed in, or -1 if it isn't in the model."""
+        if self._rows is None:
+            self._rows = {id(event): row for row, event in enumerate(self.events)}
+        return self._rows.get(id(event), -1)
+
+    def setEvents(self, events: List[Event]) -> None:
+        """Replace every row in the model."""
+        self.beginResetModel()
+        self.events = events
+        self._rows = None
+        self.endResetModel()
+
+    def updateEvents(self, events: List[Event]) -> int:
+        """Replace the rows with the given events, only removing and inserting the rows that differ so the view keeps
+        its scroll position and selection. Returns the number of rows removed and inserted.
+
+        Both lists are walked once, matching rows by the event they show. Rows that moved are removed and inserted
+        again. If rows can't be told apart or too much changed, the model is reset instead."""
+        old = self.events
+        oldIDs = [rowIdentity(event) for event in old]
+        newIDs = [rowIdentity(event) for event in events]
+        remainingOld, remainingNew = set(oldIDs), set(newIDs)
+        if len(old) == 0 or len(events) == 0 or len(remainingOld) < len(old) or len(remainingNew) < len(events):
+            changed = len(old) + len(events)
+            self.setEvents(events)
+            return changed
+
+        # Each range [start, count, added] removes count rows, then inserts the added rows, at a row of the updated model
+        ranges: List[list] = []
+        i = j = 0
+
+        def change(removed: int, inserted: List[Event]) -> None:
+            # Rows of the updated model before j are final, so changes right after the last range extend it
+            if len(ranges) == 0 or ranges[-1][0] + len(ranges[-1][2]) != j:
+                ranges.append([j, 0, []])
+            ranges[-1][1] += removed
+            ranges[-1][2].extend(inserted)
+
+        while i < len(old) or j < len(events):
+            if i < len(old) and j < len(events) and oldIDs[i] == newIDs[j]:
+                remainingOld.discard(oldIDs[i])
+                remainingNew.discard(newIDs[j])
+                if rowKey(old[i]) != rowKey(events[j]):
+                    change(1, [events[j]])
+                i, j = i + 1, j + 1
+            elif i < len(old) and (j == len(events) or oldIDs[i] not in remainingNew or newIDs[j] in remainingOld):
+                # Gone, moved further down, or in the way of a row that is still to come
+                remainingOld.discard(oldIDs[i])
+                change(1, [])
+                i += 1
+            else:
+                remainingNew.discard(newIDs[j])
+                change(0, [events[j]])
+                j += 1
+
+        changed = sum(count + len(added) for start, count, added in ranges)
+        if len(ranges) > MAX_UPDATE_RANGES:
+            self.setEvents(events)
+            return changed
+
+        for start, count, added in ranges:
+            if count > 0:
+                self.beginRemoveRows(QModelIndex(), start, start + count - 1)
+                del self.events[start:start + count]
+                self.endRemoveRows()
+            if len(added) > 0:
+                self.beginInsertRows(QModelIndex(), start, start + len(added) - 1)
+                self.events[start:start] = added
+                self.endInsertRows()
+        self._rows = None
+        return changed
+
+    def insertEvents(self, row: int, events: List[Event]) -> None:
+        """Insert new rows starting at the given row."""
+        if len(events) == 0:
+            return
+        self.beginInsertRows(QModelIndex(), row, row + len(events) - 1)
+        self.events[row:row] = events
+        self._rows = None
+        self.endInsertRows()
+
+    def removeEvents(self, events: Iterable[Event]) -> None:
+        """Remove the rows of the given events, one contiguous range at a time, or by resetting the model if there are
+        too many ranges."""
+        rows = sorted({self.row(event) for event in events} - {-1}, reverse=True)
+        # From the bottom up so earlier rows do not shift, rows in a contiguous range have the same row + offset
+        ranges = [[row for offset, row in group] for _, group in itertools.groupby(enumerate(rows), lambda pair: pair[0] + pair[1])]
+        if len(ranges) > MAX_UPDATE_RANGES:
+            removed = set(rows)
+            self.setEvents([event for row, event in enumerate(self.events) if row not in removed])
+            return
+        for group in ranges:
+            self.beginRemoveRows(QModelIndex(), group[-1], group[0])
+            del self.events[group[-1]:group[0] + 1]
+            self.endRemoveRows()
+        self._rows = None
+
+    def eventChanged(self, event: Event) -> None:
+        """Notify the view that an event's fields changed so only its row is repainted."""
+        row = self.row(event)
+        if row != -1:
+            self.dataChanged.emit(self.index(row, 0), self.index(row, len(HEADERS) - 1))
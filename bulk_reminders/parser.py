@@ -0,0 +1,85 @@
+import datetime
+import logging
+import re
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple, Union
+
+from bulk_reminders.api import Event
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+REGEX_FULL_PARSE = re.compile(
+    r'\s*([\w\d\s,.;\'!#$%^&*@\[\]()+-_=`~?<>]+)\s+\|\s+(\d{4}-\d{2}-\d{2})\s*(\d{1,2}:\d{2}(?:AM|PM))?\s*(\d{4}-\d{2}-\d{2})?\s*(\d{1,2}:\d{2}(?:AM|PM))?')
+
+# The parsed summary, start and end of a line, enough to cheaply create a new Event
+ParsedLine = Tuple[str, Union[datetime.date, datetime.datetime], Union[datetime.date, datetime.datetime]]
+
+
+class LineError(NamedTuple):
+    """A line of input that could not be parsed."""
+    line: int
+    text: str
+    message: str
+
+    def __str__(self) -> str:
+        return f'Line {self.line}: {self.message}'
+
+
+def parse_line(line: str) -> ParsedLine:
+    """Parses a single line of input. Raises a ValueError describing the problem if the line is invalid."""
+    match = REGEX_FULL_PARSE.match(line)
+    if match is None:
+        raise ValueError('Expected "Summary | YYYY-MM-DD [HH:MMAM] [YYYY-MM-DD [HH:MMPM]]"')
+    if line[match.end():].strip():
+        raise ValueError(f'Unexpected text "{line[match.end():].strip()}"')
+
+    event = Event.parse_raw(match.groups())
+    return event.summary.strip(), event.start, event.end
+
+
+class LineParser(object):
+    """Parses input line by line. Results are cached by line content, so only lines that changed are parsed again.
+
+    Caching can be disabled for one-off streams of input that should not be held in memory."""
+
+    def __init__(self, caching: bool = True) -> None:
+        self.caching = caching
+        self.cache: Dict[str, Union[ParsedLine, ValueError]] = {}
+
+    def parse(self, lines: Iterable[str]) -> Iterator[Union[Event, LineError]]:
+        """Yields a new Event for every valid line and a LineError for every invalid one. Blank lines are skipped."""
+        seen: Dict[str, Union[ParsedLine, ValueError]] = {}  # Results for the lines of this input, when caching
+        try:
+            for number, line in enumerate(lines, start=1):
+                line = line.rstrip('\r\n')
+                if not line.strip():
+                    continue
+
+                result = self.cache.get(line)
+                if result is None:
+                    try:
+                        result = parse_line(line)
+                    except ValueError as e:
+                        result = e
+                if self.caching:
+                    seen[line] = result
+
+                if isinstance(result, ValueError):
+                    yield LineError(number, line, str(result))
+                else:
+                    yield Event(summary=result[0], start=result[1], end=result[2], status='Ready')
+        finally:
+            # Only keep lines from the latest input so the cache can't grow without bound
+            if self.caching:
+                self.cache = seen
+
+    def parse_text(self, text: str) -> Tuple[List[Event], List[LineError]]:
+        """Parses a full block of text, returning the valid events and the errors separately."""
+        events, errors = [], []
+        for result in self.parse(text.splitlines()):
+            if isinstance(result, LineError):
+                errors.append(result)
+            else:
+                events.append(result)
+        logger.debug(f'Parsed {len(events)} events with {len(errors)} errors')
+        return events, errors
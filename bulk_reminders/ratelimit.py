@@ -0,0 +1,193 @@
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Optional, Tuple
+
+from googleapiclient.errors import HttpError
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+BACKOFF_FACTOR = 0.7  # Throttled schedulers slow down to this fraction of the rate the API accepted recently
+MEASURE_WINDOW = 5.0  # Seconds of successful requests the accepted rate is measured over
+TOKEN_EPSILON = 1e-9  # Refilling is inexact, so a bucket this close to enough tokens is considered full enough
+
+
+def error_reason(error: HttpError) -> Optional[str]:
+    """Extracts the machine readable reason (e.g. 'rateLimitExceeded') from an API error."""
+    try:
+        content = json.loads(error.content.decode('utf-8') if isinstance(error.content, bytes) else error.content)
+        return content['error']['errors'][0]['reason']
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+        return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Returns true if a request that failed with the given error should be tried again later."""
+    if not isinstance(error, HttpError):
+        return False
+    status = error.resp.status
+    return status in RETRYABLE_STATUSES or (status == 403 and error_reason(error) in RATE_LIMIT_REASONS)
+
+
+class TokenBucket(object):
+    """A thread-safe token bucket. Tokens refill continuously at the current rate up to the capacity."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate, self.capacity = rate, capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens: float = 1) -> None:
+        """Block until the given number of tokens are available and take them.
+
+        Requests costing more than the capacity (e.g. large batches) would wait forever otherwise, so they only wait for
+        a full bucket and take the rest on credit, delaying the requests after them."""
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= min(tokens, self.capacity) - TOKEN_EPSILON:
+                    self.tokens -= tokens
+                    return
+                wait = (min(tokens, self.capacity) - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def setRate(self, rate: float) -> None:
+        with self.lock:
+            self._refill()
+            self.rate = rate
+
+    def setCapacity(self, capacity: float) -> None:
+        with self.lock:
+            self._refill()
+            self.capacity = capacity
+            self.tokens = min(self.tokens, capacity)
+
+    def drain(self) -> None:
+        """Empty the bucket, e.g. after the API reported that its own quota ran out."""
+        with self.lock:
+            self._refill()
+            self.tokens = 0
+
+
+class RequestScheduler(object):
+    """Paces every API request made by a Calendar, retrying throttled and failed requests with exponential backoff.
+
+    The request rate and the number of requests in flight follow an additive increase, multiplicative decrease
+    scheme: they shrink when the API reports throttling and slowly grow back while requests succeed. The rate never
+    drops below a fraction of the rate the API accepted recently, so it stays close to the API's limit. Throttling
+    reported within the cooldown after slowing down is caused by the same overload (e.g. batches sent concurrently),
+    so it doesn't slow down any further.
+
+    Throttling also means the API's quota just ran out, so the token bucket is emptied and its capacity shrinks to the
+    burst the API accepted. Otherwise every large batch would be sent as one burst the API mostly rejects."""
+
+    def __init__(self, rate: float = 10.0, minRate: float = 1.0, maxRate: float = 50.0, concurrency: int = 4,
+                 maxRetries: int = 6, baseDelay: float = 1.0, maxDelay: float = 32.0, cooldown: float = 2.0) -> None:
+        self.minRate, self.maxRate = minRate, maxRate
+        self.cooldown = cooldown
+        self.slowed: Optional[float] = None  # When the scheduler last slowed down
+        self.accepted: Deque[Tuple[float, float]] = deque()  # The time and cost of recent successful requests
+        self.maxConcurrency = concurrency
+        self.concurrency = concurrency
+        self.maxRetries, self.baseDelay, self.maxDelay = maxRetries, baseDelay, maxDelay
+        self.bucket = TokenBucket(rate, capacity=max(rate, 50))
+        self.inflight = 0
+        self.condition = threading.Condition()
+        self.throttles = self.retries = 0
+
+    @property
+    def rate(self) -> float:
+        return self.bucket.rate
+
+    def backoff(self, attempt: int) -> float:
+        """Seconds to wait before the given retry attempt, with full jitter so threads don't retry in lockstep."""
+        return random.uniform(0, min(self.maxDelay, self.baseDelay * 2 ** attempt))
+
+    def acceptedRate(self, now: float) -> float:
+        """The requests per second that succeeded during the last few seconds."""
+        while len(self.accepted) > 0 and now - self.accepted[0][0] > MEASURE_WINDOW:
+            self.accepted.popleft()
+        if len(self.accepted) == 0:
+            return 0.0
+        return sum(cost for moment, cost in self.accepted) / max(1.0, now - self.accepted[0][0])
+
+    def throttled(self, burst: Optional[int] = None) -> None:
+        """Slow down after the API reported throttling or an overloaded server, unless it just did.
+
+        burst is the number of requests the API accepted at once before throttling the rest, if known."""
+        with self.condition:
+            self.throttles += 1
+            self.bucket.drain()
+            if burst is not None and 0 < burst < self.bucket.capacity:
+                self.bucket.setCapacity(burst)
+            now = time.monotonic()
+            if self.slowed is not None and now - self.slowed < self.cooldown:
+                return
+            self.slowed = now
+            self.concurrency = max(1, self.concurrency // 2)
+            rate, accepted = self.rate / 2, self.acceptedRate(now)
+            if accepted > 0:
+                # Stay close to the rate the API accepted: not far below it, and not above it after starting too fast
+                rate = max(BACKOFF_FACTOR * accepted, min(rate, accepted))
+            self.bucket.setRate(max(self.minRate, rate))
+            logger.warning(f'Throttled by the API, slowing down to {self.rate:.1f} requests/s and {self.concurrency} concurrent')
+
+    def succeeded(self, cost: float = 1) -> None:
+        """Speed back up a little after successful requests."""
+        if cost <= 0:
+            return
+        with self.condition:
+            self.accepted.append((time.monotonic(), cost))
+            self.bucket.setRate(min(self.maxRate, self.rate + 0.1 * cost))
+            if cost > self.bucket.capacity:
+                # The API accepted a larger burst than expected
+                self.bucket.setCapacity(cost)
+            if self.concurrency < self.maxConcurrency and random.random() < 0.1:
+                self.concurrency += 1
+                self.condition.notify()
+
+    def execute(self, run: Callable[[], Any], cost: float = 1, report: bool = True) -> Any:
+        """Run a request once both a concurrency slot and enough rate tokens are free, retrying it if it is throttled.
+
+        Batches pass report=False and report the sub-requests that succeeded themselves, as throttled sub-requests
+        still make the batch as a whole succeed."""
+        attempt = 0
+        while True:
+            with self.condition:
+                while self.inflight >= self.concurrency:
+                    self.condition.wait()
+                self.inflight += 1
+            try:
+                self.bucket.acquire(cost)
+                result = run()
+            except HttpError as e:
+                if not is_retryable(e) or attempt >= self.maxRetries:
+                    raise
+                self.throttled()
+                error = e
+            else:
+                if report:
+                    self.succeeded(cost)
+                return result
+            finally:
+                with self.condition:
+                    self.inflight -= 1
+                    self.condition.notify()
+
+            delay = self.backoff(attempt)
+            attempt += 1
+            self.retries += 1
+            logger.info(f'Retrying request after {delay:.1f}s (attempt {attempt}, HTTP {error.resp.status})')
+            time.sleep(delay)
@@ -0,0 +1,150 @@
+import datetime
+import logging
+import re
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple, Union
+
+from dateutil import rrule
+
+from bulk_reminders.api import Event, timezone_name
+from bulk_reminders.store import local_zone
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+MIN_OCCURRENCES = 3  # Fewer events than this are never combined into a series
+MAX_GAPS = 0.25  # The largest fraction of a series' occurrences that may be excluded with EXDATE
+
+WEEKDAYS = [rrule.MO, rrule.TU, rrule.WE, rrule.TH, rrule.FR, rrule.SA, rrule.SU]
+DAY_CODES = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+
+
+def local_date(event: Event) -> datetime.date:
+    """The local date an event starts on."""
+    return event.start.astimezone(local_zone()).date() if event.is_datetime else event.start
+
+
+def series_key(event: Event) -> Tuple:
+    """Events that can be occurrences of the same series share this key: the same summary, description, local time of
+    day and duration."""
+    time = event.start.astimezone(local_zone()).time() if event.is_datetime else None
+    return event.summary, event.description, event.is_datetime, time, event.end - event.start
+
+
+def schedule(dates: List[datetime.date]) -> Optional[Tuple[Dict, List[datetime.date]]]:
+    """Find the simplest rule producing every date, allowing a few extra dates that are then excluded.
+
+    Returns the rule's parameters along with the dates it produces, or None if the dates aren't periodic enough."""
+    first, last = dates[0], dates[-1]
+    step = 0
+    for previous, current in zip(dates, dates[1:]):
+        step = _gcd(step, (current - previous).days)
+
+    candidates = []
+    if step % 7 == 0:
+        candidates.append({'freq': rrule.WEEKLY, 'interval': step // 7})
+    else:
+        weekdays = sorted({date.weekday() for date in dates})
+        if step == 1 and len(weekdays) < 7:
+            # Several days a week, e.g. every monday, wednesday and friday
+            candidates.append({'freq': rrule.WEEKLY, 'interval': 1, 'byweekday': [WEEKDAYS[day] for day in weekdays]})
+        candidates.append({'freq': rrule.DAILY, 'interval': step})
+
+    start = datetime.datetime.combine(first, datetime.time())
+    until = datetime.datetime.combine(last, datetime.time())
+    for rule in candidates:
+        grid = [occurrence.date() for occurrence in rrule.rrule(dtstart=start, until=until, **rule)]
+        if len(grid) - len(dates) <= MAX_GAPS * len(grid):
+            return rule, grid
+    return None
+
+
+def _gcd(a: int, b: int) -> int:
+    while b:
+        a, b = b, a % b
+    return a
+
+
+def format_rule(rule: Dict, count: int) -> str:
+    """The RRULE line for the rule parameters found by schedule()."""
+    parts = ['FREQ=' + ('WEEKLY' if rule['freq'] == rrule.WEEKLY else 'DAILY')]
+    if rule['interval'] > 1:
+        parts.append(f'INTERVAL={rule["interval"]}')
+    if 'byweekday' in rule:
+        parts.append('BYDAY=' + ','.join(DAY_CODES[day.weekday] for day in rule['byweekday']))
+    parts.append(f'COUNT={count}')
+    return 'RRULE:' + ';'.join(parts)
+
+
+def format_exclusions(event: Event, dates: List[datetime.date]) -> str:
+    """The EXDATE line excluding the given dates from the series starting with the event."""
+    if event.is_datetime:
+        time = event.start.astimezone(local_zone()).time()
+        values = ','.join(datetime.datetime.combine(date, time).strftime('%Y%m%dT%H%M%S') for date in dates)
+        return f'EXDATE;TZID={timezone_name()}:{values}'
+    return 'EXDATE;VALUE=DATE:' + ','.join(date.strftime('%Y%m%d') for date in dates)
+
+
+def compress(events: List[Event], minOccurrences: int = MIN_OCCURRENCES) -> List[Event]:
+    """Combines events that repeat at a fixed interval into single recurring events.
+
+    Events keep their order, with each series taking the place of its first occurrence. Events that are already
+    recurring, already submitted or not part of a long enough series are returned unchanged."""
+    groups: Dict[Tuple, List[Event]] = defaultdict(list)
+    for event in events:
+        if event.recurrence is None and event.eventID is None:
+            groups[series_key(event)].append(event)
+
+    replacements: Dict[int, Union[Event, None]] = {}
+    for group in groups.values():
+        byDate: Dict[datetime.date, Event] = {}
+        for event in group:
+            # Only one event per day can be part of a series, the others stay on their own
+            byDate.setdefault(local_date(event), event)
+        if len(byDate) < minOccurrences:
+            continue
+
+        dates = sorted(byDate.keys())
+        found = schedule(dates)
+        if found is None:
+            continue
+
+        rule, grid = found
+        first = byDate[dates[0]]
+        recurrence = [format_rule(rule, len(grid))]
+        excluded = sorted(set(grid) - set(dates))
+        if len(excluded) > 0:
+            recurrence.append(format_exclusions(first, excluded))
+
+        series = Event(first.summary, first.start, first.end, first.description, status=first.status,
+                       recurrence=recurrence)
+        replacements[id(first)] = series
+        for date in dates[1:]:
+            replacements[id(byDate[date])] = None
+
+    compressed = [replacements.get(id(event), event) for event in events]
+    compressed = [event for event in compressed if event is not None]
+    if len(compressed) < len(events):
+        logger.info(f'Combined {len(events)} events into {len(compressed)}, '
+                    f'{sum(1 for event in compressed if event.recurrence is not None)} of them recurring')
+    return compressed
+
+
+def describe(recurrence: List[str]) -> str:
+    """A short human readable description of a recurrence, e.g. 'weekly, 14 times'."""
+    fields = {}
+    excluded = 0
+    for line in recurrence:
+        if line.startswith('RRULE:'):
+            fields = dict(part.split('=', 1) for part in line[len('RRULE:'):].split(';') if '=' in part)
+        elif line.startswith('EXDATE'):
+            excluded += len(line.split(':', 1)[-1].split(','))
+
+    frequency = fields.get('FREQ', 'repeating').lower()
+    if fields.get('INTERVAL', '1') != '1':
+        frequency = f'every {fields["INTERVAL"]} {dict(daily="days", weekly="weeks").get(frequency, frequency)}'
+    if 'BYDAY' in fields:
+        frequency += ' on ' + fields['BYDAY'].replace(',', ', ')
+    if re.fullmatch(r'\d+', fields.get('COUNT', '')):
+        return f'{frequency}, {int(fields["COUNT"]) - excluded} times'
+    return frequency
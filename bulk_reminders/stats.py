@@ -0,0 +1,64 @@
+import logging
+from typing import Optional
+
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QDockWidget, QHeaderView, QTableWidget, QTableWidgetItem, QWidget
+
+from bulk_reminders.metrics import Metrics
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+HEADERS = ['Endpoint', 'Calls', 'Errors', 'Retries', 'p50', 'p95', 'Sent', 'Received']
+REFRESH_INTERVAL = 1000  # Milliseconds between refreshes while the panel is visible
+
+
+def format_seconds(value: Optional[float]) -> str:
+    if value is None:
+        return ''
+    if value == float('inf'):
+        return 'slow'
+    return f'≤{value * 1000:.0f}ms'
+
+
+def format_bytes(value: int) -> str:
+    for unit in ('B', 'KB', 'MB'):
+        if value < 1024:
+            return f'{value:.0f}{unit}'
+        value /= 1024
+    return f'{value:.1f}GB'
+
+
+class StatsPanel(QDockWidget):
+    """A dockable table of API call statistics per endpoint, refreshed while it is visible."""
+
+    def __init__(self, metrics: Metrics, parent: Optional[QWidget] = None) -> None:
+        super(StatsPanel, self).__init__('API Statistics', parent)
+        self.metrics = metrics
+        self.table = QTableWidget(0, len(HEADERS), self)
+        self.table.setHorizontalHeaderLabels(HEADERS)
+        self.table.verticalHeader().hide()
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.setWidget(self.table)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.visibilityChanged.connect(self.visibilityToggled)
+
+    def visibilityToggled(self, visible: bool) -> None:
+        if visible:
+            self.refresh()
+            self.timer.start(REFRESH_INTERVAL)
+        else:
+            self.timer.stop()
+
+    def refresh(self) -> None:
+        rows = self.metrics.summary()
+        self.table.setRowCount(len(rows))
+        for row, stats in enumerate(rows):
+            values = [stats['endpoint'], str(stats['calls']), str(stats['errors']), str(stats['retries']),
+                      format_seconds(stats['p50']), format_seconds(stats['p95']),
+                      format_bytes(stats['sent']), format_bytes(stats['received'])]
+            for column, value in enumerate(values):
+                self.table.setItem(row, column, QTableWidgetItem(value))
@@ -0,0 +1,136 @@
+import bisect
+import datetime
+import functools
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from dateutil.parser import isoparse
+from tzlocal import get_localzone
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+REORDER_THRESHOLD = 64  # Changes applied at once above which the start index is rebuilt instead of updated in place
+
+
+@functools.lru_cache(maxsize=None)
+def local_zone() -> datetime.tzinfo:
+    """The local timezone, resolved once per process."""
+    return get_localzone()
+
+
+def eventTime(field: dict) -> datetime.datetime:
+    """Converts an API 'start' or 'end' field into a timezone aware datetime that can be compared and sorted."""
+    if 'dateTime' in field:
+        return isoparse(field['dateTime'])
+    date = isoparse(field['date'])
+    return date.replace(tzinfo=local_zone())
+
+
+class EventStore(object):
+    """A local copy of a single calendar's events, kept up to date with incremental syncs."""
+
+    def __init__(self, calendarID: str) -> None:
+        self.calendarID = calendarID
+        self.syncToken: Optional[str] = None
+        self.events: Dict[str, dict] = {}
+        self.ends: Dict[str, datetime.datetime] = {}
+        self.starts: Dict[str, datetime.datetime] = {}
+        self.order: List[Tuple[datetime.datetime, str]] = []  # The start and ID of every event, sorted
+        self.longest = datetime.timedelta(0)  # No event lasts longer, though it may be too long after removals
+        self.deleted: Set[str] = set()  # IDs of events deleted since the last drain()
+        self.resynced = False  # Whether the store was rebuilt since the last drain()
+        self.dirty: Set[str] = set()  # IDs of events changed or deleted since the store was last saved
+        self.wiped = False  # Whether the store was cleared since it was last saved
+        self.lock = threading.Lock()
+
+    def clear(self) -> None:
+        """Forget every event and the sync token, forcing the next sync to be a full one."""
+        self.syncToken = None
+        self.events.clear()
+        self.starts.clear()
+        self.ends.clear()
+        self.order.clear()
+        self.longest = datetime.timedelta(0)
+        self.deleted.clear()
+        self.resynced = True
+        self.dirty.clear()
+        self.wiped = True
+
+    def apply(self, items: Iterable[dict]) -> int:
+        """Applies a list of changed events from the API to the store. Returns the number of changes applied."""
+        count = 0
+        previous: Dict[str, Optional[datetime.datetime]] = {}  # The start of every changed event before this call
+        for item in items:
+            eventID = item['id']
+            self.dirty.add(eventID)
+            if eventID not in previous:
+                previous[eventID] = self.starts.get(eventID)
+            if item.get('status') == 'cancelled':
+                self.deleted.add(eventID)
+                self.events.pop(eventID, None)
+                self.starts.pop(eventID, None)
+                self.ends.pop(eventID, None)
+            else:
+                self.events[eventID] = item
+                self.starts[eventID] = eventTime(item['start'])
+                self.ends[eventID] = eventTime(item['end'])
+                self.longest = max(self.longest, self.ends[eventID] - self.starts[eventID])
+            count += 1
+
+        removed = {(start, eventID) for eventID, start in previous.items() if start is not None}
+        added = [(self.starts[eventID], eventID) for eventID in previous if eventID in self.starts]
+        self.reorder(removed, added)
+        return count
+
+    def reorder(self, removed: Set[Tuple[datetime.datetime, str]], added: List[Tuple[datetime.datetime, str]]) -> None:
+        """Updates the start index, one event at a time for a few changes or by sorting it again for many."""
+        if len(removed) + len(added) > REORDER_THRESHOLD:
+            # Sorting is close to linear, as the index is already sorted and only the added entries are not
+            self.order = [entry for entry in self.order if entry not in removed]
+            self.order.extend(added)
+            self.order.sort()
+            return
+        for entry in removed:
+            index = bisect.bisect_left(self.order, entry)
+            if index < len(self.order) and self.order[index] == entry:
+                del self.order[index]
+        for entry in added:
+            bisect.insort(self.order, entry)
+
+    def drain(self) -> Tuple[bool, Set[str]]:
+        """Returns whether the store was rebuilt and which events were deleted since the last call, then resets both."""
+        resynced, deleted = self.resynced, self.deleted
+        self.resynced, self.deleted = False, set()
+        return resynced, deleted
+
+    def unsaved(self) -> Tuple[bool, Set[str]]:
+        """Returns whether the store was cleared and which events changed since the last call, then resets both."""
+        wiped, dirty = self.wiped, self.dirty
+        self.wiped, self.dirty = False, set()
+        return wiped, dirty
+
+    def upcoming(self, after: Optional[datetime.datetime] = None) -> List[dict]:
+        """Returns all events that have not ended yet, ordered by their start time."""
+        if after is None:
+            after = datetime.datetime.now(datetime.timezone.utc)
+        return self.between(after)
+
+    def between(self, after: datetime.datetime, before: Optional[datetime.datetime] = None) -> List[dict]:
+        """Returns the events that end after and start before the given times, ordered by their start time. This
+        matches the events the API lists for a timeMin and timeMax.
+
+        Only events starting within the longest event's duration before after can still end after it, so the scan
+        is bounded by the window instead of the calendar's size."""
+        first = bisect.bisect_left(self.order, (after - self.longest,))
+        last = len(self.order) if before is None else bisect.bisect_left(self.order, (before,), first)
+        return [self.events[eventID] for start, eventID in self.order[first:last] if self.ends[eventID] > after]
+
+    def latest(self) -> Optional[datetime.datetime]:
+        """Returns the start of the last event, or None if there are no events."""
+        return self.order[-1][0] if len(self.order) > 0 else None
+
+    def __len__(self) -> int:
+        """Returns the number of events stored."""
+        return len(self.events)
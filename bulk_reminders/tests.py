@@ -1,2 +1,656 @@
-# TODO: Add REGEX parsing tests
-# TODO: Add Event logic tests
+"""Tests run against the local fake Calendar API server, with `python -m pytest bulk_reminders/tests.py`."""
+import datetime
+import io
+import json
+from types import SimpleNamespace
+from typing import Iterator, List
+
+import httplib2
+import pytest
+from dateutil import tz
+from dateutil.rrule import rrulestr
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.errors import HttpError
+
+from bulk_reminders import exporters, importers, undo
+from bulk_reminders.api import Calendar, Event, classify
+from bulk_reminders.benchmark import connect
+from bulk_reminders.cache import LRUCache, LocalCache, SCHEMA_VERSION
+from bulk_reminders.checkpoint import Submission
+from bulk_reminders.diff import EventIndex
+from bulk_reminders.fakeserver import FakeCalendarServer
+from bulk_reminders.model import EventTableModel, rowKey
+from bulk_reminders.parser import LineError, LineParser
+from bulk_reminders.ratelimit import RequestScheduler, TokenBucket
+from bulk_reminders.recurrence import compress, describe
+from bulk_reminders.store import EventStore
+from bulk_reminders.undo import HistoryManager, IDPair, Stage
+from bulk_reminders.windows import EventWindows, merge
+from bulk_reminders.workers import Worker
+
+DAY = datetime.timedelta(days=1)
+WEEK = datetime.timedelta(weeks=1)
+START = datetime.date(2030, 1, 7)  # A monday
+
+
+@pytest.fixture
+def server() -> Iterator[FakeCalendarServer]:
+    with FakeCalendarServer() as server:
+        yield server
+
+
+@pytest.fixture
+def calendar(server: FakeCalendarServer) -> Calendar:
+    return connect(server, 1000)
+
+
+@pytest.fixture
+def history(tmp_path) -> Iterator[HistoryManager]:
+    history = HistoryManager(str(tmp_path / 'history.jsonl'))
+    yield history
+    history.close()
+
+
+def ready(summary: str, start: datetime.date, days: int = 1, recurrence: List[str] = None) -> Event:
+    return Event(summary, start, start + days * DAY, status='Ready', recurrence=recurrence)
+
+
+def live(server: FakeCalendarServer, calendarID: str = 'primary') -> List[dict]:
+    return [event for event in server.events[calendarID].values() if event['status'] != 'cancelled']
+
+
+def api_item(eventID: str, day: int, days: int = 1, status: str = 'confirmed') -> dict:
+    """An all-day event as the API lists it, starting the given number of days after START."""
+    start, end = START + day * DAY, START + (day + days) * DAY
+    return {'id': eventID, 'status': status, 'summary': eventID, 'start': {'date': start.isoformat()}, 'end': {'date': end.isoformat()}}
+
+
+def submit(calendar: Calendar, history: HistoryManager, events: List[Event], tmp_path, reconcile: bool = False) -> List[Event]:
+    """Submit events to the primary calendar like the application does, returning them with their final status."""
+    submission = Submission('primary', history, file=str(tmp_path / 'checkpoint.jsonl'))
+    index = EventIndex.fetch(calendar, 'primary', history.eventIDs('primary')) if reconcile else None
+    for batch in submission.run(calendar, events, index):
+        for event, response, error in batch:
+            assert error is None
+    return events
+
+
+def test_parse_lines():
+    events, errors = LineParser().parse_text('Dentist | 2030-01-07\nMeeting | 2030-01-07 9:00AM 2030-01-07 10:30AM\nBroken')
+    assert [event.summary for event in events] == ['Dentist', 'Meeting']
+    assert events[0].start == datetime.datetime(2030, 1, 7) and events[0].end - events[0].start == DAY  # A full day from midnight
+    assert events[1].is_datetime and events[1].end - events[1].start == datetime.timedelta(minutes=90)
+    assert len(errors) == 1 and isinstance(errors[0], LineError) and errors[0].line == 3
+
+
+@pytest.mark.parametrize('time, hour, minute', [('9:00PM', 21, 0), ('9:00AM', 9, 0), ('12:30PM', 12, 30), ('12:15AM', 0, 15)])
+def test_parse_12_hour_times(time: str, hour: int, minute: int):
+    [event], errors = LineParser().parse_text(f'Dinner | 2030-01-07 {time}')
+    assert errors == [] and event.start == datetime.datetime(2030, 1, 7, hour, minute)
+
+
+def test_event_mixed_dates():
+    with pytest.raises(Exception):
+        Event('Mixed', START, datetime.datetime(2030, 1, 8, 10))
+
+
+def test_batches(calendar: Calendar, server: FakeCalendarServer):
+    events = [ready(f'Event {index}', START) for index in range(120)]
+    batches = list(calendar.insertEvents('primary', events))
+    assert [len(batch) for batch in batches] == [50, 50, 20] and server.stats['batches'] == 3
+    assert [event for batch in batches for event, response, error in batch] == events
+
+    pairs = [IDPair('primary', response['id']) for batch in batches for event, response, error in batch]
+    deleted = [pair for batch in calendar.deleteEvents(pairs) for pair, error in batch if error is None]
+    assert sorted(deleted, key=lambda pair: pair.key) == sorted(pairs, key=lambda pair: pair.key)
+    assert server.stats['batches'] == 6 and live(server) == []
+
+
+def test_event_pages(calendar: Calendar):
+    events = [ready(f'Event {day}', START + day * DAY) for day in range(30)]
+    for batch in calendar.insertEvents('primary', events):
+        assert all(error is None for event, response, error in batch)
+
+    def midnight(day: int) -> datetime.datetime:
+        return datetime.datetime.combine(START + day * DAY, datetime.time(), datetime.timezone.utc)
+
+    # Only events overlapping the window are listed, in order and page by page
+    pages = list(calendar.getEventPages('primary', timeMin=midnight(2), timeMax=midnight(27), pageSize=10))
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert [item['summary'] for page in pages for item in page] == [f'Event {day}' for day in range(2, 27)]
+    assert [item['summary'] for item in calendar.getEvents('primary', timeMin=midnight(0))] == [event.summary for event in events]
+
+
+def test_id_pair_equality():
+    pair = IDPair('primary', 'event')
+    assert pair == IDPair('primary', 'event') and pair == ('primary', 'event')
+    assert pair != IDPair('primary', 'other') and pair != IDPair('event', 'event') and pair != ('primary', 'other')
+    assert IDPair('same', 'same') != IDPair('same', 'other')  # The event ID used to be compared with the calendar ID
+    assert len({pair, IDPair('primary', 'event'), IDPair('primary', 'other')}) == 2
+
+
+def test_model_ranges():
+    events = [ready(f'Event {index}', START) for index in range(6)]
+    model = EventTableModel()
+    model.setEvents(list(events))
+    removed, inserted = [], []
+    model.rowsRemoved.connect(lambda parent, first, last: removed.append((first, last)))
+    model.rowsInserted.connect(lambda parent, first, last: inserted.append((first, last)))
+
+    model.removeEvents([events[4], events[1], events[2]])
+    assert removed == [(4, 4), (1, 2)] and model.events == [events[0], events[3], events[5]]
+    added = [ready('New', START), ready('Newer', START)]
+    model.insertEvents(1, added)
+    assert inserted == [(1, 2)] and model.rowCount() == 5
+    assert model.row(events[3]) == 3 and model.row(events[1]) == -1
+    assert model.data(model.index(2, 0)) == added[1].title
+
+
+def test_model_update():
+    def stored(eventID: str, status: str = 'Foreign') -> Event:
+        event = ready(eventID, START)
+        event.eventID, event.status = eventID, status
+        return event
+
+    first, second = ready('First', START), ready('Second', START)
+    model = EventTableModel()
+    model.setEvents([first, second] + [stored(eventID) for eventID in 'abcd'])
+    removed, inserted = [], []
+    model.rowsRemoved.connect(lambda parent, first, last: removed.append((first, last)))
+    model.rowsInserted.connect(lambda parent, first, last: inserted.append((first, last)))
+
+    events = [second, stored('a'), stored('b', 'Undoable'), stored('d'), stored('e'), stored('c')]
+    assert model.updateEvents(events) == 6
+    assert [rowKey(event) for event in model.events] == [rowKey(event) for event in events]
+    assert removed == [(0, 0), (2, 3)] and inserted == [(2, 2), (4, 5)]
+
+
+def test_worker_cancel():
+    emitted, closed = [], []
+
+    def produce() -> Iterator[int]:
+        try:
+            for item in range(5):
+                yield item
+                if item == 1:
+                    worker.cancel()
+        finally:
+            closed.append(True)
+
+    worker = Worker(produce)
+    worker.signals.result.connect(emitted.append)
+    worker.run()
+    assert emitted == [0, 1] and closed == [True]  # Nothing is emitted after cancel()
+
+
+def test_journal_replay(history: HistoryManager):
+    stage = Stage(history.nextIndex(), 'primary')
+    history.addStage(stage)
+    history.addEvents(stage, [IDPair('primary', f'event{i}') for i in range(5)])
+    history.removeEvents([IDPair('primary', 'event0')])
+    dropped = Stage(history.nextIndex(), 'primary')
+    history.addStage(dropped)
+    history.addEvents(dropped, [IDPair('primary', 'gone')])
+    history.dropStage(dropped)
+    history.close()
+
+    with open(history.file, 'a') as file:
+        file.write('{"type": "event", "sta')  # A record cut short by a crash
+
+    replayed = HistoryManager(history.file)
+    assert [stage.index for stage in replayed.stages] == [stage.index]
+    assert sorted(replayed.eventIDs('primary')) == [f'event{i}' for i in range(1, 5)]
+    replayed.addEvents(replayed.stages[0], [IDPair('primary', 'after')])
+    replayed.close()
+    assert HistoryManager(history.file).exists(IDPair('primary', 'after')) == stage.index
+
+
+def test_journal_replay_readded(history: HistoryManager):
+    stage = Stage(history.nextIndex(), 'primary')
+    history.addStage(stage)
+    history.addEvents(stage, [IDPair('primary', 'a')])
+    history.removeEvents([IDPair('primary', 'a')])
+    history.addEvents(stage, [IDPair('primary', 'a')])
+    history.close()
+
+    replayed = HistoryManager(history.file)
+    assert [(stage.index, [pair.eventID for pair in stage.events]) for stage in replayed.stages] == [(0, ['a'])]
+    assert replayed.getTotal() == 1
+
+
+def test_journal_replay_drop(history: HistoryManager):
+    first = Stage(history.nextIndex(), 'primary')
+    history.addStage(first)
+    history.addEvents(first, [IDPair('primary', 'shared'), IDPair('primary', 'only')])
+    second = Stage(history.nextIndex(), 'primary')
+    history.addStage(second)
+    history.addEvents(second, [IDPair('primary', 'shared')])
+    history.dropStage(first)
+    before = history.eventIDs('primary'), history.exists(IDPair('primary', 'shared'))
+    history.close()
+
+    replayed = HistoryManager(history.file)
+    assert (replayed.eventIDs('primary'), replayed.exists(IDPair('primary', 'shared'))) == before == ({'shared'}, second.index)
+
+
+def test_journal_compaction(history: HistoryManager, monkeypatch):
+    monkeypatch.setattr(undo, 'COMPACT_THRESHOLD', 10)
+    stage = Stage(history.nextIndex(), 'primary')
+    history.addStage(stage)
+    pairs = [IDPair('primary', f'event{i}') for i in range(30)]
+    history.addEvents(stage, pairs)
+    for pair in pairs[:25]:
+        history.removeEvents([pair])
+    history.close()
+
+    with open(history.file) as file:
+        records = [json.loads(line) for line in file]
+    assert len(records) < 30  # Compacted at least once, rather than holding every addition and removal
+    assert sorted(HistoryManager(history.file).eventIDs('primary')) == sorted(pair.eventID for pair in pairs[25:])
+
+
+def test_classify():
+    def item(eventID: str, **fields) -> dict:
+        return {'id': eventID, 'summary': eventID, 'start': {'date': START.isoformat()}, 'end': {'date': (START + DAY).isoformat()}, **fields}
+
+    apiEvents = [item('mine'), item('foreign'), item('series_20300114', recurringEventId='series'), item('other')]
+    events, counts = classify([ready('First', START), ready('Second', START)], apiEvents, {'mine', 'series'})
+    assert [event.status for event in events] == ['Ready', 'Ready', 'Undoable', 'Foreign', 'Undoable', 'Foreign']
+    assert counts == {'Ready': 2, 'Undoable': 2, 'Foreign': 2}
+    assert classify([], [], set()) == ([], {})
+
+
+def test_diff_classification():
+    def item(eventID: str, summary: str, start: datetime.date) -> dict:
+        return {'id': eventID, 'summary': summary, 'start': {'date': start.isoformat()}, 'end': {'date': (start + DAY).isoformat()}}
+
+    existing = [item('same', 'Same', START), item('moved', 'Moved', START), item('longer', 'Longer', START),
+                item('foreign', 'Foreign', START)]
+    result = EventIndex(existing, {'same', 'moved', 'longer'}).diff([
+        ready(' same ', START), ready('Moved', START + WEEK), ready('Longer', START, days=2),
+        ready('Foreign', START + WEEK), ready('New', START)])
+    assert [item['id'] for event, item in result.unchanged] == ['same']
+    assert sorted(item['id'] for event, item in result.changed) == ['longer', 'moved']
+    assert sorted(event.summary for event in result.new) == ['Foreign', 'New']
+
+
+def test_reconcile(calendar: Calendar, history: HistoryManager, server: FakeCalendarServer, tmp_path):
+    submit(calendar, history, [ready('Kept', START), ready('Moved', START)], tmp_path)
+    events = submit(calendar, history, [ready('Kept', START), ready('Moved', START + WEEK), ready('New', START)],
+                    tmp_path, reconcile=True)
+    assert [event.status for event in events] == ['Unchanged', 'Updated', 'Ready']
+    assert history.exists(IDPair('primary', events[2].eventID)) != -1
+    assert sorted((event['summary'], event['start']['date']) for event in live(server)) == [
+        ('Kept', '2030-01-07'), ('Moved', '2030-01-14'), ('New', '2030-01-07')]
+    assert len(history.select('primary')) == 2
+
+    # Nothing left to send, so no empty stage is recorded
+    submit(calendar, history, [ready('Kept', START)], tmp_path, reconcile=True)
+    assert len(history.stages) == 2
+
+
+def test_reconcile_kind_change(calendar: Calendar, history: HistoryManager, server: FakeCalendarServer, tmp_path):
+    timed = Event('Trip', datetime.datetime(2030, 1, 8, 9, tzinfo=datetime.timezone.utc),
+                  datetime.datetime(2030, 1, 8, 17, tzinfo=datetime.timezone.utc), status='Ready')
+    submit(calendar, history, [ready('Trip', START)], tmp_path)
+    for event, kind in ((timed, 'dateTime'), (ready('Trip', START), 'date')):
+        [event] = submit(calendar, history, [event], tmp_path, reconcile=True)
+        assert event.status == 'Updated'
+        [item] = live(server)
+        assert set(item['start']) - {'timeZone'} == set(item['end']) - {'timeZone'} == {kind}
+
+
+def test_prune_inflight(history: HistoryManager):
+    stage = Stage(history.nextIndex(), 'primary')
+    history.addStage(stage)
+    history.addEvents(stage, [IDPair('primary', eventID) for eventID in ('gone', 'sending', 'late')])
+    history.sending('primary', ['sending'])
+
+    def missingEvents(calendarID: str, eventIDs: List[str]) -> set:
+        assert eventIDs == ['gone', 'late']
+        history.sending('primary', ['late'])  # Sent while the prune's requests are made
+        history.sent('primary', ['late'])
+        return set(eventIDs)
+
+    assert history.prune('primary', ['gone', 'sending', 'late'], SimpleNamespace(missingEvents=missingEvents)) == 1
+    assert [pair.eventID for pair in stage.events] == ['sending', 'late']
+
+
+def test_compress_recurrence():
+    events = [ready('Gym', START + week * WEEK) for week in range(6) if week != 3] + [ready('Once', START)]
+    series, once = compress(events)
+    assert series.recurrence == ['RRULE:FREQ=WEEKLY;COUNT=6', 'EXDATE;VALUE=DATE:20300128']
+    assert describe(series.recurrence) == 'weekly, 5 times'
+    assert once.recurrence is None
+
+    classes = [Event('Class', datetime.datetime(2030, 1, 7, 9, tzinfo=datetime.timezone.utc) + day * DAY,
+                     datetime.datetime(2030, 1, 7, 10, tzinfo=datetime.timezone.utc) + day * DAY) for day in (0, 2, 4, 7, 9, 11)]
+    [series] = compress(classes)
+    assert series.recurrence == ['RRULE:FREQ=WEEKLY;BYDAY=MO,WE,FR;COUNT=6']
+
+    # Too few occurrences to combine
+    assert all(event.recurrence is None for event in compress(events[:2]))
+
+
+def test_recurrence_changes(calendar: Calendar, history: HistoryManager, server: FakeCalendarServer, tmp_path):
+    submit(calendar, history, [ready('Gym', START, recurrence=['RRULE:FREQ=WEEKLY;COUNT=4'])], tmp_path)
+    [event] = submit(calendar, history, [ready('Gym', START, recurrence=['RRULE:FREQ=WEEKLY;COUNT=6'])], tmp_path, reconcile=True)
+    assert event.status == 'Updated'
+    assert [event['recurrence'] for event in live(server)] == [['RRULE:FREQ=WEEKLY;COUNT=6']]
+    [event] = submit(calendar, history, [ready('Gym', START, recurrence=['rrule:FREQ=WEEKLY;COUNT=6'])], tmp_path, reconcile=True)
+    assert event.status == 'Unchanged'
+
+
+def test_rollback_stages(calendar: Calendar, history: HistoryManager, server: FakeCalendarServer, tmp_path):
+    for stage in range(3):
+        submit(calendar, history, [ready(f'Stage {stage} event {i}', START + i * DAY) for i in range(60)], tmp_path)
+    assert len(history.select('primary')) == 3 and len(live(server)) == 180
+
+    # Undo the latest two stages, with one of their events already deleted elsewhere
+    stages = history.select('primary', 2)
+    server.events['primary'][stages[0].events[0].eventID]['status'] = 'cancelled'
+    for batch in history.rollback(calendar, stages):
+        assert all(error is None for pair, error in batch)
+    assert sorted({event['summary'].split(' event')[0] for event in live(server)}) == ['Stage 0']
+    assert len(history.stages) == 1 and history.getTotal() == 60
+
+    history.close()
+    assert HistoryManager(history.file).getTotal() == 60
+
+
+def test_import_csv():
+    file = io.StringIO('Subject,Start Date,Start Time,End Date,End Time,All Day Event,Description\n'
+                       'Dentist,01/07/2030,10:00 AM,01/07/2030,11:00 AM,False,Checkup\n'
+                       'Holiday,2030-01-08,,2030-01-10,,True,\n'
+                       ',2030-01-09,,,,,\n')
+    dentist, holiday, error = importers.read_csv(file)
+    assert dentist.summary == 'Dentist' and dentist.description == 'Checkup'
+    assert dentist.start == datetime.datetime(2030, 1, 7, 10) and dentist.end == datetime.datetime(2030, 1, 7, 11)
+    assert (holiday.start, holiday.end) == (datetime.date(2030, 1, 8), datetime.date(2030, 1, 10))
+    assert isinstance(error, LineError) and error.line == 4
+
+
+def test_import_ics():
+    file = io.StringIO('BEGIN:VCALENDAR\r\nBEGIN:VEVENT\r\nSUMMARY:A long\r\n  summary\\, folded\r\n'
+                       'DTSTART:20300107T100000Z\r\nDURATION:PT90M\r\nRRULE:FREQ=WEEKLY;COUNT=3\r\n'
+                       'BEGIN:VALARM\r\nTRIGGER:-PT15M\r\nEND:VALARM\r\nEND:VEVENT\r\n'
+                       'BEGIN:VEVENT\r\nSUMMARY:Cancelled\r\nSTATUS:CANCELLED\r\nDTSTART;VALUE=DATE:20300107\r\nEND:VEVENT\r\n'
+                       'BEGIN:VEVENT\r\nSUMMARY:Broken\r\nEND:VEVENT\r\nEND:VCALENDAR\r\n')
+    event, error = importers.read_ics(file)
+    assert event.summary == 'A long summary, folded'
+    assert event.start == datetime.datetime(2030, 1, 7, 10, tzinfo=datetime.timezone.utc)
+    assert event.end - event.start == datetime.timedelta(minutes=90)
+    assert event.recurrence == ['RRULE:FREQ=WEEKLY;COUNT=3']
+    assert isinstance(error, LineError) and 'DTSTART' in error.message
+
+
+def test_export_formats(calendar: Calendar, history: HistoryManager, tmp_path):
+    submit(calendar, history, [
+        Event('Meeting ' + 'é' * 60, datetime.datetime(2030, 1, 7, 10, tzinfo=datetime.timezone.utc),
+              datetime.datetime(2030, 1, 7, 11, tzinfo=datetime.timezone.utc), 'Line one\nLine two', status='Ready',
+              recurrence=['RRULE:FREQ=WEEKLY;COUNT=3']),
+        ready('Holiday', START, days=2)], tmp_path)
+    fields = exporters.requested_fields(exporters.DEFAULT_FIELDS)
+
+    def export(format: str) -> str:
+        file = io.StringIO()
+        counts = list(exporters.export(file, format, calendar.exportEventPages('primary', fields, None, None, False)))
+        assert counts[-1] == 2
+        return file.getvalue()
+
+    ics = export('ics')
+    lines = ics.split('\r\n')
+    assert max(len(line.encode('utf-8')) for line in lines) <= exporters.ICS_LINE_LENGTH
+    assert sum(1 for line in lines if line.startswith('DTSTAMP:')) == 2
+    zones = {line.split('TZID=')[1].split(':')[0] for line in lines if ';TZID=' in line}
+    assert zones == {line[len('TZID:'):] for line in lines if line.startswith('TZID:')}  # Each described once
+    for format, text in (('ics', ics), ('csv', export('csv'))):
+        imported = sorted(getattr(importers, f'read_{format}')(io.StringIO(text)), key=lambda event: event.summary)
+        assert [event.summary for event in imported] == ['Holiday', 'Meeting ' + 'é' * 60]
+        assert (imported[0].start, imported[0].end) == (START, START + 2 * DAY)
+        assert imported[1].start == datetime.datetime(2030, 1, 7, 10, tzinfo=datetime.timezone.utc)
+        assert imported[1].description == 'Line one\nLine two'
+        assert imported[1].recurrence == ['RRULE:FREQ=WEEKLY;COUNT=3']
+
+    # Every VEVENT needs a DTSTAMP, even when the time it was last updated isn't exported
+    file = io.StringIO()
+    list(exporters.export(file, 'ics', calendar.exportEventPages('primary', exporters.requested_fields(['summary'])), ['summary']))
+    assert file.getvalue().count('DTSTAMP:') == 2
+
+    records = [json.loads(line) for line in export('jsonl').splitlines()]
+    assert all(set(record) <= set(exporters.DEFAULT_FIELDS) for record in records)
+    with pytest.raises(TypeError):
+        exporters.Exporter(io.StringIO(), fields)
+
+
+@pytest.mark.parametrize('zone', ['America/New_York', 'Europe/London', 'Australia/Sydney', 'America/Santiago'])
+def test_export_recurrence_across_dst(zone: str):
+    """Occurrences of a recurring event keep their local time on both sides of a daylight saving time change."""
+    local = tz.gettz(zone)
+    start = datetime.datetime(2030, 1, 6, 9, tzinfo=local)
+    item = {'id': 'series', 'status': 'confirmed', 'summary': 'Standup', 'recurrence': ['RRULE:FREQ=WEEKLY;COUNT=52'],
+            'start': {'dateTime': start.isoformat(), 'timeZone': zone},
+            'end': {'dateTime': (start + datetime.timedelta(minutes=15)).isoformat(), 'timeZone': zone}}
+    file = io.StringIO()
+    list(exporters.export(file, 'ics', [[item]]))
+    text = file.getvalue()
+    assert f'DTSTART;TZID={zone}:20300106T090000' in text.split('\r\n')
+
+    # The VTIMEZONE written agrees with the timezone database for every occurrence
+    described = tz.tzical(io.StringIO(text)).get(zone)
+    [event] = importers.read_ics(io.StringIO(text))
+    occurrences = list(rrulestr('\n'.join(event.recurrence), dtstart=event.start))
+    assert len({occurrence.utcoffset() for occurrence in occurrences}) == 2  # The series crosses a change
+    for occurrence in occurrences:
+        assert (occurrence.hour, occurrence.minute) == (9, 0)
+        assert occurrence.replace(tzinfo=described).utcoffset() == occurrence.utcoffset()
+
+
+def test_store_windows():
+    store = EventStore('primary')
+    store.apply([api_item(f'event{day}', day) for day in range(100)] + [api_item('long', 5, days=20)])
+    store.apply([api_item('event50', 0, status='cancelled'), api_item('event60', 200), api_item('event70', 3), api_item('event70', 4)])
+    assert store.latest() == store.starts['event60']
+
+    def expected(after: datetime.datetime, before: datetime.datetime) -> List[str]:
+        return sorted((eventID for eventID in store.events if store.ends[eventID] > after and store.starts[eventID] < before),
+                      key=lambda eventID: (store.starts[eventID], eventID))
+
+    after, before = store.starts['event10'], store.starts['event30']
+    assert [item['id'] for item in store.between(after, before)] == expected(after, before) and 'long' in expected(after, before)
+    assert [item['id'] for item in store.between(after)][-1] == 'event60'
+
+    # An event spanning the boundary of two windows is part of both
+    boundary = store.starts['event40']
+    store.apply([api_item('span', 38, days=4)])
+    assert 'span' in [item['id'] for item in store.between(boundary - WEEK, boundary)]
+    assert 'span' in [item['id'] for item in store.between(boundary, boundary + WEEK)]
+
+    # Changes making an event longer than any before are found from windows long after it started
+    store.apply([api_item('event1', 1, days=300)])
+    for window in range(0, 300, 30):
+        after, before = store.starts['event0'] + window * DAY, store.starts['event0'] + (window + 30) * DAY
+        assert [item['id'] for item in store.between(after, before)] == expected(after, before)
+        assert 'event1' in expected(after, before)
+    # Removing the longest event leaves a conservative bound, which still finds exactly the right events
+    store.apply([api_item('event1', 1, status='cancelled')])
+    after = store.starts['event90']
+    assert [item['id'] for item in store.between(after, after + WEEK)] == expected(after, after + WEEK)
+
+
+def test_event_windows():
+    windows = EventWindows('primary', length=WEEK)
+    windows.anchor = datetime.datetime.combine(START, datetime.time(), datetime.timezone.utc)
+    windows.until = windows.anchor + 3 * WEEK
+    assert windows.bounds(0) == (windows.anchor, windows.anchor + WEEK)
+    assert windows.bounds(2) == (windows.anchor + 2 * WEEK, windows.anchor + 3 * WEEK)
+    assert windows.key(1) == ('primary', windows.anchor + WEEK)
+    assert windows.horizon == windows.anchor + WEEK and not windows.complete
+    windows.count = 3
+    assert windows.horizon == windows.until and windows.complete
+
+    # Events spanning the boundary of two windows are listed by both, but shown once
+    first, second = [api_item('before', 0), api_item('span', 6, days=2)], [api_item('span', 6, days=2), api_item('after', 8)]
+    assert [item['id'] for item in merge([first, second, []])] == ['before', 'span', 'after']
+
+
+@pytest.fixture
+def wallclock(monkeypatch) -> SimpleNamespace:
+    """A fake clock for the caches, which only advances when a test moves it."""
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr('bulk_reminders.cache.time', SimpleNamespace(time=lambda: clock.now, monotonic=lambda: clock.now))
+    return clock
+
+
+def cached_store(calendarID: str, count: int, syncToken: str = 'token') -> EventStore:
+    store = EventStore(calendarID)
+    store.apply([api_item(f'{calendarID}{day}', day) for day in range(count)])
+    store.syncToken = syncToken
+    return store
+
+
+def test_cache_round_trip(tmp_path, wallclock: SimpleNamespace):
+    cache = LocalCache(str(tmp_path / 'cache.sqlite3'))
+    cache.saveStore(cached_store('primary', 3, syncToken='42'))
+    cache.close()
+
+    cache = LocalCache(str(tmp_path / 'cache.sqlite3'))
+    store = cache.loadStore('primary')
+    assert store.syncToken == '42' and sorted(store.events) == ['primary0', 'primary1', 'primary2']
+    assert store.resynced and store.unsaved() == (False, set())
+    assert [item['id'] for item in cache.loadWindow('primary', store.starts['primary1'], store.ends['primary2'])] == ['primary1', 'primary2']
+    assert cache.loadStore('other') is None
+    cache.close()
+
+
+def test_cache_schema_version(tmp_path, wallclock: SimpleNamespace):
+    file = str(tmp_path / 'cache.sqlite3')
+    cache = LocalCache(file)
+    cache.saveStore(cached_store('primary', 3))
+    cache.connection.execute('PRAGMA user_version = 1')
+    cache.close()
+
+    cache = LocalCache(file)
+    assert not cache.hasStore('primary') and cache.loadStore('primary') is None
+    assert cache.connection.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION
+    cache.close()
+
+
+def test_cache_eviction(tmp_path, wallclock: SimpleNamespace):
+    cache = LocalCache(str(tmp_path / 'cache.sqlite3'), maxEvents=6, maxAge=100)
+    for calendarID in ('old', 'first', 'second'):
+        cache.saveStore(cached_store(calendarID, 2))
+        wallclock.now += 10
+    assert all(cache.hasStore(calendarID) for calendarID in ('old', 'first', 'second'))
+
+    # Over the event limit, the least recently viewed calendars go first, but never the one just saved
+    cache.saveStore(cached_store('third', 2))
+    assert [calendarID for calendarID in ('old', 'first', 'second', 'third') if cache.hasStore(calendarID)] == ['first', 'second', 'third']
+    cache.saveStore(cached_store('large', 10))
+    assert [calendarID for calendarID in ('first', 'second', 'third', 'large') if cache.hasStore(calendarID)] == ['large']
+
+    # Calendars not viewed for longer than the maximum age go as well
+    wallclock.now += 200
+    cache.saveStore(cached_store('recent', 1))
+    assert not cache.hasStore('large') and cache.hasStore('recent')
+    cache.close()
+
+
+def test_lru_cache(wallclock: SimpleNamespace):
+    cache = LRUCache(maxSize=2, ttl=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1  # Now more recently used than b
+    cache.put('c', 3)
+    assert (cache.get('a'), cache.get('b'), cache.get('c'), len(cache)) == (1, None, 3, 2)
+
+    wallclock.now += 61
+    assert cache.get('a') is None and len(cache) == 1
+    cache.put('a', 4)
+    cache.invalidate('c')
+    assert (cache.get('a'), cache.get('c')) == (4, None)
+
+
+@pytest.mark.parametrize('token', ['999999', 'not-a-token'])
+def test_full_resync(calendar: Calendar, history: HistoryManager, server: FakeCalendarServer, tmp_path, token: str):
+    submit(calendar, history, [ready('First', START)], tmp_path)
+    assert [event['summary'] for event in calendar.allEvents('primary')] == ['First']
+    assert server.dispatch('GET', f'/calendar/v3/calendars/primary/events?syncToken={token}', None)[0] == 410
+
+    submit(calendar, history, [ready('Second', START)], tmp_path)
+    store = calendar.getStore('primary')
+    store.syncToken = token
+    assert sorted(event['summary'] for event in calendar.allEvents('primary')) == ['First', 'Second']
+    assert store.syncToken not in (None, token)
+
+
+@pytest.fixture
+def clock(monkeypatch) -> SimpleNamespace:
+    """A fake clock for the rate limiter, where sleeping advances time instantly."""
+    clock = SimpleNamespace(now=0.0, slept=[])
+
+    def sleep(seconds: float) -> None:
+        clock.slept.append(seconds)
+        clock.now += seconds
+
+    monkeypatch.setattr('bulk_reminders.ratelimit.time', SimpleNamespace(monotonic=lambda: clock.now, sleep=sleep))
+    return clock
+
+
+def http_error(status: int, reason: str = 'backendError') -> HttpError:
+    content = json.dumps({'error': {'errors': [{'reason': reason}]}}).encode('utf-8')
+    return HttpError(httplib2.Response({'status': status}), content)
+
+
+def test_token_bucket(clock: SimpleNamespace):
+    bucket = TokenBucket(rate=10, capacity=5)
+    bucket.acquire(5)
+    assert clock.now == 0
+    bucket.acquire(2)
+    assert clock.now == pytest.approx(0.2)
+    bucket.acquire(20)  # Larger than the capacity: waits for a full bucket and takes the rest on credit
+    assert clock.now == pytest.approx(0.7)
+    bucket.acquire(1)
+    assert clock.now == pytest.approx(0.7 + 1.6)
+
+    clock.now += 10
+    bucket.drain()
+    bucket.acquire(1)
+    assert clock.now == pytest.approx(12.4)
+
+
+def test_scheduler_backoff(clock: SimpleNamespace):
+    scheduler = RequestScheduler(rate=100, baseDelay=1, maxDelay=4, maxRetries=3)
+    assert all(0 <= scheduler.backoff(attempt) <= min(4, 2 ** attempt) for attempt in range(6) for _ in range(20))
+
+    failures = [http_error(503), http_error(403, 'rateLimitExceeded')]
+
+    def flaky() -> str:
+        if len(failures) > 0:
+            raise failures.pop(0)
+        return 'done'
+
+    assert scheduler.execute(flaky) == 'done' and scheduler.retries == 2 and len(clock.slept) >= 2
+    assert scheduler.throttles == 2 and scheduler.rate < 100  # Slowed down once, within the cooldown
+
+    with pytest.raises(HttpError):
+        scheduler.execute(lambda: (_ for _ in ()).throw(http_error(404, 'notFound')))
+    assert scheduler.retries == 2
+    with pytest.raises(HttpError):
+        scheduler.execute(lambda: (_ for _ in ()).throw(http_error(503)))
+    assert scheduler.retries == 5
+
+
+def test_throttled_throughput(clock: SimpleNamespace):
+    """Batches larger than the API's burst are partially throttled, but throughput stays close to the limit."""
+    with FakeCalendarServer(rateLimit=20, clock=lambda: clock.now) as server:
+        calendar = Calendar()
+        calendar.credentials = AnonymousCredentials()
+        calendar.setupService(server.url)
+        events = [ready(f'Event {index}', START) for index in range(150)]
+        results = [result for batch in calendar.insertEvents('primary', events) for result in batch]
+
+    assert all(error is None for event, response, error in results) and len(live(server)) == 150
+    assert server.stats['throttled'] > 0
+    assert calendar.scheduler.throttles <= 3  # At most once per batch, not once per re-queued batch
+    assert len(events) / clock.now > 0.5 * 20  # Simulated seconds, only the scheduler's waits advance the clock
@@ -0,0 +1,58 @@
+import contextlib
+import logging
+import time
+from typing import Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+STARTUP_BUDGET = 1.5  # Seconds allowed between launching and the first rows being shown
+
+
+class PhaseTimer(object):
+    """Records how long each phase of an operation takes, measured from when the timer was created."""
+
+    def __init__(self, name: str, budget: Optional[float] = None) -> None:
+        self.name = name
+        self.budget = budget
+        self.start = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+        self.marks: List[Tuple[str, float]] = []
+        self.reported = False
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time the enclosed block as a named phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def mark(self, name: str) -> float:
+        """Record a milestone, returning the seconds elapsed since the timer was created."""
+        elapsed = time.perf_counter() - self.start
+        self.marks.append((name, elapsed))
+        return elapsed
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def report(self) -> str:
+        """Log every phase and milestone once, warning if the total went over the budget."""
+        lines = [f'{name}: {duration * 1000:.0f}ms' for name, duration in self.phases]
+        lines.extend(f'{name} at {elapsed * 1000:.0f}ms' for name, elapsed in self.marks)
+        text = f'{self.name.capitalize()} timings: ' + ', '.join(lines)
+
+        if not self.reported:
+            self.reported = True
+            if self.budget is not None and self.elapsed > self.budget:
+                logger.warning(f'{text} (over the {self.budget * 1000:.0f}ms budget)')
+            else:
+                logger.info(text)
+        return text
+
+
+# Created as early as possible so it measures from (nearly) the launch of the application
+startup = PhaseTimer('startup', STARTUP_BUDGET)
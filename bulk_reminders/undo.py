@@ -1,17 +1,35 @@
+import json
 import logging
 import os
-from typing import Any, Iterator, List
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, TYPE_CHECKING, TextIO, Tuple, Union
 
-import jsonpickle
+if TYPE_CHECKING:
+    from bulk_reminders import api
 
 logger = logging.getLogger(__file__)
 logger.setLevel(logging.DEBUG)
 
+HISTORY_FILE = 'history.jsonl'
+COMPACT_THRESHOLD = 1000  # Minimum number of dead journal records before the journal is compacted
+COLLAPSE_SIZE = 5  # Older stages with fewer events than this are merged together by collapse()
+
 
 class HistoryManager(object):
+    """Undo history stored as an append-only journal of JSON lines, one record per stage or event.
+
+    Every change is appended to the journal, so saving never rewrites the whole file. Once enough records are
+    obsolete, the journal is compacted into a fresh file which atomically replaces the old one."""
+
     def __init__(self, file: str) -> None:
         self.file = file
         self.stages: List[Stage] = []
+        self.index: Dict[Tuple[str, str], Stage] = {}
+        self.records = 0  # Number of records in the journal file
+        self._journal: Optional[TextIO] = None
+        self.lock = threading.RLock()  # Held while the history is changed, never across requests
+        self.inflight: Dict[str, Set[str]] = {}  # IDs of events being created on each calendar, never pruned
+        self.pruning: List[Tuple[str, Set[str]]] = []  # The calendar and candidates of every prune in progress
 
         # Immediately load data if possible
         if os.path.exists(self.file):
@@ -19,32 +37,151 @@ class HistoryManager(object):
 
     def pop(self) -> 'Stage':
         """Remove the latest Stage and return it"""
-        return self.stages.pop(0)
+        stage = self.stages[0]
+        self.dropStage(stage)
+        return stage
+
+    def dropStage(self, stage: 'Stage') -> None:
+        """Remove a Stage and all of its events from the history."""
+        with self.lock:
+            self.stages.remove(stage)
+            for pair in stage.events:
+                if self.index.get(pair.key) is stage:
+                    del self.index[pair.key]
+            self.append({'type': 'drop', 'stage': stage.index})
+
+    def select(self, calendarID: Optional[str] = None, count: Optional[int] = None) -> List['Stage']:
+        """The latest stages with events to undo, newest first. Only stages for the given calendar are included if one
+        is given, and at most count of them if a count is given."""
+        stages = [stage for stage in self.stages if len(stage) > 0 and (calendarID is None or stage.commonCalendar == calendarID)]
+        return stages if count is None else stages[:count]
+
+    def rollback(self, calendar: 'api.Calendar', stages: List['Stage']) -> Iterator[List[Tuple['IDPair', Optional[Exception]]]]:
+        """Deletes every event of the given stages with batched requests, yielding the results one batch at a time.
+
+        Deleted events are removed from the history as each batch completes and stages left empty are dropped, so an
+        interrupted or partially failed rollback can simply be started again."""
+        pairs = [pair for stage in stages for pair in stage.events]
+        logger.info(f'Rolling back {len(stages)} stages with {len(pairs)} events')
+        try:
+            for results in calendar.deleteEvents(pairs):
+                self.removeEvents([pair for pair, error in results if error is None])
+                yield results
+        finally:
+            for stage in stages:
+                if len(stage) == 0 and stage in self.stages:
+                    self.dropStage(stage)
 
     def load(self) -> None:
         """Load data from the undo history file"""
         logger.info('Loading from undo history file.')
         with open(self.file, 'r') as file:
-            self.stages = jsonpickle.decode(file.read())
+            content = file.read()
+
+        if content.lstrip().startswith('['):
+            # Older versions stored the whole history as a single jsonpickle document
+            logger.info('Converting undo history file to journal format.')
+            import jsonpickle
+            self.stages = jsonpickle.decode(content)
+            self.reindex()
+            self.save()
+            return
+
+        self.stages, self.index, self.records = [], {}, 0
+        stages: Dict[int, Stage] = {}
+        for line in content.splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A partially written record from a crash, everything before it is still valid
+                logger.warning('Ignoring a corrupt record in the undo history file.')
+                continue
+            self.records += 1
+            self.replay(record, stages)
+
+        self.stages = sorted(stages.values(), key=lambda stage: stage.index, reverse=True)
+        for stage in self.stages:
+            # Pairs removed and added again were appended twice, only the first copy is kept
+            seen = set()
+            stage.events = [pair for pair in stage.events
+                            if self.index.get(pair.key) is stage and not (pair.key in seen or seen.add(pair.key))]
+
+    def replay(self, record: dict, stages: Dict[int, 'Stage']) -> None:
+        """Apply a single journal record to the in-memory history."""
+        kind = record.get('type')
+        if kind == 'stage':
+            stages[record['stage']] = Stage(record['stage'], record['calendarID'])
+        elif kind == 'event' and record['stage'] in stages:
+            stage = stages[record['stage']]
+            pair = IDPair(record['calendarID'], record['eventID'])
+            stage.events.append(pair)
+            self.index[pair.key] = stage
+        elif kind == 'remove':
+            # The pair is dropped from its stage's list once the whole journal has been replayed
+            self.index.pop((record['calendarID'], record['eventID']), None)
+        elif kind == 'drop':
+            stage = stages.pop(record['stage'], None)
+            if stage is not None:
+                for pair in stage.events:
+                    # Like dropStage(), events added to a later stage again stay in the history
+                    if self.index.get(pair.key) is stage:
+                        del self.index[pair.key]
+
+    def reindex(self) -> None:
+        """Rebuild the lookup index from the stages."""
+        self.index = {pair.key: stage for stage in self.stages for pair in stage.events}
 
     def save(self) -> None:
-        """Save data to the undo history file."""
+        """Compact the undo history file, replacing it atomically with only the records still needed."""
         logger.info('Saving to undo history file.')
-        with open(self.file, 'w') as file:
-            file.write(jsonpickle.encode(self.stages, indent=4))
+        self.close()
+        temporary = self.file + '.tmp'
+        with open(temporary, 'w') as file:
+            records = 0
+            for stage in reversed(self.stages):
+                for record in stage.records():
+                    file.write(json.dumps(record) + '\n')
+                    records += 1
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.file)
+        self.records = records
+
+    def append(self, *records: dict) -> None:
+        """Append records to the journal, compacting it if too many records have become obsolete."""
+        if self._journal is None:
+            self._journal = open(self.file, 'a')
+            # Never continue a record that was only partially written before a crash
+            if self._journal.tell() > 0:
+                with open(self.file, 'rb') as file:
+                    file.seek(-1, os.SEEK_END)
+                    if file.read(1) != b'\n':
+                        self._journal.write('\n')
+        for record in records:
+            self._journal.write(json.dumps(record) + '\n')
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self.records += len(records)
+
+        live = len(self.stages) + len(self.index)
+        if self.records - live > max(COMPACT_THRESHOLD, live):
+            self.save()
+
+    def close(self) -> None:
+        """Close the journal file if it is open."""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
 
     def getTotal(self) -> int:
         """Returns the total number of undoable events known."""
-        return sum(len(stage) for stage in self.stages)
+        return len(self.index)
 
-    def exists(self, eventID: 'IDPair') -> int:
+    def exists(self, eventID: Union['IDPair', Tuple[str, str]]) -> int:
         """Check if a given Event ID exists anywhere in the undo history data. Returns the stage index or -1 if it wasn't found."""
-        for stage in self.stages:
-            for undoable in stage.events:
-                if eventID == undoable.eventID:
-                    logger.debug(f'Found Event {eventID} in Stage {stage.index}')
-                    return stage.index
-        return -1
+        key = eventID.key if type(eventID) is IDPair else eventID
+        stage = self.index.get(key)
+        return -1 if stage is None else stage.index
 
     def all_pairs(self) -> Iterator['IDPair']:
         """Generator for every IDPair object within the master HistoryManager"""
@@ -56,6 +193,26 @@ class HistoryManager(object):
         """Returns the number of stages"""
         return len(self.stages)
 
+    def eventIDs(self, calendarID: str) -> Set[str]:
+        """The IDs of every event in the history that belongs to the given calendar."""
+        with self.lock:
+            return {eventID for pairCalendarID, eventID in self.index if pairCalendarID == calendarID}
+
+    def sending(self, calendarID: str, eventIDs: Iterable[str]) -> None:
+        """Marks events as being created, so they aren't pruned while a batch is only partly created."""
+        eventIDs = set(eventIDs)
+        with self.lock:
+            self.inflight.setdefault(calendarID, set()).update(eventIDs)
+            # Prunes in progress may already have found them missing, before they were created
+            for pruneCalendarID, candidates in self.pruning:
+                if pruneCalendarID == calendarID:
+                    candidates.difference_update(eventIDs)
+
+    def sent(self, calendarID: str, eventIDs: Iterable[str]) -> None:
+        """Marks events as no longer being created, whether or not that succeeded."""
+        with self.lock:
+            self.inflight.get(calendarID, set()).difference_update(eventIDs)
+
     def nextIndex(self):
         """Gets the next index (for a new stage)"""
         if len(self.stages) == 0:
@@ -65,15 +222,123 @@ class HistoryManager(object):
     def addStage(self, newStage: 'Stage'):
         """Adds and inserts a new Stage at the start of the history."""
         logger.debug(f'Adding new stage with {len(newStage)} events.')
-        self.stages.insert(0, newStage)
-        self.save()
+        with self.lock:
+            self.stages.insert(0, newStage)
+            for pair in newStage.events:
+                self.index[pair.key] = newStage
+            self.append(*newStage.records())
+
+    def addEvents(self, stage: 'Stage', pairs: Iterable['IDPair']) -> None:
+        """Adds events to a Stage that is already part of the history."""
+        pairs = list(pairs)
+        with self.lock:
+            stage.events.extend(pairs)
+            for pair in pairs:
+                self.index[pair.key] = stage
+            self.append(*(pair.record(stage.index) for pair in pairs))
+
+    def removeEvents(self, pairs: Iterable['IDPair']) -> None:
+        """Removes events from whichever stages they are in."""
+        removed: Dict[int, Stage] = {}
+        records = []
+        with self.lock:
+            for pair in pairs:
+                stage = self.index.pop(pair.key, None)
+                if stage is not None:
+                    removed[id(stage)] = stage
+                    records.append({'type': 'remove', 'calendarID': pair.calendarID, 'eventID': pair.eventID})
+
+            for stage in removed.values():
+                stage.events = [pair for pair in stage.events if pair.key in self.index]
+            if len(records) > 0:
+                self.append(*records)
 
-    def verify(self, calendarID: str, known_events: List[Any]) -> None:
-        """Given a calendar ID and a list of events from this calendar, make sure there are no IDPairs in storage that no longer exist any more."""
-        pass
+    def verify(self, calendarID: str, known_events: List[Any], calendar: Optional['api.Calendar'] = None) -> int:
+        """Given a calendar ID and a list of events from this calendar, make sure there are no IDPairs in storage that no longer exist any more.
 
-    def collapse(self) -> None:
-        pass
+        Occurrences keep their recurring event alive. If a Calendar is given, events missing from the list are only
+        removed once batched requests confirm they are gone, as they may have been created after the list was
+        fetched. Returns the number of pairs removed."""
+        live = {item['id'] for item in known_events}
+        live.update(item['recurringEventId'] for item in known_events if 'recurringEventId' in item)
+        with self.lock:
+            candidates = [eventID for pairCalendarID, eventID in self.index if pairCalendarID == calendarID and eventID not in live]
+        return self.prune(calendarID, candidates, calendar)
+
+    def prune(self, calendarID: str, eventIDs: Iterable[str], calendar: Optional['api.Calendar'] = None) -> int:
+        """Removes the pairs of the given events from a calendar, after confirming they are gone with batched requests
+        if a Calendar is given. Events being created are skipped. Returns the number of pairs removed.
+
+        The lock is not held during the requests, so events sent while they are made are dropped from the candidates."""
+        with self.lock:
+            inflight = self.inflight.get(calendarID, set())
+            candidates = {eventID for eventID in eventIDs if (calendarID, eventID) in self.index and eventID not in inflight}
+            claim = (calendarID, candidates)
+            self.pruning.append(claim)
+        try:
+            missing = candidates
+            if calendar is not None and len(candidates) > 0:
+                missing = calendar.missingEvents(calendarID, sorted(candidates))
+        finally:
+            with self.lock:
+                self.pruning.remove(claim)
+
+        with self.lock:
+            inflight = self.inflight.get(calendarID, set())
+            eventIDs = [eventID for eventID in sorted(missing) if eventID in candidates and eventID not in inflight
+                        and (calendarID, eventID) in self.index]
+            self.removeEvents(IDPair(calendarID, eventID) for eventID in eventIDs)
+            return len(eventIDs)
+
+    def reconcile(self, calendar: 'api.Calendar', calendarID: str) -> int:
+        """Prunes pairs of events that were deleted outside of this application, then collapses the history.
+
+        Only what changed since the last call is checked: the events the calendar's incremental syncs reported as
+        deleted, or after a full sync, the pairs whose events were not part of it. Returns the number of pairs removed."""
+        store = calendar.stores.get(calendarID)
+        if store is None:
+            return 0
+        with store.lock:
+            resynced, deleted = store.drain()
+            known = list(store.events.values()) if resynced else None
+
+        if resynced:
+            removed = self.verify(calendarID, known, calendar)
+        else:
+            # Occurrences of a recurring event are named after it, its remaining occurrences may keep it alive
+            candidates = deleted | {eventID.rsplit('_', 1)[0] for eventID in deleted if '_' in eventID}
+            removed = self.prune(calendarID, sorted(candidates), calendar)
+        collapsed = self.collapse()
+        if removed > 0 or collapsed > 0:
+            logger.info(f'Removed {removed} deleted events and {collapsed} stages from the undo history')
+        return removed
+
+    def collapse(self) -> int:
+        """Drops empty stages and merges runs of small stages for the same calendar into the newest of them.
+
+        The latest stage of each calendar is never touched, so undoing the last submission always undoes exactly
+        that submission (which may still be in progress). Returns the number of stages removed."""
+        removed = 0
+        with self.lock:
+            seen = set()
+            target: Optional[Stage] = None  # The newest small stage of the current run
+            for stage in list(self.stages):
+                if stage.commonCalendar not in seen:
+                    seen.add(stage.commonCalendar)
+                    target = None
+                elif len(stage) == 0:
+                    self.dropStage(stage)
+                    removed += 1
+                elif len(stage) >= COLLAPSE_SIZE:
+                    target = None
+                elif target is not None and target.commonCalendar == stage.commonCalendar:
+                    pairs = list(stage.events)
+                    self.dropStage(stage)
+                    self.addEvents(target, pairs)
+                    removed += 1
+                else:
+                    target = stage
+        return removed
 
 
 class Stage(object):
@@ -82,6 +347,12 @@ class Stage(object):
         self.commonCalendar = commonCalendar
         self.events: List[IDPair] = []
 
+    def records(self) -> Iterator[dict]:
+        """Journal records that recreate this stage."""
+        yield {'type': 'stage', 'stage': self.index, 'calendarID': self.commonCalendar}
+        for pair in self.events:
+            yield pair.record(self.index)
+
     def __contains__(self, item) -> bool:
         if type(item) is IDPair:
             return item in self.events
@@ -96,10 +367,19 @@ class IDPair(object):
     def __init__(self, calendarID: str, eventID: str) -> None:
         self.calendarID, self.eventID = calendarID, eventID
 
+    @property
+    def key(self) -> Tuple[str, str]:
+        """The tuple used to index this pair."""
+        return self.calendarID, self.eventID
+
+    def record(self, stage: int) -> dict:
+        """A journal record adding this pair to a stage."""
+        return {'type': 'event', 'stage': stage, 'calendarID': self.calendarID, 'eventID': self.eventID}
+
     def __eq__(self, other):
         """Check equality between two IDPair objects or two item tuple."""
         if type(other) is IDPair:
-            return self.calendarID == other.calendarID and self.eventID == other.calendarID
+            return self.calendarID == other.calendarID and self.eventID == other.eventID
         elif type(other) is tuple:
             return len(other) == 2 and other == (self.calendarID, self.eventID)
         return False
@@ -0,0 +1,54 @@
+import datetime
+import logging
+from typing import Iterable, List, Tuple
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+WINDOW_LENGTH = datetime.timedelta(days=30)
+MAX_HORIZON = datetime.timedelta(days=5 * 365)  # How far ahead windows are loaded when it is unknown where events end
+MAX_CACHED_WINDOWS = 24  # Windows fetched from the API that are kept in memory, across all calendars
+
+
+class EventWindows(object):
+    """Tracks which consecutive time windows of a calendar's future events are shown, starting from when the calendar
+    was first viewed. Windows have fixed bounds, so a window fetched once can be cached by its key."""
+
+    def __init__(self, calendarID: str, length: datetime.timedelta = WINDOW_LENGTH) -> None:
+        self.calendarID = calendarID
+        self.anchor = datetime.datetime.now(datetime.timezone.utc)
+        self.length = length
+        self.count = 1  # Number of windows shown
+        self.until = self.anchor + MAX_HORIZON  # No windows are loaded past this
+
+    def bounds(self, index: int) -> Tuple[datetime.datetime, datetime.datetime]:
+        """The start and end of a window."""
+        start = self.anchor + self.length * index
+        return start, start + self.length
+
+    def key(self, index: int) -> Tuple[str, datetime.datetime]:
+        return self.calendarID, self.bounds(index)[0]
+
+    @property
+    def horizon(self) -> datetime.datetime:
+        """The end of the last window shown."""
+        return self.bounds(self.count - 1)[1]
+
+    @property
+    def complete(self) -> bool:
+        """Whether every window that may contain events is shown."""
+        return self.horizon >= self.until
+
+
+def merge(windows: Iterable[List[dict]]) -> List[dict]:
+    """Concatenates consecutive windows of events. Events spanning the boundary of two windows are listed by both, so
+    only their first appearance is kept."""
+    seen = set()
+    merged = []
+    for items in windows:
+        for item in items:
+            if item['id'] not in seen:
+                seen.add(item['id'])
+                merged.append(item)
+    return merged
+
@@ -0,0 +1,84 @@
+import logging
+from types import GeneratorType
+from typing import Any, Callable, Optional, Set
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+MAX_WORKERS = 4
+
+
+class WorkerSignals(QObject):
+    """Signals emitted by a Worker. They are delivered to the GUI thread through queued connections."""
+    result = pyqtSignal(object)
+    error = pyqtSignal(object)
+    finished = pyqtSignal()
+
+
+class Worker(QRunnable):
+    """Runs a function on a pool thread. If the function returns a generator, every item is emitted as it is produced."""
+
+    def __init__(self, fn: Callable, *args, **kwargs) -> None:
+        super(Worker, self).__init__()
+        self.fn, self.args, self.kwargs = fn, args, kwargs
+        self.signals = WorkerSignals()
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        """Stop the worker before it emits the next item. Work already in flight is allowed to finish."""
+        self.cancelled = True
+
+    def run(self) -> None:
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+            if isinstance(result, GeneratorType):
+                for item in result:
+                    if self.cancelled:
+                        logger.info(f'Worker for {self.fn.__name__} cancelled')
+                        result.close()
+                        break
+                    self.signals.result.emit(item)
+            elif not self.cancelled:
+                self.signals.result.emit(result)
+        except BaseException as e:
+            logger.error(f'Worker for {self.fn.__name__} failed', exc_info=e)
+            self.signals.error.emit(e)
+        finally:
+            self.signals.finished.emit()
+
+
+class WorkerPool(object):
+    """A bounded pool of worker threads for running Calendar API calls off the GUI thread."""
+
+    def __init__(self, maxThreads: int = MAX_WORKERS) -> None:
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(maxThreads)
+        self.active: Set[Worker] = set()
+
+    def start(self, fn: Callable, *args, result: Optional[Callable[[Any], None]] = None,
+              error: Optional[Callable[[BaseException], None]] = None,
+              finished: Optional[Callable[[], None]] = None, **kwargs) -> Worker:
+        """Queue a function to be run with the given callbacks connected to the worker's signals."""
+        worker = Worker(fn, *args, **kwargs)
+        if result is not None:
+            worker.signals.result.connect(result)
+        if error is not None:
+            worker.signals.error.connect(error)
+        if finished is not None:
+            worker.signals.finished.connect(finished)
+        worker.signals.finished.connect(lambda: self.active.discard(worker))
+
+        self.active.add(worker)
+        self.pool.start(worker)
+        return worker
+
+    def cancelAll(self) -> None:
+        """Cancel every worker that is queued or running."""
+        for worker in list(self.active):
+            worker.cancel()
+
+    def __len__(self) -> int:
+        """Returns the number of workers that have not finished yet."""
+        return len(self.active)
@@ -1,6 +1,9 @@
-from PyQt5.QtWidgets import QApplication
+from bulk_reminders.timing import startup
 
-from bulk_reminders.gui import MainWindow
+with startup.phase('imports'):
+    from PyQt5.QtWidgets import QApplication
+
+    from bulk_reminders.gui import MainWindow
 
 if __name__ == '__main__':
     app = QApplication([])